@@ -0,0 +1,226 @@
+"""
+Headless batch report generation.
+
+Usage:
+    python batch.py CASES_DIR [--output-dir DIR] [--workers N] [--pdf-workers N]
+
+Every sub-folder of CASES_DIR is one client case (layout: see pipeline.py). Cases run in
+parallel across a pool of worker processes; each writes
+
+    <output-dir>/<case>/Generated_Report.docx
+    <output-dir>/<case>/report.log          progress, warnings and errors of that case
+    <output-dir>/<case>/trace.jsonl         one line per traced call (see tracing.py)
+
+and a throughput summary (cases/hour, per-case and per-stage timings, p50/p95 per traced
+call) is printed and saved to <output-dir>/summary.json, with the same traces in
+Prometheus text format in <output-dir>/metrics.prom. The exit code is 1 when any case failed to produce a report.
+
+The OpenAI key comes from OPENAI_API_KEY. Cases share the on-disk LLM response and PDF
+page caches, so re-running a batch only pays for what changed.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import statistics
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import tracing
+
+DEFAULT_OUTPUT_DIR = os.path.join("generated_docs", "batch")
+DEFAULT_WORKERS = min(4, os.cpu_count() or 1)
+LOG_FORMAT = "%(asctime)s %(levelname)s %(message)s"
+TRACE_FILE_NAME = "trace.jsonl"
+
+
+def find_cases(cases_dir):
+    """Case folders directly under cases_dir, sorted by name."""
+    return [
+        os.path.join(cases_dir, name) for name in sorted(os.listdir(cases_dir))
+        if os.path.isdir(os.path.join(cases_dir, name)) and not name.startswith(".")
+    ]
+
+
+def _init_worker(pdf_workers):
+    """Case workers already run in parallel: cap the per-case PDF/OCR pool to avoid oversubscription."""
+    from scheduler import set_process_pool_workers
+
+    set_process_pool_workers(pdf_workers)
+
+
+def run_case(case_dir, output_dir):
+    """
+    Worker: generate the report of one case folder, logging to <output_dir>/<case>/report.log.
+
+    Returns:
+    - dict: name, ok, seconds, output_path, errors, warnings, stage_seconds and (on failure) error.
+    """
+    from pipeline import Case, REPORT_FILE_NAME, generate_report
+
+    trace_path = os.path.join(output_dir, os.path.basename(os.path.normpath(case_dir)), TRACE_FILE_NAME)
+    if os.path.exists(trace_path):
+        os.remove(trace_path)  # the trace of a previous batch run
+
+    name = os.path.basename(os.path.normpath(case_dir))
+    case_output_dir = os.path.join(output_dir, name)
+    os.makedirs(case_output_dir, exist_ok=True)
+
+    # One case at a time per worker process, so the root logger can carry this case's log
+    handler = logging.FileHandler(os.path.join(case_output_dir, "report.log"), mode="w", encoding="utf-8")
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    root = logging.getLogger()
+    root.addHandler(handler)
+    case_log = logging.getLogger("batch.case")
+    case_log.setLevel(logging.INFO)
+
+    def progress(stage, level, message):
+        # Errors and warnings are already logged by the pipeline itself
+        if level not in ("error", "warning"):
+            case_log.info("[%s] %s%s", stage, level, f": {message}" if message else "")
+
+    start = time.perf_counter()
+    summary = {"name": name, "ok": False, "output_path": None, "errors": 0, "warnings": 0, "stage_seconds": {}}
+    try:
+        case_log.info("Case %s", case_dir)
+        result = generate_report(
+            Case.from_directory(case_dir), os.path.join(case_output_dir, REPORT_FILE_NAME),
+            progress=progress, trace_path=trace_path,
+        )
+        summary.update(
+            ok=True,
+            output_path=result.output_path,
+            errors=result.error_count,
+            warnings=sum(1 for _, level, _ in result.messages if level == "warning"),
+            stage_seconds={stage: round(sec, 3) for stage, sec in result.stage_seconds.items()},
+        )
+    except Exception as e:
+        case_log.error("Case failed: %r\n%s", e, traceback.format_exc())
+        summary["error"] = repr(e)
+    finally:
+        summary["seconds"] = round(time.perf_counter() - start, 3)
+        case_log.info("Finished in %.1fs (ok=%s)", summary["seconds"], summary["ok"])
+        root.removeHandler(handler)
+        handler.close()
+    return summary
+
+
+def _percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarise(case_results, wall_seconds, workers):
+    """Throughput report of a batch run."""
+    durations = sorted(r["seconds"] for r in case_results)
+    stage_totals = {}
+    for result in case_results:
+        for stage, seconds in result.get("stage_seconds", {}).items():
+            stage_totals[stage] = stage_totals.get(stage, 0.0) + seconds
+    completed = [r for r in case_results if r["ok"]]
+    return {
+        "cases": len(case_results),
+        "succeeded": len(completed),
+        "failed": len(case_results) - len(completed),
+        "with_section_errors": sum(1 for r in completed if r["errors"]),
+        "workers": workers,
+        "wall_seconds": round(wall_seconds, 3),
+        "cases_per_hour": round(3600 * len(completed) / wall_seconds, 1) if wall_seconds > 0 else None,
+        "case_seconds": {
+            "mean": round(statistics.mean(durations), 3),
+            "p50": _percentile(durations, 0.50),
+            "p95": _percentile(durations, 0.95),
+            "max": durations[-1],
+        } if durations else {},
+        # Summed over cases; stages inside one case overlap, so these exceed the case times
+        "stage_seconds": {stage: round(sec, 3) for stage, sec in sorted(stage_totals.items(), key=lambda kv: -kv[1])},
+        "results": sorted(case_results, key=lambda r: r["name"]),
+    }
+
+
+def run_batch(cases_dir, output_dir=DEFAULT_OUTPUT_DIR, workers=DEFAULT_WORKERS, pdf_workers=1, on_result=None):
+    """
+    Generate the report of every case folder under cases_dir.
+
+    Args:
+    - cases_dir (str): Directory of case folders.
+    - output_dir (str): Where reports, per-case logs and summary.json go.
+    - workers (int): Cases processed at once (1 runs them in this process).
+    - pdf_workers (int): PDF/OCR processes each case may use.
+    - on_result (callable): Called with each case's summary dict as it finishes.
+
+    Returns:
+    - dict: The throughput summary (see summarise).
+    """
+    case_dirs = find_cases(cases_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    start = time.perf_counter()
+    case_results = []
+
+    if workers <= 1:
+        for case_dir in case_dirs:
+            case_results.append(run_case(case_dir, output_dir))
+            if on_result:
+                on_result(case_results[-1])
+    else:
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=context, initializer=_init_worker, initargs=(pdf_workers,)
+        ) as pool:
+            futures = {pool.submit(run_case, case_dir, output_dir): case_dir for case_dir in case_dirs}
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as e:  # worker process died
+                    name = os.path.basename(os.path.normpath(futures[future]))
+                    result = {"name": name, "ok": False, "seconds": 0.0, "errors": 0, "warnings": 0,
+                              "stage_seconds": {}, "error": repr(e)}
+                case_results.append(result)
+                if on_result:
+                    on_result(result)
+
+    summary = summarise(case_results, time.perf_counter() - start, workers)
+    trace_paths = [
+        os.path.join(output_dir, result["name"], TRACE_FILE_NAME) for result in case_results
+        if os.path.exists(os.path.join(output_dir, result["name"], TRACE_FILE_NAME))
+    ]
+    spans = tracing.read_jsonl(*trace_paths)
+    summary["spans"] = tracing.summarise(spans)
+    with open(os.path.join(output_dir, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2)
+    with open(os.path.join(output_dir, "metrics.prom"), "w", encoding="utf-8") as f:
+        f.write(tracing.prometheus_text(spans))
+    return summary
+
+
+def _print_result(result):
+    status = "ok" if result["ok"] else "FAILED"
+    detail = f"{result['errors']} section errors" if result["ok"] else result.get("error", "")
+    print(f"{result['name']:<30} {status:<7} {result['seconds']:>8.1f}s  {detail}", flush=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("cases_dir", help="Directory containing one folder per case")
+    parser.add_argument("--output-dir", default=DEFAULT_OUTPUT_DIR, help="Where reports and logs are written")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Cases processed in parallel")
+    parser.add_argument("--pdf-workers", type=int, default=1, help="PDF/OCR processes per case worker")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.cases_dir):
+        parser.error(f"not a directory: {args.cases_dir}")
+    logging.basicConfig(level=logging.WARNING, format=LOG_FORMAT)
+    for handler in logging.getLogger().handlers:
+        handler.setLevel(logging.WARNING)  # per-case progress goes to the case logs only
+
+    summary = run_batch(args.cases_dir, args.output_dir, args.workers, args.pdf_workers, on_result=_print_result)
+    print(json.dumps({k: v for k, v in summary.items() if k not in ("results", "spans")}, indent=2))
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
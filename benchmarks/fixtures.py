@@ -0,0 +1,195 @@
+"""
+Synthetic case folders for the offline benchmarks (layout: see pipeline.py).
+
+Usage (from the repository root):
+    python -m benchmarks.fixtures OUT_DIR --plans 3 --funds 40
+
+A case holds a template .docx with every report placeholder, a FactFind PDF, risk profile
+and annuity quote images, N plan reports, client and Dark Star fact sheets, a SAP report,
+and up to 40 fund PDFs plus P1. Content is plausible filler: the stub OpenAI server
+(benchmarks/stub_openai.py) answers from canned responses, so only sizes and counts matter.
+PDFs are written directly (text-only Helvetica pages), so no PDF library is needed.
+"""
+import argparse
+import os
+import random
+import sys
+
+MAX_FUNDS = 40
+
+TEMPLATE_PARAGRAPHS = (
+    "{Today’s date}",
+    "{Full name}",
+    "{Address}",
+    "{salutation}",
+    "Your Current Situation",
+    "{Current_Situation}",
+    "Priorities and Objectives",
+    "{Priorities_and_Objectives}",
+    "Attitude to Risk",
+    "{Attitude_to_Risk}",
+    "Your Existing Plans",
+    "{table1}",
+    "{Review of Existing Royal London Personal Pension}",
+    "{Investment_holdings}",
+    "Fund Performance",
+    "{table2-1}",
+    "{Last_Year_Performance}",
+    "{table2-2}",
+    "Switching Analysis",
+    "{table3-1}",
+    "Annuity Quotes",
+    "{Annuity_Quotes}",
+    "Fund Comparison",
+    "{Fund_Comparison}",
+    "Inheritance Tax",
+    "{IHT_Text}",
+    "Safe Withdrawal Rate",
+    "{Safe Withdrawal Rate (SWR)}",
+)
+
+FILLER = (
+    "The value of your plan as at the review date is shown below together with the funds held.",
+    "Charges are deducted monthly from the value of the plan and include the fund and platform charges.",
+    "Past performance is not a reliable indicator of future results and values can fall as well as rise.",
+    "Your selected retirement age and the projected values assume growth rates of 2%, 5% and 8% a year.",
+    "Fees and charges: equivalent to 0.44% of the value of your plan each year.",
+    "Review dates: 01/04/2024 to 31/03/2025 Plan value £210,000.00",
+)
+
+
+def write_pdf(path, pages):
+    """Write a text-only PDF: pages is a list of lists of lines."""
+    objects = [b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>", None]  # font, page tree
+    kids = []
+    for lines in pages:
+        ops = ["BT /F1 10 Tf 50 790 Td 13 TL"]
+        for line in lines:
+            line = line.encode("latin-1", "replace").decode("latin-1")
+            ops.append("(" + line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") + ") Tj T*")
+        ops.append("ET")
+        stream = "\n".join(ops).encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 1 0 R >> >>"
+            f" /Contents {len(objects)} 0 R >>".encode()
+        )
+        kids.append(len(objects))
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(f'{k} 0 R' for k in kids)}] /Count {len(kids)} >>".encode()
+    objects.append(b"<< /Type /Catalog /Pages 2 0 R >>")
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n".encode() + body + b"\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += b"".join(f"{offset:010d} 00000 n \n".encode() for offset in offsets)
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root {len(objects)} 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def write_text_image(path, lines):
+    """Render lines of text onto a white PNG, like a clean scan."""
+    from PIL import Image, ImageDraw
+
+    image = Image.new("L", (1240, 60 + 36 * len(lines)), 255)
+    draw = ImageDraw.Draw(image)
+    for idx, line in enumerate(lines):
+        draw.text((60, 30 + 36 * idx), line, fill=0)
+    image.save(path)
+
+
+def write_template(path):
+    from docx import Document
+
+    document = Document()
+    for text in TEMPLATE_PARAGRAPHS:
+        document.add_paragraph(text)
+    document.save(path)
+
+
+def _pages(rng, title, page_count, lines_per_page=45):
+    pages = []
+    for page in range(page_count):
+        lines = [f"{title} - page {page + 1}"]
+        lines += [rng.choice(FILLER) for _ in range(lines_per_page)]
+        pages.append(lines)
+    return pages
+
+
+def _write(root, folder, name, writer, *args):
+    directory = os.path.join(root, folder) if folder else root
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name)
+    writer(path, *args)
+    return path
+
+
+def make_case(root, plans=2, funds=5, fact_sheets=2, dark_star=1, sap=1, risk_images=2, annuity_images=2,
+              pages=3, seed=0):
+    """
+    Write one synthetic case folder.
+
+    Args:
+    - root (str): Case folder to create.
+    - plans, fact_sheets, dark_star, sap (int): Number of PDFs of each kind.
+    - funds (int): Funds compared against P1 (at most MAX_FUNDS), one PDF each.
+    - risk_images, annuity_images (int): Images to OCR (0 writes the risk profile as a PDF instead).
+    - pages (int): Pages per plan report / fact sheet.
+    - seed (int): Filler text seed.
+
+    Returns:
+    - str: root
+    """
+    rng = random.Random(seed)
+    funds = min(funds, MAX_FUNDS)
+    os.makedirs(root, exist_ok=True)
+    _write(root, "", "template.docx", write_template)
+    _write(root, "", "factfind.pdf", write_pdf, _pages(rng, "FactFind - John Smith, age 64", 6))
+    if risk_images:
+        for idx in range(risk_images):
+            _write(root, "risk", f"risk_{idx + 1}.png", write_text_image,
+                   ["Risk Level 3", "Risk Type: Balanced", "Definition of Balanced: You are comfortable with some risk."])
+    else:
+        _write(root, "risk", "risk.pdf", write_pdf, [["Risk Level 3 Risk Type: Balanced"]])
+    for idx in range(plans):
+        _write(root, "plans", f"plan_{idx + 1}.pdf", write_pdf, _pages(rng, f"Royal London plan RL{100000 + idx}", pages))
+    for idx in range(fact_sheets):
+        _write(root, "fact_sheets", f"fact_sheet_{idx + 1}.pdf", write_pdf, _pages(rng, f"Fund fact sheet {idx + 1}", pages))
+    for idx in range(dark_star):
+        _write(root, "dark_star", f"dark_star_{idx + 1}.pdf", write_pdf, _pages(rng, "Dark Star Balanced Plus", 2))
+    for idx in range(sap):
+        _write(root, "sap", f"sap_{idx + 1}.pdf", write_pdf, _pages(rng, "Comparison at Age 75", 2))
+    for idx in range(annuity_images):
+        _write(root, "annuity", f"quote_{idx + 1}.png", write_text_image,
+               ["Your Income", "GBP 124,030 pension pot", "GBP 854 monthly", "GBP 10,250 yearly", "No annual increase"])
+    for idx in range(funds):
+        _write(root, os.path.join("funds", str(idx + 1)), f"fund_{idx + 1}.pdf", write_pdf,
+               _pages(rng, f"Fund {idx + 1} costs and charges", 2))
+    if funds:
+        _write(root, "p1", "p1.pdf", write_pdf, _pages(rng, "P1 benchmark fund", 2))
+    return root
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("out_dir", help="Folder to create the case folders in")
+    parser.add_argument("--cases", type=int, default=1)
+    parser.add_argument("--plans", type=int, default=2)
+    parser.add_argument("--funds", type=int, default=5, help=f"Funds to compare (max {MAX_FUNDS})")
+    parser.add_argument("--no-images", action="store_true", help="No OCR inputs (risk profile as PDF, no annuity quotes)")
+    args = parser.parse_args(argv)
+
+    for idx in range(args.cases):
+        images = 0 if args.no_images else 2
+        path = make_case(os.path.join(args.out_dir, f"case_{idx + 1}"), plans=args.plans, funds=args.funds,
+                         risk_images=images, annuity_images=images, seed=idx)
+        print(path)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+"""
+Import-time budget for logic.py (and the modules pool workers import).
+
+Usage (from the repository root):
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time --budget-ms 150 --runs 7
+
+Each module is imported in a fresh interpreter under `python -X importtime`, without an
+OpenAI key in the environment. The check fails (exit code 1) when the median cumulative
+import time is over budget, when the import raises, or when any heavy backend is loaded
+eagerly. Run it in CI next to compileall to catch import-time regressions.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BUDGET_MS = float(os.getenv("IMPORT_TIME_BUDGET_MS", "200"))
+DEFAULT_MODULES = ("logic", "pipeline", "pdf_text", "ocr")
+# Must only load on first use, never at import time
+HEAVY_MODULES = (
+    "streamlit", "docx", "pdfplumber", "pdfminer", "pytesseract", "PIL",
+    "cv2", "numpy", "openai", "mammoth", "pandas",
+)
+
+_PROBE = """
+import json, sys
+import {module}
+heavy = sorted(name for name in {heavy!r} if name in sys.modules)
+print(json.dumps(heavy))
+"""
+
+
+def measure_import(module, python=sys.executable):
+    """
+    Import a module in a fresh interpreter.
+
+    Returns:
+    - tuple: (cumulative import time in ms, heavy modules that got loaded)
+    """
+    env = dict(os.environ)
+    env.pop("OPENAI_API_KEY", None)
+    env["PYTHONPATH"] = REPO_ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    proc = subprocess.run(
+        [python, "-X", "importtime", "-c", _PROBE.format(module=module, heavy=HEAVY_MODULES)],
+        capture_output=True, text=True, env=env, cwd=REPO_ROOT,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr[-2000:]}")
+    cumulative_us = None
+    for line in proc.stderr.splitlines():
+        # "import time:      self [us] | cumulative | imported package"
+        parts = line.split("|")
+        if len(parts) == 3 and parts[2].strip() == module:
+            cumulative_us = int(parts[1].strip())
+    if cumulative_us is None:
+        raise RuntimeError(f"no importtime line for {module}")
+    return cumulative_us / 1000.0, json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def check(modules=DEFAULT_MODULES, budget_ms=DEFAULT_BUDGET_MS, runs=5):
+    """Measure every module; returns (report dict, list of failure messages)."""
+    report = {}
+    failures = []
+    for module in modules:
+        try:
+            samples = [measure_import(module) for _ in range(runs)]
+        except RuntimeError as e:
+            failures.append(str(e))
+            continue
+        median_ms = statistics.median(ms for ms, _ in samples)
+        heavy = sorted({name for _, loaded in samples for name in loaded})
+        report[module] = {"median_ms": round(median_ms, 1), "budget_ms": budget_ms, "heavy_modules": heavy}
+        if median_ms > budget_ms:
+            failures.append(f"{module}: import takes {median_ms:.1f} ms, budget is {budget_ms:.0f} ms")
+        if heavy:
+            failures.append(f"{module}: eagerly imports {', '.join(heavy)}")
+    return report, failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS, help="Per-module import budget")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per module (median is used)")
+    parser.add_argument("modules", nargs="*", default=list(DEFAULT_MODULES))
+    args = parser.parse_args(argv)
+
+    report, failures = check(args.modules, args.budget_ms, args.runs)
+    print(json.dumps(report, indent=2))
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,101 @@
+"""
+Benchmark: per-image OCR latency of the persistent tesserocr engine vs pytesseract subprocesses.
+
+Usage (from the repository root):
+    python -m benchmarks.ocr_backends --synthetic 20
+    python -m benchmarks.ocr_backends --images path/to/photos --backends pytesseract
+
+Every image is preprocessed once up front (see image_preprocessing) so only OCR is timed.
+The first tesserocr call includes loading the language data; it is reported separately
+as "warmup_ms" and excluded from the per-image figures.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+from PIL import Image
+
+from benchmarks.ocr_preprocessing import character_accuracy, make_synthetic_photo
+from image_preprocessing import preprocess_for_ocr
+from ocr import get_backend
+
+
+def load_cases(images_dir=None, synthetic=0):
+    """list of (name, preprocessed PIL image, expected text or None)."""
+    cases = []
+    if images_dir:
+        for path in sorted(glob.glob(os.path.join(images_dir, "*"))):
+            if os.path.splitext(path)[1].lower() not in (".png", ".jpg", ".jpeg"):
+                continue
+            truth_path = os.path.splitext(path)[0] + ".txt"
+            expected = open(truth_path, encoding="utf-8").read() if os.path.exists(truth_path) else None
+            cases.append((os.path.basename(path), preprocess_for_ocr(Image.open(path)), expected))
+    for seed in range(synthetic):
+        image, expected = make_synthetic_photo(seed)
+        cases.append((f"synthetic-{seed}", preprocess_for_ocr(image), expected))
+    return cases
+
+
+def run_backend(name, cases):
+    """OCR every case with one backend. Returns per-image rows plus the warm-up time."""
+    start = time.perf_counter()
+    backend = get_backend(name)
+    warmup = time.perf_counter() - start
+
+    rows = []
+    for case_name, image, expected in cases:
+        start = time.perf_counter()
+        text = backend.ocr(image)
+        seconds = time.perf_counter() - start
+        row = {"backend": name, "image": case_name, "ms": round(1000 * seconds, 1)}
+        if expected is not None:
+            row["accuracy"] = round(character_accuracy(expected, text), 4)
+        rows.append(row)
+        print(json.dumps(row))
+    return rows, warmup
+
+
+def summarise(rows, warmup):
+    values = sorted(r["ms"] for r in rows)
+    summary = {
+        "images": len(values),
+        "warmup_ms": round(1000 * warmup, 1),
+        "total_ms": round(sum(values), 1),
+        "mean_ms": round(sum(values) / len(values), 1),
+        "p50_ms": values[len(values) // 2],
+        "p95_ms": values[min(len(values) - 1, int(0.95 * len(values)))],
+    }
+    scores = [r["accuracy"] for r in rows if "accuracy" in r]
+    if scores:
+        summary["mean_accuracy"] = round(sum(scores) / len(scores), 4)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", help="Directory of png/jpg images (optional .txt ground truth alongside)")
+    parser.add_argument("--synthetic", type=int, default=0, help="Number of synthetic phone photos to generate")
+    parser.add_argument("--backends", default="tesserocr,pytesseract", help="Comma-separated backends to compare")
+    args = parser.parse_args(argv)
+
+    cases = load_cases(args.images, args.synthetic)
+    if not cases:
+        parser.error("nothing to benchmark: pass --images and/or --synthetic N")
+
+    summary = {}
+    for name in [b.strip() for b in args.backends.split(",") if b.strip()]:
+        try:
+            rows, warmup = run_backend(name, cases)
+        except Exception as e:
+            summary[name] = {"error": repr(e)}
+            continue
+        summary[name] = summarise(rows, warmup)
+    print(json.dumps(summary, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,128 @@
+"""
+Benchmark: OCR wall time and character accuracy with vs without OpenCV preprocessing.
+
+Usage (from the repository root):
+    python -m benchmarks.ocr_preprocessing --images path/to/photos
+    python -m benchmarks.ocr_preprocessing --synthetic 5
+
+With --images, every image may have a ground-truth transcript next to it (same name, .txt);
+images without one are timed but not scored. --synthetic renders quote-like pages with known
+text, then degrades them like a phone photo (12MP, skewed, low contrast, noisy).
+"""
+import argparse
+import difflib
+import glob
+import json
+import os
+import random
+import sys
+import time
+
+from PIL import Image, ImageDraw, ImageEnhance, ImageFont
+
+from image_preprocessing import preprocess_for_ocr
+from ocr import ocr_image
+
+# Plain ASCII: Pillow's built-in font has no "£" glyph
+SYNTHETIC_LINES = [
+    "Your Income",
+    "GBP 124,030 pension pot",
+    "GBP 854 monthly",
+    "GBP 10,250 yearly",
+    "Your Choices",
+    "No annual increase",
+    "Guaranteed period 5 years",
+    "Risk Level 3 Risk Type: Balanced",
+    "Definition of Balanced: You are comfortable with some risk.",
+]
+
+
+def character_accuracy(expected, actual):
+    """Similarity of two transcripts after whitespace normalisation (1.0 = identical)."""
+    expected = " ".join(expected.split())
+    actual = " ".join(actual.split())
+    if not expected:
+        return 1.0 if not actual else 0.0
+    return difflib.SequenceMatcher(None, expected, actual, autojunk=False).ratio()
+
+
+def make_synthetic_photo(seed, lines=SYNTHETIC_LINES):
+    """Render known text on an A4 page, then rotate, upscale to ~12MP, dim and add noise."""
+    rng = random.Random(seed)
+    page = Image.new("RGB", (2480, 3508), "white")
+    draw = ImageDraw.Draw(page)
+    try:
+        font = ImageFont.load_default(size=56)
+    except TypeError:  # Pillow < 10.1 has no sized default font
+        font = ImageFont.load_default()
+    for idx, line in enumerate(lines):
+        draw.text((220, 300 + idx * 120), line, fill="black", font=font)
+    photo = page.rotate(rng.uniform(-6, 6), expand=True, fillcolor=(235, 230, 220))
+    photo = photo.resize((3024, 4032))
+    photo = ImageEnhance.Contrast(photo).enhance(0.45)
+    noise = Image.effect_noise(photo.size, 40).convert("RGB")
+    photo = Image.blend(photo, noise, 0.12)
+    return photo, "\n".join(lines)
+
+
+def _timed_ocr(image, preprocess):
+    start = time.perf_counter()
+    if preprocess:
+        image = preprocess_for_ocr(image)
+    text = ocr_image(image)
+    return text, time.perf_counter() - start
+
+
+def run(cases):
+    """cases: list of (name, PIL image, expected text or None). Returns a result dict per case."""
+    results = []
+    for name, image, expected in cases:
+        row = {"image": name, "pixels": image.size[0] * image.size[1]}
+        for label, preprocess in (("raw", False), ("preprocessed", True)):
+            text, seconds = _timed_ocr(image, preprocess)
+            row[f"{label}_seconds"] = round(seconds, 3)
+            if expected is not None:
+                row[f"{label}_accuracy"] = round(character_accuracy(expected, text), 4)
+        results.append(row)
+        print(json.dumps(row))
+    return results
+
+
+def summarise(results):
+    summary = {}
+    for label in ("raw", "preprocessed"):
+        seconds = [r[f"{label}_seconds"] for r in results]
+        summary[f"{label}_total_seconds"] = round(sum(seconds), 3)
+        scores = [r[f"{label}_accuracy"] for r in results if f"{label}_accuracy" in r]
+        if scores:
+            summary[f"{label}_mean_accuracy"] = round(sum(scores) / len(scores), 4)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", help="Directory of png/jpg images (optional .txt ground truth alongside)")
+    parser.add_argument("--synthetic", type=int, default=0, help="Number of synthetic phone photos to generate")
+    args = parser.parse_args(argv)
+
+    cases = []
+    if args.images:
+        for path in sorted(glob.glob(os.path.join(args.images, "*"))):
+            if os.path.splitext(path)[1].lower() not in (".png", ".jpg", ".jpeg"):
+                continue
+            truth_path = os.path.splitext(path)[0] + ".txt"
+            expected = open(truth_path, encoding="utf-8").read() if os.path.exists(truth_path) else None
+            cases.append((os.path.basename(path), Image.open(path), expected))
+    for seed in range(args.synthetic):
+        image, expected = make_synthetic_photo(seed)
+        cases.append((f"synthetic-{seed}", image, expected))
+    if not cases:
+        parser.error("nothing to benchmark: pass --images and/or --synthetic N")
+
+    summary = summarise(run(cases))
+    print(json.dumps(summary, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
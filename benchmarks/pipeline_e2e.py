@@ -0,0 +1,273 @@
+"""
+Offline end-to-end benchmark of report generation: no API credit, no real documents.
+
+Usage (from the repository root):
+    python -m benchmarks.pipeline_e2e --scenario small --runs 3
+    python -m benchmarks.pipeline_e2e --scenario large --check          # compare with the baseline
+    python -m benchmarks.pipeline_e2e --scenario large --update-baseline
+
+A stub OpenAI server (benchmarks/stub_openai.py, --latency-ms/--jitter-ms) answers every
+chat call with a canned, schema-valid response, and a synthetic case (benchmarks/fixtures.py)
+is generated per scenario. Two flows are timed:
+
+  - library: pipeline.generate_report() on the case folder, as batch.py does.
+  - app:     app.py's flow: the case files are read into memory like uploads and spooled
+             (spool.py), the case is submitted to the job queue (jobs.py), a worker runs it
+             and the page polls its progress until the report can be downloaded.
+
+The LLM response cache and the client-side rate limit are disabled so every run pays the
+stub latency and nothing else. The first run of each flow (imports, OpenAI client set-up,
+cold PDF page cache) is reported separately as "warmup_seconds" and left out of the
+figures. The report gives end-to-end p50/p95 per flow and p50/p95 per pipeline stage
+(from the run traces, see tracing.py).
+
+Baselines live in benchmarks/baselines/pipeline_e2e.json, keyed by scenario. --check exits
+with 1 when an end-to-end or stage p50 is slower than baseline * (1 + --tolerance) plus
+--slack-ms. Timings depend on the machine, so record baselines on the machine (or CI
+runner) that runs the check.
+"""
+import argparse
+import dataclasses
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.fixtures import make_case
+from benchmarks.stub_openai import StubOpenAI
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "pipeline_e2e.json")
+FLOWS = ("library", "app")
+SCENARIOS = {
+    "small": {"plans": 2, "funds": 5, "fact_sheets": 2, "dark_star": 1, "sap": 1, "pages": 3},
+    "large": {"plans": 4, "funds": 40, "fact_sheets": 3, "dark_star": 2, "sap": 2, "pages": 8},
+}
+# Stages shorter than this are too noisy to gate on
+MIN_GATED_SECONDS = 0.05
+APP_POLL_SECONDS = 0.1
+
+
+def _percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def _quantiles(values):
+    values = sorted(values)
+    return {"p50": round(_percentile(values, 0.5), 4), "p95": round(_percentile(values, 0.95), 4)}
+
+
+def stage_seconds(spans):
+    """Total seconds per pipeline stage in one run's trace (stage spans + the document build)."""
+    totals = {}
+    for record in spans:
+        if record["kind"] == "stage":
+            totals[record["name"]] = totals.get(record["name"], 0.0) + record["seconds"]
+    return totals
+
+
+def run_library(case_dir, work_dir, run_index):
+    from pipeline import Case, generate_report
+
+    output_path = os.path.join(work_dir, f"library_{run_index}", "Generated_Report.docx")
+    start = time.perf_counter()
+    result = generate_report(Case.from_directory(case_dir), output_path, trace_path="")
+    return time.perf_counter() - start, result.trace, result.error_count
+
+
+def upload(path):
+    """A case file in memory, as Streamlit hands over an upload (BytesIO with a .name)."""
+    with open(path, "rb") as f:
+        file = io.BytesIO(f.read())
+    file.name = os.path.basename(path)
+    return file
+
+
+def run_app(case_dir, work_dir, run_index):
+    """Upload -> spool -> submit -> worker -> progress polling -> download, as app.py does it."""
+    from jobs import DONE, FAILED, JobQueue, job_dir, new_job_id, run_worker
+    from pipeline import CASE_FOLDERS, Case
+    from spool import session_spool
+    from tracing import read_jsonl
+
+    db_path = os.path.join(work_dir, "jobs.sqlite3")
+    jobs_dir = os.path.join(work_dir, "jobs")
+    queue = JobQueue(db_path, jobs_dir)
+    case = Case.from_directory(case_dir)
+    uploads = dataclasses.replace(
+        case,
+        template=upload(case.template),
+        factfind=upload(case.factfind),
+        funds=[[upload(path) for path in paths] for paths in case.funds],
+        **{attr: [upload(path) for path in getattr(case, attr)] for attr in CASE_FOLDERS},
+    )
+    start = time.perf_counter()
+    job_id = new_job_id()
+    # A new session per run, so every run pays for writing the spool
+    spool = session_spool(root=os.path.join(work_dir, "spool"))
+    queue.submit(dataclasses.replace(
+        uploads,
+        template=spool.path(uploads.template),
+        factfind=spool.path(uploads.factfind),
+        funds=[spool.paths(files) for files in uploads.funds],
+        **{attr: spool.paths(getattr(uploads, attr)) for attr in CASE_FOLDERS},
+    ), job_id)
+    worker = threading.Thread(target=run_worker, args=(db_path, jobs_dir, APP_POLL_SECONDS, 1))
+    worker.start()
+    while True:
+        progress = queue.progress(job_id)
+        if progress["status"] in (DONE, FAILED):
+            break
+        time.sleep(APP_POLL_SECONDS)
+    if progress["status"] == DONE:
+        queue.report(job_id)  # the download
+    elapsed = time.perf_counter() - start
+    worker.join()
+    trace_path = os.path.join(job_dir(job_id, jobs_dir), "trace.jsonl")
+    spans = read_jsonl(trace_path) if os.path.exists(trace_path) else []
+    errors = sum(1 for _, level, _ in progress["messages"] if level == "error")
+    return elapsed, spans, errors + (progress["status"] == FAILED)
+
+
+def run_benchmark(scenario, runs=3, latency_ms=300, jitter_ms=100, flows=FLOWS, images=True):
+    """
+    Run the flows against a fresh fixture case and the stub server.
+
+    Returns:
+    - dict: {"scenario", "config", "flows": {flow: {"seconds": {p50, p95}, "warmup_seconds", "runs", "errors",
+      "stages": {stage: {p50, p95}}}}, "stub": request counters}
+    """
+    runners = {"library": run_library, "app": run_app}
+    work_dir = tempfile.mkdtemp(prefix="report_bench_")
+    stub = StubOpenAI(latency_ms=latency_ms, jitter_ms=jitter_ms, seed=0).start()
+    os.environ.update({
+        "OPENAI_BASE_URL": stub.base_url,
+        "OPENAI_API_KEY": "stub",
+        "LLM_CACHE_DISABLED": "1",
+        # The stub has no quota; the client-side limiter would otherwise dominate large scenarios
+        "RATE_LIMIT_RPM": "1000000",
+        "RATE_LIMIT_TPM": "1000000000",
+        "PDF_PAGE_CACHE_PATH": os.path.join(work_dir, "pdf_pages.sqlite3"),
+    })
+    try:
+        counts = dict(SCENARIOS[scenario])
+        if not images:
+            counts.update(risk_images=0, annuity_images=0)
+        case_dir = make_case(os.path.join(work_dir, "case"), **counts)
+        report = {
+            "scenario": scenario_key(scenario, images),
+            "config": {"runs": runs, "latency_ms": latency_ms, "jitter_ms": jitter_ms, **counts},
+            "flows": {},
+        }
+        for flow in flows:
+            warmup_seconds = runners[flow](case_dir, work_dir, "warmup")[0]
+            seconds, per_stage, errors = [], {}, 0
+            for run_index in range(runs):
+                elapsed, spans, run_errors = runners[flow](case_dir, work_dir, run_index)
+                seconds.append(elapsed)
+                errors += run_errors
+                for stage, value in stage_seconds(spans).items():
+                    per_stage.setdefault(stage, []).append(value)
+            report["flows"][flow] = {
+                "seconds": _quantiles(seconds),
+                "warmup_seconds": round(warmup_seconds, 4),
+                "runs": [round(s, 4) for s in seconds],
+                "errors": errors,
+                "stages": {stage: _quantiles(values) for stage, values in sorted(per_stage.items())},
+            }
+        report["stub"] = stub.counters
+        return report
+    finally:
+        stub.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def scenario_key(scenario, images=True):
+    return scenario if images else f"{scenario}-no-images"
+
+
+def load_baselines(path=BASELINE_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_baseline(report, path=BASELINE_PATH):
+    baselines = load_baselines(path)
+    baselines[report["scenario"]] = {
+        "config": report["config"],
+        "flows": {
+            flow: {"seconds": data["seconds"]["p50"], "stages": {s: q["p50"] for s, q in data["stages"].items()}}
+            for flow, data in report["flows"].items()
+        },
+    }
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def compare(report, baseline, tolerance=0.25, slack_ms=50):
+    """Regression messages for every p50 over baseline * (1 + tolerance) + slack."""
+    regressions = []
+    slack = slack_ms / 1000.0
+
+    def check(label, current, reference):
+        if reference is None or reference < MIN_GATED_SECONDS:
+            return
+        limit = reference * (1 + tolerance) + slack
+        if current > limit:
+            regressions.append(f"{label}: p50 {current:.3f}s > {limit:.3f}s (baseline {reference:.3f}s)")
+
+    for flow, data in report["flows"].items():
+        reference = baseline.get("flows", {}).get(flow)
+        if not reference:
+            continue
+        check(f"{flow} end-to-end", data["seconds"]["p50"], reference["seconds"])
+        for stage, quantiles in data["stages"].items():
+            check(f"{flow} stage {stage}", quantiles["p50"], reference["stages"].get(stage))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="small")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--latency-ms", type=float, default=300, help="Stub response latency")
+    parser.add_argument("--jitter-ms", type=float, default=100, help="Stub latency jitter (+/-)")
+    parser.add_argument("--flows", nargs="+", choices=FLOWS, default=list(FLOWS))
+    parser.add_argument("--no-images", action="store_true", help="Skip OCR inputs (no Tesseract needed)")
+    parser.add_argument("--check", action="store_true", help="Fail on regressions against the stored baseline")
+    parser.add_argument("--update-baseline", action="store_true", help="Store this run as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative slowdown")
+    parser.add_argument("--slack-ms", type=float, default=50, help="Allowed absolute slowdown")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Baseline file")
+    args = parser.parse_args(argv)
+
+    report = run_benchmark(args.scenario, args.runs, args.latency_ms, args.jitter_ms, args.flows,
+                           images=not args.no_images)
+    print(json.dumps(report, indent=2))
+    if args.update_baseline:
+        save_baseline(report, args.baseline)
+        print(f"Baseline for {report['scenario']} written to {args.baseline}", file=sys.stderr)
+    if args.check:
+        baseline = load_baselines(args.baseline).get(report["scenario"])
+        if baseline is None:
+            print(f"FAIL: no baseline for {report['scenario']} (run with --update-baseline)", file=sys.stderr)
+            return 1
+        regressions = compare(report, baseline, args.tolerance, args.slack_ms)
+        for regression in regressions:
+            print(f"FAIL: {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+        print(f"OK: within {args.tolerance:.0%} + {args.slack_ms:.0f} ms of the baseline", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,247 @@
+"""
+Local stand-in for the OpenAI chat completions endpoint, for offline benchmarks.
+
+Usage (from the repository root):
+    python -m benchmarks.stub_openai --port 8765 --latency-ms 800 --jitter-ms 300
+
+then point the app or batch.py at it:
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=stub streamlit run app.py
+
+Every POST to .../chat/completions sleeps for latency ± jitter and answers like the real
+API (choices, usage). JSON-mode requests get a canned answer that is valid for the schema
+the prompt asks for (see schemas.py), so every extractor and the repair path work end to
+end; other prompts get a canned section of text. --error-rate makes that share of requests
+fail with 429 + Retry-After, to exercise rate_limit.py.
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from schemas import validate
+
+# JSON-mode answer per schema; a prompt is matched by the first marker it contains
+CANNED_JSON = {
+    "factfind_digest": {
+        "client_details": {"Full name": "John Smith", "Address": "1 High Street, York", "salutation": "Dear John,"},
+        "household": {"clients": [{"forename": "John", "age": "64", "marital_status": "Married",
+                                   "health": "Good", "employment": "Retired"}], "partner": {}},
+        "property": {"main_residence": "1 High Street", "ownership": "Owned outright", "value": "£350,000.00"},
+        "debts": {"mortgage": "£0.00", "other": [], "total": "£0.00"},
+        "dependents": [],
+        "current_situation": [
+            "• John, you are 64 years old, married and in good health.",
+            "• You own your house outright which is worth approximately £350,000.00.",
+            "• You have a monthly gross income of £2,700.00 and a monthly expenditure of £1,670.00, "
+            "leaving you with a monthly surplus of £1,030.00.",
+        ],
+        "objectives": ["1. Draw a sustainable income from your pension.", "2. Keep costs low."],
+    },
+    "plan_details": {
+        "Plans": [{"Provider": "Royal London", "Plan Number": "RL123456", "Plan Type": "Personal Pension",
+                   "Current Value": "£210,000.00"}],
+    },
+    "fund_performance": {
+        "Funds": [{
+            "Fund": "Royal London Governed Portfolio 4", "ISIN": "GB00B3M9JJ78",
+            "Year 1": "8.1%", "Year 2": "6.4%", "Year 3": "-9.2%", "Year 4": "11.0%", "Year 5": "4.3%",
+            "Cumulative (5 YR)": "20.6%",
+            "Benchmark": {"Year 1": "7.5%", "Year 2": "6.0%", "Year 3": "-8.1%", "Year 4": "10.2%",
+                          "Year 5": "3.9%", "Cumulative (5 YR)": "19.5%"},
+        }],
+    },
+    "portfolio": {
+        "PortfolioTotal": 210000,
+        "Holdings": [
+            {"Fund": "Royal London Governed Portfolio 4", "Value": 157500, "Percent": "75%"},
+            {"Fund": "Royal London Cash Plus", "Value": 52500, "Percent": "25%"},
+            {"Fund": "TOTAL", "Value": 210000, "Percent": "100%"},
+        ],
+    },
+    "sap_comparison": {
+        "Age": 75,
+        "companyName": "Royal London",
+        "Table": {
+            "Assumed Growth Rates": ["2%", "5%", "8%"],
+            "Existing Schemes": ["£118,972.00", "£155,558.00", "£201,866.00"],
+            "Rate of Return Required from Royal London": ["2.4%", "5.4%", "8.4%"],
+            "Effect on Fund if Moved to Royal London": ["-£1,200.00", "-£1,900.00", "-£2,600.00"],
+            "Reduction in Yield if Moved to Royal London": ["0.4%", "0.4%", "0.4%"],
+        },
+    },
+    "annuity_quotes": {
+        "Quotes": [{"Purchase Amount": "£124,030", "Monthly Amount": "£854", "Yearly Amount": "£10,250",
+                    "Yearly Increase": "None"}],
+    },
+    "fee_metrics": {
+        "Provider": "Royal London", "Plan Value": "£210,000.00", "Weighted Fund Charge": "0.44%",
+        "Platform Charge": "0.0%", "Ongoing Advice Fee": "0.50%", "Discretionary Fund Manager Charge": "0.0%",
+        "Drawdown Fee": "0.0%", "ProfitShare": "-0.15%",
+    },
+}
+SCHEMA_MARKERS = (
+    ("factfind_digest", "current_situation"),
+    ("plan_details", '"Plans"'),
+    ("fund_performance", '"Funds"'),
+    ("portfolio", "PortfolioTotal"),
+    ("sap_comparison", "companyName"),
+    ("annuity_quotes", '"Quotes"'),
+    ("fee_metrics", "Weighted Fund Charge"),
+)
+CANNED_TEXT = (
+    "Based on the information provided, your current arrangement remains broadly suitable. "
+    "The plan offers a diversified range of funds with competitive charges, and the projected "
+    "values support a sustainable level of withdrawals over your retirement. We recommend "
+    "reviewing the position annually, or sooner if your circumstances change."
+)
+
+for _name, _answer in CANNED_JSON.items():
+    assert not validate(_answer, _name), (_name, validate(_answer, _name))
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default listen backlog (5) drops connections when many calls run in parallel
+    request_queue_size = 128
+
+
+def prompt_type(messages, json_mode):
+    """Schema name the prompt asks for ("text" for free-text prompts)."""
+    if not json_mode:
+        return "text"
+    prompt = "\n".join(str(m.get("content") or "") for m in messages)
+    for name, marker in SCHEMA_MARKERS:
+        if marker in prompt:
+            return name
+    return "json"
+
+
+def canned_answer(kind):
+    if kind == "text":
+        return CANNED_TEXT
+    return json.dumps(CANNED_JSON.get(kind, {}), ensure_ascii=False)
+
+
+class StubOpenAI:
+    """
+    Threaded HTTP server answering chat completions with canned responses.
+
+    Use as a context manager; base_url is what OPENAI_BASE_URL should be set to.
+    """
+
+    def __init__(self, latency_ms=300, jitter_ms=100, error_rate=0.0, host="127.0.0.1", port=0, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counters = {"requests": 0, "errors": 0, "by_type": {}}
+        self._server = _Server((host, port), self._handler_class())
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def _delay(self):
+        with self._lock:
+            jitter = self._random.uniform(-self.jitter_ms, self.jitter_ms)
+            fail = self._random.random() < self.error_rate
+        return max(0.0, self.latency_ms + jitter) / 1000.0, fail
+
+    def _count(self, kind, failed):
+        with self._lock:
+            self.counters["requests"] += 1
+            self.counters["errors"] += int(failed)
+            self.counters["by_type"][kind] = self.counters["by_type"].get(kind, 0) + 1
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass  # keep benchmark output clean
+
+            def _send(self, status, payload, headers=()):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send(404, {"error": {"message": f"Unknown path {self.path}"}})
+                    return
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                messages = request.get("messages", [])
+                json_mode = (request.get("response_format") or {}).get("type") == "json_object"
+                kind = prompt_type(messages, json_mode)
+                delay, fail = stub._delay()
+                time.sleep(delay)
+                stub._count(kind, fail)
+                if fail:
+                    self._send(429, {"error": {"message": "Rate limit reached (stub)", "type": "rate_limit_error"}},
+                               headers=[("Retry-After", "1")])
+                    return
+                content = canned_answer(kind)
+                prompt_tokens = sum(len(str(m.get("content") or "")) for m in messages) // 4
+                completion_tokens = len(content) // 4
+                self._send(200, {
+                    "id": f"chatcmpl-{uuid.uuid4().hex}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": request.get("model", "stub"),
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": content}}],
+                    "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                              "total_tokens": prompt_tokens + completion_tokens},
+                })
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--jitter-ms", type=float, default=100)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 429")
+    args = parser.parse_args(argv)
+
+    stub = StubOpenAI(args.latency_ms, args.jitter_ms, args.error_rate, args.host, args.port).start()
+    print(f"Stub OpenAI listening on {stub.base_url}", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        stub.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,157 @@
+"""
+Deterministic fee comparison engine for the {Fund_Comparison} section.
+
+The LLM only extracts raw fee metrics (see logic.extract_fee_metrics_with_gpt); every
+monetary amount, total and difference is computed here with Decimal arithmetic, so the
+figures are reproducible and always add up.
+"""
+import re
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+# Fee categories in template order: (metric key, label used in the rendered text)
+FEE_CATEGORIES = (
+    ("Weighted Fund Charge", "Weighted Fund Charge"),
+    ("Platform Charge", "Platform Charge"),
+    ("Ongoing Advice Fee", "Ongoing Advice Fee"),
+    ("Discretionary Fund Manager Charge", "Discretionary Fund Manager Charge"),
+    ("Drawdown Fee", "Drawdown Fee"),
+    ("ProfitShare", "ProfitShare"),
+)
+
+PENNY = Decimal("0.01")
+_NUMBER = re.compile(r"-?\d+(?:\.\d+)?")
+
+
+def parse_decimal(value):
+    """
+    Parse a percentage or money string ("0.44%", "-0.15 %", "£123,456.78") into a Decimal.
+    Missing or unparseable values ("", "N/A", None) become 0.
+    """
+    if value is None:
+        return Decimal("0")
+    if isinstance(value, (int, float, Decimal)):
+        return Decimal(str(value))
+    text = str(value).replace(",", "").replace("−", "-")
+    negative = text.strip().startswith("-") or text.strip().startswith("(")
+    match = _NUMBER.search(text)
+    if not match:
+        return Decimal("0")
+    try:
+        number = Decimal(match.group(0))
+    except InvalidOperation:
+        return Decimal("0")
+    if negative and number > 0:
+        number = -number
+    return number
+
+
+def format_money(amount):
+    """Format a Decimal as £1,234.56 (negative amounts as -£1,234.56)."""
+    amount = amount.quantize(PENNY, rounding=ROUND_HALF_UP)
+    sign = "-" if amount < 0 else ""
+    return f"{sign}£{abs(amount):,.2f}"
+
+
+def format_percent(rate):
+    """Format a Decimal percentage as 0.44% (two decimal places)."""
+    return f"{rate.quantize(PENNY, rounding=ROUND_HALF_UP)}%"
+
+
+def compute_fee_breakdown(metrics, plan_value):
+    """
+    Monetary amount of every fee category for one fund.
+
+    Returns:
+    - dict: {"rows": [(key, rate, amount), ...], "total_rate": Decimal, "total_amount": Decimal}
+    """
+    rows = []
+    for key, _label in FEE_CATEGORIES:
+        rate = parse_decimal(metrics.get(key))
+        amount = (plan_value * rate / Decimal("100")).quantize(PENNY, rounding=ROUND_HALF_UP)
+        rows.append((key, rate, amount))
+    return {
+        "rows": rows,
+        "total_rate": sum((rate for _, rate, _ in rows), Decimal("0")),
+        "total_amount": sum((amount for _, _, amount in rows), Decimal("0")),
+    }
+
+
+def compute_fee_comparison(fund_metrics, p1_metrics):
+    """
+    Compare the existing fund against P1. Both are priced on the existing fund's plan value.
+
+    Args:
+    - fund_metrics (dict): Raw metrics of the existing (Royal London) fund, including "Plan Value".
+    - p1_metrics (dict): Raw metrics of the P1 benchmark.
+
+    Returns:
+    - dict with the plan value, both breakdowns and per-category/total differences (P1 - fund).
+    """
+    plan_value = parse_decimal(fund_metrics.get("Plan Value"))
+    if plan_value <= 0:
+        raise ValueError(f"Plan value not found in fund metrics: {fund_metrics.get('Plan Value')!r}")
+
+    fund = compute_fee_breakdown(fund_metrics, plan_value)
+    p1 = compute_fee_breakdown(p1_metrics, plan_value)
+    differences = [
+        (key, p1_rate - fund_rate, p1_amount - fund_amount)
+        for (key, fund_rate, fund_amount), (_, p1_rate, p1_amount) in zip(fund["rows"], p1["rows"])
+    ]
+    return {
+        "provider": fund_metrics.get("Provider") or "Royal London",
+        "plan_value": plan_value,
+        "fund": fund,
+        "p1": p1,
+        "differences": differences,
+        "total_rate_difference": p1["total_rate"] - fund["total_rate"],
+        "total_amount_difference": p1["total_amount"] - fund["total_amount"],
+    }
+
+
+def comparison_statement(comparison):
+    """Plain-English summary of the total fee difference between the fund and P1."""
+    provider = comparison["provider"]
+    fund, p1 = comparison["fund"], comparison["p1"]
+    rate_diff = comparison["total_rate_difference"]
+    amount_diff = comparison["total_amount_difference"]
+    if amount_diff == 0:
+        return (
+            f"P1's total annual ongoing charges of {format_percent(p1['total_rate'])} "
+            f"({format_money(p1['total_amount'])}) are the same as {provider}'s."
+        )
+    direction = "lower" if amount_diff < 0 else "higher"
+    statement = (
+        f"P1's total annual ongoing charges are {format_percent(abs(rate_diff))} "
+        f"({format_money(abs(amount_diff))}) {direction} than {provider}'s: "
+        f"{format_percent(p1['total_rate'])} ({format_money(p1['total_amount'])}) compared with "
+        f"{format_percent(fund['total_rate'])} ({format_money(fund['total_amount'])})."
+    )
+    largest = max(comparison["differences"], key=lambda row: abs(row[2]))
+    if largest[2] != 0:
+        largest_direction = "lower" if largest[2] < 0 else "higher"
+        statement += (
+            f" The largest difference is the {largest[0]}, which is {format_money(abs(largest[2]))} "
+            f"{largest_direction} with P1."
+        )
+    return statement
+
+
+def render_fund_comparison(comparison):
+    """Render a computed comparison in the existing "Plan value = ..." template text."""
+    labels = dict(FEE_CATEGORIES)
+    lines = [f"Plan value = {format_money(comparison['plan_value'])}  "]
+    for key, rate, amount in comparison["fund"]["rows"]:
+        lines.append(f"{labels[key]} % = {format_percent(rate)} ({format_money(amount)})  ")
+    lines += ["", "**P1 Metrics**:  "]
+    for key, rate, amount in comparison["p1"]["rows"]:
+        lines.append(f"{labels[key]} % = {format_percent(rate)} ({format_money(amount)})  ")
+    fund, p1 = comparison["fund"], comparison["p1"]
+    lines += [
+        "",
+        "**Total Annual Ongoing Charges**:  ",
+        f"- {comparison['provider']}: {format_percent(fund['total_rate'])} ({format_money(fund['total_amount'])})  ",
+        f"- P1: {format_percent(p1['total_rate'])} ({format_money(p1['total_amount'])})  ",
+        "",
+        f"**Comparison**: {comparison_statement(comparison)}  ",
+    ]
+    return "\n".join(lines)
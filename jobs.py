@@ -0,0 +1,446 @@
+"""
+Local background job queue for report generation.
+
+The Streamlit app only spools the uploads and submits a job; worker processes pick jobs
+up, run pipeline.generate_report() and record per-stage progress as they go. Everything
+lives in one SQLite file (WAL mode, shared by the web server and any number of worker
+processes on the host), including the finished report itself, so a closed browser tab
+loses nothing and the report can be downloaded later. A job's input files are the
+session's spooled uploads (spool.py), which purge() removes once they go unused for the
+retention period; the folder per job holds its trace. With JOB_KEEP_REPORT_FILES=1 a copy
+of each report is also written to the job folder, named after its content hash.
+
+Run dedicated workers (sized independently of web sessions) with:
+    python jobs.py worker --workers 4
+
+or let app.py start JOB_EMBEDDED_WORKERS worker processes alongside the web server.
+`python jobs.py status` lists recent jobs.
+"""
+import argparse
+import dataclasses
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+import uuid
+
+from spool import purge_spools
+
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", os.path.join("cache", "jobs.sqlite3"))
+JOBS_DIR = os.getenv("JOBS_DIR", "jobs")
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1.0"))
+# A running job whose worker has not reported for this long is assumed dead and re-queued
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "900"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETENTION_DAYS = float(os.getenv("JOB_RETENTION_DAYS", "7"))
+JOB_KEEP_REPORT_FILES = os.getenv("JOB_KEEP_REPORT_FILES", "0") == "1"
+# Stage results each worker keeps across jobs (see pipeline.StageMemo)
+JOB_MEMO_ITEMS = int(os.getenv("JOB_MEMO_ITEMS", "1024"))
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+logger = logging.getLogger(__name__)
+
+
+def job_dir(job_id, jobs_dir=None):
+    """Folder holding a job's inputs and output."""
+    return os.path.join(jobs_dir or JOBS_DIR, job_id)
+
+
+def new_job_id():
+    return uuid.uuid4().hex
+
+
+class JobQueue:
+    """
+    SQLite-backed job queue. Safe to share between threads and processes: each thread
+    gets its own connection, and jobs are claimed inside an IMMEDIATE transaction so two
+    workers never run the same job.
+    """
+
+    def __init__(self, path=None, jobs_dir=None):
+        self.path = path or JOB_DB_PATH
+        self.jobs_dir = jobs_dir or JOBS_DIR
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY,"
+                " status TEXT NOT NULL,"
+                " case_json TEXT NOT NULL,"
+                " output_path TEXT,"
+                " report BLOB,"
+                " error TEXT,"
+                " attempts INTEGER NOT NULL DEFAULT 0,"
+                " worker TEXT,"
+                " created_at REAL NOT NULL,"
+                " started_at REAL,"
+                " finished_at REAL,"
+                " heartbeat_at REAL)"
+            )
+            # Job databases created before reports were stored in them
+            if "report" not in [row["name"] for row in conn.execute("PRAGMA table_info(jobs)")]:
+                try:
+                    conn.execute("ALTER TABLE jobs ADD COLUMN report BLOB")
+                except sqlite3.OperationalError:
+                    pass  # another process added it first
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, created_at)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS job_events ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " job_id TEXT NOT NULL,"
+                " at REAL NOT NULL,"
+                " stage TEXT NOT NULL,"
+                " level TEXT NOT NULL,"
+                " message TEXT NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_job_events_job ON job_events(job_id, id)")
+            self._local.conn = conn
+        return conn
+
+    # ---- Submitting and reading -------------------------------------------
+
+    def submit(self, case, job_id=None):
+        """
+        Queue a case (pipeline.Case, its files already on disk) and return the job id.
+        Uploads belong in a spool (spool.Spool.path): purge() removes spooled files once
+        they go unused for the retention period. Files elsewhere are left alone.
+        """
+        job_id = job_id or new_job_id()
+        self._connection().execute(
+            "INSERT INTO jobs (id, status, case_json, created_at) VALUES (?, ?, ?, ?)",
+            (job_id, QUEUED, json.dumps(dataclasses.asdict(case)), time.time()),
+        )
+        return job_id
+
+    def get(self, job_id):
+        """The job row as a dict, without the report (None if unknown)."""
+        row = self._connection().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job.pop("report", None)
+        return job
+
+    def report(self, job_id):
+        """The finished report (.docx bytes) of a job, or None."""
+        row = self._connection().execute(
+            "SELECT report, output_path FROM jobs WHERE id = ? AND status = ?", (job_id, DONE)
+        ).fetchone()
+        if row is None:
+            return None
+        if row["report"] is not None:
+            return bytes(row["report"])
+        if row["output_path"] and os.path.exists(row["output_path"]):
+            # Jobs finished before reports were stored in the database
+            with open(row["output_path"], "rb") as f:
+                return f.read()
+        return None
+
+    def events(self, job_id, after_id=0):
+        """Progress events of a job, oldest first: dicts with id, at, stage, level, message."""
+        rows = self._connection().execute(
+            "SELECT id, at, stage, level, message FROM job_events WHERE job_id = ? AND id > ? ORDER BY id",
+            (job_id, after_id),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def progress(self, job_id):
+        """
+        Per-stage state of a job for progress displays.
+
+        Returns:
+        - dict: {"status", "fraction" (0..1), "stages": {stage: "running"|"done"},
+          "current": stage or None, "messages": [(stage, level, message), ...] warnings/errors/successes}
+        """
+        from pipeline import REPORT_STAGES
+
+        job = self.get(job_id)
+        if job is None:
+            return None
+        stages = {}
+        messages = []
+        for event in self.events(job_id):
+            if event["level"] == "start":
+                stages[event["stage"]] = "running"
+            elif event["level"] == "done":
+                stages[event["stage"]] = "done"
+            elif event["level"] in ("success", "warning", "error"):
+                messages.append((event["stage"], event["level"], event["message"]))
+        done = sum(1 for stage in REPORT_STAGES if stages.get(stage) == "done")
+        current = next((stage for stage in REPORT_STAGES if stages.get(stage) == "running"), None)
+        return {
+            "status": job["status"],
+            "fraction": 1.0 if job["status"] == DONE else done / len(REPORT_STAGES),
+            "stages": stages,
+            "current": current,
+            "messages": messages,
+        }
+
+    def list_jobs(self, limit=20):
+        rows = self._connection().execute(
+            "SELECT id, status, created_at, finished_at, error FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    # ---- Worker side -------------------------------------------------------
+
+    def claim(self, worker_id):
+        """Atomically take the oldest queued job. Returns the job dict, or None if the queue is empty."""
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (QUEUED,)
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            now = time.time()
+            conn.execute(
+                "UPDATE jobs SET status = ?, worker = ?, attempts = attempts + 1,"
+                " started_at = ?, heartbeat_at = ? WHERE id = ?",
+                (RUNNING, worker_id, now, now, row["id"]),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        job = dict(row)
+        job.update(status=RUNNING, worker=worker_id, attempts=row["attempts"] + 1)
+        return job
+
+    def add_event(self, job_id, stage, level, message=""):
+        """Record a progress event (also counts as the worker's heartbeat)."""
+        now = time.time()
+        conn = self._connection()
+        conn.execute(
+            "INSERT INTO job_events (job_id, at, stage, level, message) VALUES (?, ?, ?, ?, ?)",
+            (job_id, now, stage, level, message),
+        )
+        conn.execute("UPDATE jobs SET heartbeat_at = ? WHERE id = ?", (now, job_id))
+
+    def heartbeat(self, job_id, worker_id, attempt):
+        """Mark a running job as still alive. Returns False once it no longer belongs to this attempt."""
+        return self._connection().execute(
+            "UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND status = ? AND worker = ? AND attempts = ?",
+            (time.time(), job_id, RUNNING, worker_id, attempt),
+        ).rowcount > 0
+
+    def finish(self, job_id, report, output_path=None, worker_id=None, attempt=None):
+        """
+        Mark a job done, storing its report (.docx bytes) and the path of a kept copy, if any.
+        With worker_id/attempt, only while the job still belongs to that claim: a worker whose
+        job was re-queued can't overwrite another attempt. Returns whether the job was updated.
+        """
+        sql, args = self._owned(
+            "UPDATE jobs SET status = ?, report = ?, output_path = ?, error = NULL, finished_at = ? WHERE id = ?",
+            (DONE, sqlite3.Binary(report), output_path, time.time(), job_id), worker_id, attempt,
+        )
+        return self._connection().execute(sql, args).rowcount > 0
+
+    def fail(self, job_id, error, worker_id=None, attempt=None):
+        """Mark a job failed (only while it belongs to worker_id/attempt, when given, as for finish)."""
+        sql, args = self._owned(
+            "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+            (FAILED, error, time.time(), job_id), worker_id, attempt,
+        )
+        return self._connection().execute(sql, args).rowcount > 0
+
+    @staticmethod
+    def _owned(sql, args, worker_id, attempt):
+        if worker_id is None:
+            return sql, args
+        return f"{sql} AND status = ? AND worker = ? AND attempts = ?", (*args, RUNNING, worker_id, attempt)
+
+    def requeue_stale(self, stale_seconds=JOB_STALE_SECONDS, max_attempts=JOB_MAX_ATTEMPTS):
+        """Give jobs whose worker died another go (or fail them after max_attempts)."""
+        conn = self._connection()
+        cutoff = time.time() - stale_seconds
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = 'Worker stopped responding', finished_at = ?"
+                " WHERE status = ? AND heartbeat_at < ? AND attempts >= ?",
+                (FAILED, time.time(), RUNNING, cutoff, max_attempts),
+            )
+            requeued = conn.execute(
+                "UPDATE jobs SET status = ?, worker = NULL WHERE status = ? AND heartbeat_at < ?",
+                (QUEUED, RUNNING, cutoff),
+            ).rowcount
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return requeued
+
+    def purge(self, max_age_days=JOB_RETENTION_DAYS):
+        """
+        Delete finished jobs older than max_age_days, with their folders, and spooled
+        uploads (spool.py) not used for as long.
+        """
+        conn = self._connection()
+        cutoff = time.time() - max_age_days * 86400
+        old = [row["id"] for row in conn.execute(
+            "SELECT id FROM jobs WHERE status IN (?, ?) AND finished_at < ?", (DONE, FAILED, cutoff)
+        )]
+        for job_id in old:
+            shutil.rmtree(job_dir(job_id, self.jobs_dir), ignore_errors=True)
+            conn.execute("DELETE FROM job_events WHERE job_id = ?", (job_id,))
+            conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        purge_spools(max_age_days * 86400)
+        return len(old)
+
+
+def run_job(queue, job, memo=None):
+    """
+    Generate the report of one claimed job, recording progress events as it goes.
+    memo is the worker's stage memo, so stages already run for the same content are reused.
+    """
+    from pipeline import Case, generate_report, save_report
+
+    job_id = job["id"]
+    claim = (job["worker"], job["attempts"])
+    # Keep the job alive while a long stage runs without progress events, so
+    # requeue_stale() doesn't hand it to a second worker
+    stop_heartbeat = threading.Event()
+    heartbeat = threading.Thread(
+        target=_heartbeat, args=(queue, job_id, claim, stop_heartbeat), name=f"heartbeat-{job_id[:8]}", daemon=True
+    )
+    heartbeat.start()
+    try:
+        case = Case(**json.loads(job["case_json"]))
+        result = generate_report(
+            case,
+            progress=lambda stage, level, message: queue.add_event(job_id, stage, level, message),
+            memo=memo,
+            trace_path=os.path.join(job_dir(job_id, queue.jobs_dir), "trace.jsonl"),
+        )
+        output_path = save_report(result.document, job_id, root=queue.jobs_dir) if JOB_KEEP_REPORT_FILES else None
+    except Exception as e:
+        logger.error("Job %s failed: %r\n%s", job_id, e, traceback.format_exc())
+        if queue.fail(job_id, repr(e), *claim):
+            queue.add_event(job_id, "document", "error", f"Report generation failed: {e}")
+        else:
+            logger.warning("Job %s was re-queued meanwhile; dropping this attempt's failure", job_id)
+        return False
+    finally:
+        stop_heartbeat.set()
+        heartbeat.join()
+    if not queue.finish(job_id, result.document, output_path, *claim):
+        logger.warning("Job %s was re-queued meanwhile; dropping this attempt's report", job_id)
+        return False
+    return True
+
+
+def _heartbeat(queue, job_id, claim, stop, interval=None):
+    interval = interval or JOB_STALE_SECONDS / 3
+    while not stop.wait(interval):
+        try:
+            if not queue.heartbeat(job_id, *claim):
+                return  # re-queued or finished elsewhere
+        except sqlite3.Error as e:
+            logger.warning("Heartbeat of job %s failed: %r", job_id, e)
+
+
+def run_worker(db_path=None, jobs_dir=None, poll_seconds=JOB_POLL_SECONDS, max_jobs=None):
+    """
+    Worker loop: claim and run jobs until stopped (or after max_jobs jobs).
+    Stale jobs of dead workers are re-queued and old jobs purged while idle.
+    Stage results are memoised across jobs (up to JOB_MEMO_ITEMS), keyed on content hashes,
+    so resubmitting the same uploads is not extracted, OCRed or prompted again.
+    """
+    from pipeline import StageMemo
+
+    queue = JobQueue(db_path, jobs_dir)
+    memo = StageMemo(JOB_MEMO_ITEMS)
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    processed = 0
+    last_housekeeping = 0.0
+    while max_jobs is None or processed < max_jobs:
+        job = queue.claim(worker_id)
+        if job is None:
+            if time.time() - last_housekeeping > 60:
+                queue.requeue_stale()
+                queue.purge()
+                last_housekeeping = time.time()
+            time.sleep(poll_seconds)
+            continue
+        logger.info("Worker %s running job %s", worker_id, job["id"])
+        run_job(queue, job, memo)
+        processed += 1
+    return processed
+
+
+def _worker_main(db_path, jobs_dir, pdf_workers):
+    from scheduler import set_process_pool_workers
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    set_process_pool_workers(pdf_workers)
+    try:
+        run_worker(db_path, jobs_dir)
+    except KeyboardInterrupt:
+        pass
+
+
+def start_workers(count, db_path=None, jobs_dir=None, pdf_workers=1, daemon=True):
+    """
+    Start count worker processes. Daemon workers exit with the parent (used by app.py);
+    they cannot have child processes, so their PDF/OCR work always runs inline.
+
+    Returns:
+    - list[multiprocessing.Process]
+    """
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+    workers = []
+    for _ in range(count):
+        process = context.Process(
+            target=_worker_main, args=(db_path, jobs_dir, 1 if daemon else pdf_workers), daemon=daemon
+        )
+        process.start()
+        workers.append(process)
+    return workers
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    worker = sub.add_parser("worker", help="Run worker processes until interrupted")
+    worker.add_argument("--workers", type=int, default=1, help="Worker processes to start")
+    worker.add_argument("--pdf-workers", type=int, default=1, help="PDF/OCR processes per worker")
+    sub.add_parser("status", help="List recent jobs")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    if args.command == "status":
+        for job in JobQueue().list_jobs():
+            print(f"{job['id']}  {job['status']:<8} {time.ctime(job['created_at'])}  {job['error'] or ''}")
+        return 0
+
+    processes = start_workers(args.workers, pdf_workers=args.pdf_workers, daemon=False)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
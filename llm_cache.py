@@ -0,0 +1,214 @@
+"""
+Content-addressed cache for chat completion responses.
+
+Every GPT helper in logic.py goes through logic.chat_completion, which looks responses up
+here before calling OpenAI. Entries are keyed on the model, a hash of the messages, the
+temperature (plus any other sampling parameters) and a prompt-version tag, so editing a
+prompt or bumping its tag never serves a stale answer.
+
+Two tiers:
+  - an in-memory LRU, private to the process (entries keep their write time, so the TTL
+    applies to them too)
+  - an on-disk SQLite store, shared by every Streamlit/worker process on the host,
+    with TTL and total-size eviction
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join("cache", "llm_cache.sqlite3"))
+DEFAULT_MEMORY_ITEMS = 512
+DEFAULT_TTL_SECONDS = 30 * 24 * 3600  # 30 days
+DEFAULT_MAX_DISK_BYTES = 512 * 1024 * 1024  # 512 MB
+EVICT_EVERY_N_WRITES = 50
+
+
+def make_cache_key(model, messages, temperature, prompt_version, **params):
+    """
+    Build the content-addressed key for a chat completion request.
+
+    Args:
+    - model (str): Model name, e.g. "gpt-4o-mini".
+    - messages (list): The chat messages sent to the model.
+    - temperature (float): Sampling temperature.
+    - prompt_version (str): Tag identifying the prompt template revision.
+    - params: Any other request parameters that change the output (max_tokens, top_p, ...).
+
+    Returns:
+    - str: A sha256 hex digest.
+    """
+    prompt_hash = hashlib.sha256(
+        json.dumps(messages, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    ).hexdigest()
+    payload = json.dumps(
+        {
+            "model": model,
+            "prompt": prompt_hash,
+            "temperature": temperature,
+            "version": prompt_version,
+            "params": params,
+        },
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Two-tier (memory LRU + SQLite) key/value cache for model responses.
+
+    The SQLite file may be shared by several processes; each thread gets its own
+    connection and the database runs in WAL mode so readers don't block writers.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, memory_items=DEFAULT_MEMORY_ITEMS,
+                 ttl_seconds=DEFAULT_TTL_SECONDS, max_disk_bytes=DEFAULT_MAX_DISK_BYTES):
+        self.path = path
+        self.memory_items = memory_items
+        self.ttl_seconds = ttl_seconds
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._writes = 0
+        self._counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+
+    # ---- SQLite tier -------------------------------------------------------
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses(accessed_at)")
+            conn.commit()
+            self._local.conn = conn
+        return conn
+
+    def _disk_get(self, key):
+        """(value, created_at) for key, or None when it is missing or expired."""
+        conn = self._connection()
+        row = conn.execute("SELECT value, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        value, created_at = row
+        now = time.time()
+        if self.ttl_seconds and now - created_at > self.ttl_seconds:
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            conn.commit()
+            return None
+        conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+        conn.commit()
+        return value, created_at
+
+    def _disk_set(self, key, value, created_at):
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO responses (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+            (key, value, len(value.encode("utf-8")), created_at, created_at),
+        )
+        conn.commit()
+
+    def evict(self):
+        """Drop expired entries, then the least recently used ones until under max_disk_bytes."""
+        conn = self._connection()
+        removed = 0
+        if self.ttl_seconds:
+            cur = conn.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+            removed += cur.rowcount
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if self.max_disk_bytes and total > self.max_disk_bytes:
+            excess = total - self.max_disk_bytes
+            victims = []
+            for key, size in conn.execute("SELECT key, size FROM responses ORDER BY accessed_at"):
+                victims.append((key,))
+                excess -= size
+                if excess <= 0:
+                    break
+            conn.executemany("DELETE FROM responses WHERE key = ?", victims)
+            removed += len(victims)
+        conn.commit()
+        with self._lock:
+            if self.ttl_seconds:
+                cutoff = time.time() - self.ttl_seconds
+                for key in [k for k, (_, created_at) in self._memory.items() if created_at < cutoff]:
+                    del self._memory[key]
+            self._counters["evictions"] += removed
+        return removed
+
+    # ---- Public API --------------------------------------------------------
+
+    def get(self, key):
+        """Return the cached value for key, or None on a miss."""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, created_at = entry
+                if self._expired(created_at):
+                    # The disk copy has expired too; _disk_get below deletes it
+                    del self._memory[key]
+                else:
+                    self._memory.move_to_end(key)
+                    self._counters["memory_hits"] += 1
+                    return value
+        row = self._disk_get(key)
+        with self._lock:
+            if row is None:
+                self._counters["misses"] += 1
+                return None
+            self._counters["disk_hits"] += 1
+            self._remember(key, *row)
+        return row[0]
+
+    def set(self, key, value):
+        """Store value under key in both tiers."""
+        created_at = time.time()
+        with self._lock:
+            self._remember(key, value, created_at)
+            self._counters["writes"] += 1
+            self._writes += 1
+            run_eviction = self._writes % EVICT_EVERY_N_WRITES == 0
+        self._disk_set(key, value, created_at)
+        if run_eviction:
+            self.evict()
+
+    def _expired(self, created_at):
+        return bool(self.ttl_seconds) and time.time() - created_at > self.ttl_seconds
+
+    def _remember(self, key, value, created_at):
+        self._memory[key] = (value, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def stats(self):
+        """Hit/miss counters for this process, plus the hit rate."""
+        with self._lock:
+            counters = dict(self._counters)
+        lookups = counters["memory_hits"] + counters["disk_hits"] + counters["misses"]
+        hits = counters["memory_hits"] + counters["disk_hits"]
+        counters["hit_rate"] = hits / lookups if lookups else 0.0
+        return counters
+
+    def clear(self):
+        """Empty both tiers (counters are kept)."""
+        with self._lock:
+            self._memory.clear()
+        conn = self._connection()
+        conn.execute("DELETE FROM responses")
+        conn.commit()
@@ -1,46 +1,195 @@
-import streamlit as st  # ✅ Correct importimport openai
-from docx import Document
+"""
+Report-building logic: text extraction, GPT helpers and Word document assembly.
+
+Nothing here depends on Streamlit: helpers take local file paths (or Streamlit uploads,
+which are saved first) and report per-file problems through an optional
+on_message(level, message) callback, logging them otherwise. Orchestration of a whole
+case lives in pipeline.py.
+
+Heavy backends (python-docx, pdfplumber, Pillow, OpenCV, Tesseract, mammoth, Streamlit)
+and the OpenAI client load on first use, so importing this module is cheap for Streamlit
+cold starts and pool/batch workers, and works without an API key configured.
+See benchmarks/import_time.py for the import-time budget.
+"""
 from datetime import datetime
-import pdfplumber
+import io
 import json
+import logging
 import os
 import re  # Ensure this is included
-import openai
-import pytesseract
-from PIL import Image
-from docx.shared import Pt, Inches, RGBColor
-from docx.enum.text import WD_PARAGRAPH_ALIGNMENT, WD_LINE_SPACING
-import platform
-from docx import Document
-from docx.shared import Pt, Inches
-from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
-from openai import OpenAI
-import mammoth
-from io import StringIO
-
-
-# At the top of your file with other imports
-# Initialize client once at the module level
-try:
-    import streamlit as st
-    client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
-except (AttributeError, ModuleNotFoundError):
-    import os
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY", ""))
-    if not client.api_key:
-        raise ValueError("OpenAI API key not found in environment variables or Streamlit secrets")
-
-UPLOAD_FOLDER = "uploaded_docs"  # Ensure it's defined globally
-
-
-# Specify the full path to Tesseract executable if not in PATH
-# Add this at the top of your file (after imports):
-
-# Set Tesseract path based on OS
-if platform.system() == 'Windows':
-    pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
-else:  # For Linux (Streamlit Cloud) and macOS
-    pytesseract.pytesseract.tesseract_cmd = '/usr/bin/tesseract'
+import sys
+import threading
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
+from llm_cache import ResponseCache, make_cache_key
+from rate_limit import RateLimiter, call_with_retries, estimate_tokens
+from schemas import parse_and_validate, repair_prompt
+from tracing import file_sizes, span, traced
+from scheduler import llm_slot, run_concurrently
+from fee_calculator import compute_fee_comparison, render_fund_comparison
+from pdf_text import extract_pdf_pages
+from spool import as_readable, default_spool, open_binary, source_name
+from report_template import add_table, ensure_styles, render_template, template_index
+
+if TYPE_CHECKING:
+    from docx.document import Document
+
+
+logger = logging.getLogger(__name__)
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def _openai_api_key():
+    """API key from Streamlit secrets when running under Streamlit, else OPENAI_API_KEY."""
+    # Only consult secrets if the app already loaded Streamlit; batch workers never import it
+    if "streamlit" in sys.modules:
+        try:
+            return sys.modules["streamlit"].secrets["OPENAI_API_KEY"]
+        except Exception:
+            pass  # no secrets file, or no key in it
+    return os.getenv("OPENAI_API_KEY", "")
+
+
+def get_client():
+    """The shared OpenAI client, created on the first API call."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                api_key = _openai_api_key()
+                if not api_key:
+                    raise ValueError("OpenAI API key not found in environment variables or Streamlit secrets")
+                from openai import OpenAI
+
+                # Retries are handled by chat_completion (rate_limit.call_with_retries)
+                _client = OpenAI(api_key=api_key, max_retries=0)
+    return _client
+
+# Run the OpenCV preprocessing pipeline on photos/scans before OCR (set OCR_PREPROCESS=0 to disable)
+OCR_PREPROCESS = os.getenv("OCR_PREPROCESS", "1") == "1"
+
+# Shared response cache for every chat completion call (memory LRU + on-disk SQLite)
+response_cache = ResponseCache()
+# Shared RPM/TPM limiter for every API call (see rate_limit.py)
+rate_limiter = RateLimiter()
+
+
+def chat_completion(prompt=None, prompt_version="v1", model="gpt-4o-mini", temperature=0, messages=None,
+                    validate=None, **params):
+    """
+    Single entry point for every chat completion call in this module.
+
+    Responses are served from the content-addressed response cache when the same
+    model, messages, temperature/params and prompt-version tag were seen before;
+    otherwise the API is called and the result is stored. API calls wait for the shared
+    rate limiter and are retried with backoff on 429s and transient errors; at most
+    LLM_MAX_CONCURRENCY of them are in flight per process (scheduler.llm_slot), however
+    deeply the calling fan-outs nest. Each call is traced as an "llm" span named after the
+    prompt-version tag (see tracing.py).
+
+    Args:
+    - prompt (str): User prompt; ignored when messages is given.
+    - prompt_version (str): Tag identifying the prompt template revision. Bump it to invalidate cached answers.
+    - model (str): Model name.
+    - temperature (float): Sampling temperature.
+    - messages (list): Full chat messages, for calls that need a system prompt.
+    - validate (callable): validate(content) -> bool. Only answers that pass are cached, and
+      a cached answer that fails is ignored, so an invalid answer is never replayed.
+    - params: Extra request parameters (max_tokens, top_p, ...).
+
+    Returns:
+    - str: The message content of the first choice.
+    """
+    if messages is None:
+        messages = [{"role": "user", "content": prompt}]
+    with span("llm", prompt_version.split(":")[0], model=model) as trace:
+        trace["bytes_in"] = sum(len(str(m.get("content") or "").encode("utf-8")) for m in messages)
+        use_cache = os.getenv("LLM_CACHE_DISABLED", "") != "1"
+        key = make_cache_key(model, messages, temperature, prompt_version, **params)
+        if use_cache:
+            cached = response_cache.get(key)
+            if cached is not None and (validate is None or validate(cached)):
+                trace["cache"] = "hit"
+                return cached
+        trace["cache"] = "miss"
+
+        estimated_tokens = estimate_tokens(messages, params.get("max_tokens"))
+
+        def request():
+            rate_limiter.acquire(estimated_tokens)
+            # One of the process-wide LLM_MAX_CONCURRENCY slots; not held through retry backoff
+            with llm_slot():
+                return get_client().chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=temperature,
+                    **params
+                )
+
+        response = call_with_retries(request, limiter=rate_limiter)
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            trace["prompt_tokens"] = getattr(usage, "prompt_tokens", None)
+            trace["completion_tokens"] = getattr(usage, "completion_tokens", None)
+            if getattr(usage, "total_tokens", None):
+                rate_limiter.adjust(estimated_tokens - usage.total_tokens)
+        content = response.choices[0].message.content or ""
+        if use_cache and (validate is None or validate(content)):
+            response_cache.set(key, content)
+        return content
+
+
+def structured_completion(prompt, schema, prompt_version, **params):
+    """
+    Chat completion whose answer must be JSON matching a registered schema (see schemas.py).
+
+    The request uses JSON mode. If the answer doesn't parse or validate, one repair call
+    sends back just the invalid answer, the schema and the errors; the source text is not
+    re-sent and the extraction is not re-run. Only answers that validate are cached, so an
+    answer that is still invalid after repair is asked for again on the next run.
+
+    Args:
+    - prompt (str): Extraction prompt (must ask for JSON).
+    - schema (str): Name of the schema in schemas.SCHEMAS.
+    - prompt_version (str): Prompt template tag, as for chat_completion.
+    - params: Extra request parameters.
+
+    Returns:
+    - dict: The validated answer.
+
+    Raises:
+    - ValueError: When the repaired answer is still invalid.
+    """
+    params.setdefault("response_format", {"type": "json_object"})
+    params["validate"] = lambda content: not parse_and_validate(content, schema)[1]
+    raw_content = chat_completion(prompt, prompt_version=prompt_version, **params)
+    data, errors = parse_and_validate(raw_content, schema)
+    if not errors:
+        return data
+
+    logger.warning("%s answer failed validation (%s), asking for a repair", schema, "; ".join(errors[:3]))
+    repaired = chat_completion(
+        repair_prompt(raw_content, schema, errors), prompt_version=f"repair:{prompt_version}", **params
+    )
+    data, errors = parse_and_validate(repaired, schema)
+    if errors:
+        raise ValueError(
+            f"{schema} JSON is invalid after repair: {'; '.join(errors)}\nResponse: {repaired!r}"
+        )
+    return data
+
+
+def llm_cache_stats():
+    """Hit/miss counters of the shared response cache (memory hits, disk hits, misses, writes, hit rate)."""
+    return response_cache.stats()
+
+
+def rate_limit_stats():
+    """Requests let through the shared rate limiter, and how often/long they had to wait."""
+    return rate_limiter.stats()
+
 
 def clean_json_response(response_str) -> str:
     """Strip out code fences, extra markdown, etc."""
@@ -58,10 +207,16 @@ def parse_json_response(response_content: str, context: str = "") -> dict:
             f"Original content: {repr(response_content)}\n"
         )
         raise ValueError(error_msg) from e
-    
-def extract_text_from_file(file_path):
-    """Extract text from PDF, docx, or image (png/jpg/jpeg)."""
-    ext = os.path.splitext(file_path)[1].lower()
+
+@traced("extract", bytes_in=lambda file_path, *args, **kwargs: file_sizes(file_path))
+def extract_text_from_file(file_path, name=None):
+    """
+    Extract text from PDF, docx, or image (png/jpg/jpeg).
+
+    file_path may also be an in-memory source (bytes, memoryview or an upload, see
+    spool.py); the type is taken from name, or from the upload's own name.
+    """
+    ext = os.path.splitext(source_name(file_path, name))[1].lower()
     if ext == ".pdf":
         return extract_text_from_pdf(file_path)
     elif ext in [".png", ".jpg", ".jpeg"]:
@@ -71,28 +226,58 @@ def extract_text_from_file(file_path):
     else:
         return ""
     
-def extract_text_from_image(image_path):
+def extract_text_from_image(image_path, preprocess=OCR_PREPROCESS):
     """
     Extract text from an image using Tesseract OCR.
     
     Args:
-    - image_path (str): Path to the image file.
+    - image_path (str): Path to the image file, or the image in memory (bytes, memoryview, upload).
+    - preprocess (bool): Normalise the photo first (downscale, threshold, deskew, crop);
+      see image_preprocessing.preprocess_for_ocr.
 
     Returns:
     - str: Extracted text from the image.
     """
-    # Load the image
-    image = Image.open(image_path)
+    from PIL import Image
+    from ocr import ocr_image
+
+    # Load the image (in-memory images are read in place)
+    image = Image.open(as_readable(image_path))
+    if preprocess:
+        from image_preprocessing import preprocess_for_ocr
+
+        image = preprocess_for_ocr(image)
 
     # Extract text using Tesseract OCR
-    extracted_text = pytesseract.image_to_string(image)
+    extracted_text = ocr_image(image)
 
     return extracted_text
 
+
+@traced("ocr", bytes_in=lambda image_paths, *args, **kwargs: file_sizes(image_paths))
+def extract_texts_from_images(image_paths, preprocess=OCR_PREPROCESS):
+    """
+    OCR several images at once across the process pool (see ocr.ocr_files).
+
+    Args:
+    - image_paths (list): Paths to the image files, or images in memory (bytes, memoryview, upload).
+    - preprocess (bool): Normalise each photo before OCR.
+
+    Returns:
+    - tuple: (texts, errors). texts is in the order of image_paths (None where OCR failed);
+      errors maps the index of each failed image to its exception.
+    """
+    from ocr import ocr_files
+
+    return ocr_files(image_paths, preprocess=preprocess)
+
 # logic.py (snippet)
 
 def extract_text_from_docx(file_path):
-    with open(file_path, "rb") as docx_file:
+    """Markdown text of a .docx, given its path or the file in memory (bytes, memoryview, upload)."""
+    import mammoth
+
+    with open_binary(file_path) as docx_file:
         # Convert to Markdown (you can also do .convert_to_html)
         result = mammoth.convert_to_markdown(docx_file)
         text = result.value  # The generated Markdown
@@ -103,50 +288,67 @@ def extract_text_from_docx(file_path):
 def extract_text_from_pdf(file_path):
     """
     Extract text from a PDF file using pdfplumber.
+    Pages without a text layer (scans) are rasterised and OCRed; text-layer pages stay on the fast path.
+    Large documents are split into page ranges across a process pool and every page's
+    text is cached by (file hash, page number); see pdf_text.extract_pdf_pages.
+    Use pdf_text.iter_pdf_pages to read page by page and stop early.
+    file_path may also be the PDF in memory (bytes, memoryview, upload).
     """
     try:
-        with pdfplumber.open(file_path) as pdf:
-            text = "\n".join([page.extract_text() for page in pdf.pages])
-        return text
+        return "\n".join(extract_pdf_pages(file_path))
     except Exception as e:
         raise ValueError("Error extracting text from PDF: " + repr(e))
     
 def extract_texts_from_files(uploaded_files):
     """
-    Given a list of uploaded files (e.g., for one fund),
+    Given a list of uploaded files or local paths (e.g., for one fund),
     extract text from each file and combine them into a single string.
     """
     combined_text = ""
     for uploaded_file in uploaded_files:
-        file_path = save_uploaded_file(uploaded_file, UPLOAD_FOLDER)
         # Here we assume the files are PDFs; you can extend this logic if needed.
-        file_text = extract_text_from_pdf(file_path)
+        # Uploads are read from memory, no copy on disk.
+        file_text = extract_text_from_pdf(uploaded_file)
         combined_text += "\n" + file_text
     return combined_text.strip()    
 
 # NEW: Process multiple funds for comparison against P1
 def process_funds_for_comparison(funds_uploads, p1_files):
+    """
+    Compare each fund against the P1 benchmark.
+
+    P1's fee metrics are extracted into structured form once, every fund's metrics are
+    extracted independently in parallel, and each comparison is then assembled from the
+    two structured records by the local fee calculator, so P1's text is sent to the model
+    exactly once per case and no arithmetic is left to the model.
+    Returns a list of (fund number, comparison text) tuples.
+    """
     if not p1_files:
         raise ValueError("No P1 files provided.")
     # Process the P1 files once (combine their text)
     p1_text = extract_texts_from_files(p1_files)
-    comparison_results = []
-    # Loop over each fund (each element is a list of uploaded files for that fund)
+
+    tasks = {"P1": (extract_fee_metrics_with_gpt, (p1_text, "p1"))}
     for idx, fund_files in enumerate(funds_uploads):
         if fund_files:
-            fund_text = extract_texts_from_files(fund_files)
-            try:
-                # Call your GPT function to compare this fund vs. P1
-                comparison_result = extract_fund_comparison_with_gpt(
-                    fund1_text=fund_text,
-                    fund2_file1_text=p1_text,
-                    fund2_file2_text=p1_text  # Passing P1 text twice as required
-                )
-            except Exception as e:
-                comparison_result = f"Error processing Fund {idx+1}: {str(e)}"
-            comparison_results.append((idx+1, comparison_result))
-        else:
-            comparison_results.append((idx+1, "No files uploaded for this fund."))
+            tasks[idx + 1] = (extract_fee_metrics_with_gpt, (extract_texts_from_files(fund_files), "fund"))
+    metrics, errors = run_concurrently(tasks)
+    if "P1" in errors:
+        raise ValueError(f"Error extracting P1 fee metrics: {errors['P1']}")
+
+    comparison_results = []
+    for idx, fund_files in enumerate(funds_uploads):
+        fund_num = idx + 1
+        if not fund_files:
+            comparison_results.append((fund_num, "No files uploaded for this fund."))
+            continue
+        try:
+            if fund_num in errors:
+                raise errors[fund_num]
+            comparison_result = assemble_fund_comparison(metrics[fund_num], metrics["P1"])
+        except Exception as e:
+            comparison_result = f"Error processing Fund {fund_num}: {str(e)}"
+        comparison_results.append((fund_num, comparison_result))
     return comparison_results
   
 
@@ -155,15 +357,22 @@ def extract_risk_details(file_path):
     Extract risk level, type, first sentence, and last sentence from an uploaded image or document using OCR.
     
     Args:
-    - file_path: Path to the uploaded image or document.
+    - file_path: Path to the uploaded image, or the image in memory (bytes, memoryview, upload).
     
     Returns:
     - A dictionary with risk details (level, type, first sentence, last sentence).
     """
     try:
-        # Use Tesseract OCR to extract text from the uploaded image
-        image = Image.open(file_path)
-        text = pytesseract.image_to_string(image)
+        from PIL import Image
+        from ocr import ocr_image
+
+        # Use Tesseract OCR to extract text from the uploaded image (read in place when in memory)
+        image = Image.open(as_readable(file_path))
+        if OCR_PREPROCESS:
+            from image_preprocessing import preprocess_for_ocr
+
+            image = preprocess_for_ocr(image)
+        text = ocr_image(image)
 
         # Extract relevant details
         level_of_risk = re.search(r"Risk Level\s(\d+)", text)
@@ -188,278 +397,246 @@ def extract_risk_details(file_path):
     except Exception as e:
         raise ValueError("Error extracting risk details: " + repr(e))
     
+@dataclass(eq=False)
+class PlanDocument:
+    """
+    One uploaded plan file: its text, extracted exactly once, plus every result derived
+    from it. Consumers read from here instead of re-extracting or re-prompting.
+    """
+    name: str
+    text: str = ""
+    plan_details: list = None
+    review: str = None
+    portfolio: dict = None
+    swr: str = None
+    errors: dict = field(default_factory=dict)
+
+    # Results derived from the plan text, one GPT call each (see _producer)
+    DERIVED_FIELDS = ("plan_details", "review", "portfolio", "swr")
+
+    @property
+    def has_text(self):
+        return bool(self.text.strip())
+
+    def _producer(self, field_name):
+        return {
+            "plan_details": extract_plan_details_with_gpt,
+            "review": generate_pension_review_section,
+            "portfolio": extract_investment_portfolio_with_gpt,
+            "swr": generate_safe_withdrawal_rate_section,
+        }[field_name]
+
+    def pending(self, fields=None):
+        """
+        Derived fields not computed yet, as field -> (fn, args) tasks for the scheduler.
+        Previously recorded errors for those fields are cleared so they get retried.
+        fields limits the tasks to those fields (default: every derived field).
+        """
+        if not self.has_text:
+            return {}
+        tasks = {}
+        for field_name in (self.DERIVED_FIELDS if fields is None else fields):
+            if getattr(self, field_name) is None:
+                self.errors.pop(field_name, None)
+                tasks[field_name] = (self._producer(field_name), (self.text,))
+        return tasks
+
+    def get(self, field_name):
+        """Return a derived result, computing it on first use. Re-raises a recorded error."""
+        if field_name in self.errors:
+            raise self.errors[field_name]
+        if getattr(self, field_name) is None:
+            setattr(self, field_name, self._producer(field_name)(self.text))
+        return getattr(self, field_name)
+
+
+def load_plan_document(uploaded_file):
+    """Extract a plan file's text once into a PlanDocument (uploads are read from memory)."""
+    name = file_display_name(uploaded_file)
+    return PlanDocument(name=name, text=extract_text_from_file(uploaded_file, name))
+
+
+def log_message(level, message):
+    """Default on_message callback: send per-file messages to this module's logger."""
+    logger.log(logging.ERROR if level == "error" else logging.WARNING if level == "warning" else logging.INFO, message)
+
+
 # 4) Main function that loops over multiple plan files
-def process_plan_report(uploaded_files):
+def process_plan_report(uploaded_files, on_message=log_message):
     """
     Loop over each uploaded file, extract text, call GPT, and gather plan data.
-    If any file can't be parsed as docx/pdf/etc., log the file name and skip it.
+    If any file can't be parsed as docx/pdf/etc., report the file name and skip it.
+
+    on_message(level, message) receives "error"/"success" notes per file.
     """
     all_plan_data = []
 
     for uf in uploaded_files:
-        # 1) Save the file
-        file_path = save_uploaded_file(uf, UPLOAD_FOLDER)
-
-        # 2) Extract text, with try/except
+        name = file_display_name(uf)
+        # 1) Save the file and extract text, with try/except
         try:
-            extracted_text = extract_text_from_file(file_path)
+            plan_doc = load_plan_document(uf)
         except Exception as e:
-            # Log or show an error in Streamlit, indicating which file failed
-            st.error(f"Failed to extract text from '{uf.name}': {e}")
-            # Optionally skip to next file
+            # Report which file failed and skip to the next one
+            on_message("error", f"Failed to extract text from '{name}': {e}")
             continue
 
-        # 3) Process extracted text with GPT
+        # 2) Process extracted text with GPT
         try:
-            plan_list = extract_plan_details_with_gpt(extracted_text)
-            all_plan_data.extend(plan_list)
+            all_plan_data.extend(plan_doc.get("plan_details"))
         except Exception as e:
-            st.error(f"GPT error processing file '{uf.name}': {e}")
-            # Optionally skip or continue
+            on_message("error", f"GPT error processing file '{name}': {e}")
             continue
 
         # If successful:
-        st.success(f"Successfully processed file: {uf.name}")
+        on_message("success", f"Successfully processed file: {name}")
 
     return all_plan_data
     
-def process_fund_reviews_single_prompt(uploaded_files):
+def process_fund_reviews_single_prompt(uploaded_files, on_message=log_message):
     """
     For each file:
-      - Save & extract text
-      - Call generate_fund_review_single_call(extracted_text)
+      - Save & extract text into a PlanDocument
+      - Generate its review (generate_pension_review_section)
       - Collect each review in a list
     Returns a list of final text blocks (one per file).
     """
     all_reviews = []
     for uf in uploaded_files:
-        file_path = save_uploaded_file(uf, UPLOAD_FOLDER)
+        name = file_display_name(uf)
         try:
-            extracted_text = extract_text_from_file(file_path)
+            plan_doc = load_plan_document(uf)
         except Exception as e:
-            st.error(f"Failed to extract text from '{uf.name}': {e}")
+            on_message("error", f"Failed to extract text from '{name}': {e}")
             continue
 
         # Single GPT call that parses owner/fund + writes the final review
         try:
-            review_text = generate_pension_review_section(extracted_text)
-            all_reviews.append(review_text)
-            st.success(f"Successfully generated review for {uf.name}")
+            all_reviews.append(plan_doc.get("review"))
+            on_message("success", f"Successfully generated review for {name}")
         except Exception as e:
-            st.error(f"GPT error on '{uf.name}': {e}")
+            on_message("error", f"GPT error on '{name}': {e}")
 
     return all_reviews
 
-def process_funds_for_comparison(funds_uploads, p1_files):
-   
-    if not p1_files:
-        raise ValueError("No P1 files provided.")
-    p1_text = extract_texts_from_files(p1_files)
-    comparison_results = []
-    for idx, fund_files in enumerate(funds_uploads):
-        if fund_files:
-            fund_text = extract_texts_from_files(fund_files)
-            try:
-                comparison_result = extract_fund_comparison_with_gpt(
-                    fund1_text=fund_text,
-                    fund2_file1_text=p1_text,
-                    fund2_file2_text=p1_text  # Passing consolidated P1 text twice
-                )
-            except Exception as e:
-                comparison_result = f"Error processing Fund {idx+1}: {str(e)}"
-            comparison_results.append((idx+1, comparison_result))
-        else:
-            comparison_results.append((idx+1, "No files uploaded for this fund."))
-    return comparison_results
+def format_report_date(date=None):
+    """Format a date the way the report template expects it, e.g. "9th January 2025"."""
+    date = date or datetime.now()
+    day = date.day
+    suffix = "th" if 11 <= day % 100 <= 13 else {1: "st", 2: "nd", 3: "rd"}.get(day % 10, "th")
+    return f"{day}{suffix} {date.strftime('%B %Y')}"
 
 
-def extract_client_details_with_gpt(factfinding_text):
-    prompt = f"""
-    You are an AI assistant tasked with extracting specific client details from a FactFinding report.
+def extract_factfind_digest(factfinding_text):
+    """
+    Read the FactFinding report once and return a structured digest consumed by every
+    FactFind-based section (client details, Current Situation, Priorities and Objectives, IHT).
 
-    **Objective**:
-    Analyze the provided FactFinding report and extract the following details to populate placeholders in a financial document:
+    Returns:
+    - dict: {
+        "client_details": {"Full name", "Address", "Today’s date", "salutation"},
+        "household": {...}, "property": {...}, "debts": {...}, "dependents": [...],
+        "current_situation": ["• ...", ...], "objectives": ["1. ...", ...]
+      }
+    """
+    prompt = f"""
+    You are an AI assistant that reads a client FactFinding report ONCE and returns a structured digest
+    used to write every FactFind-based section of a financial report.
 
-    **Placeholders**:
-    - Full name: Combine Title and Surname and if the fact finds is adreesed for two people combine both names like : Mr forename+Surname & Mrs Forename+Surname ; example "Mr James Yeandle & Mrs Elizabeth Yeandle". 
+    **Client details**:
+    - Full name: Combine Title and Surname and if the fact finds is adreesed for two people combine both names like : Mr forename+Surname & Mrs Forename+Surname ; example "Mr James Yeandle & Mrs Elizabeth Yeandle".
     - Address: Full multiline address with postal code
-    - Today's date: Current date in "9th January 2025" format
     - Salutation: "Dear [Forename]," format and if it is for two people use "Dear [Forename] & [Forename]," format.
 
+    **Household, property, debts and dependents**:
+    - household: each client's forename, age, marital status, health, employment/retirement status and previous occupation, plus the spouse or partner if found.
+    - property: main residence ownership and approximate value (use the address to estimate typical local prices if no value is given).
+    - debts: mortgage, loans and other liabilities with amounts (use "£0.00" when there are none).
+    - dependents: each dependent's name, relationship and age. Exclude the name of the person who took the notes (e.g., "16 Sep 2024 - Alex Armstrong").
+
+    **current_situation** (list of bullet strings, each starting with "• "):
+    - Write as bullet points only. Do not include any headings or introductions.
+    - If the report is for one individual, use singular language (e.g., "Chris, you are 68 years....", "You have...").
+    - If the report is for two individuals, use joint language (e.g., "Tony, you are 74 years old, and Liz, you are 75 years old....", "You both have...").
+    - Keep it conversational by using "You" at the beginning of some sentences.
+    - Include personal details (age, marital status, health), retirement details and previous occupation, property ownership and value, pensions, incomes and cash withdrawals, debts, dependants and spouse details with their financial details, emergency funds, Will and Power of Attorney, and protection (e.g., home insurance, car insurance).
+    - Mention monthly income and expenditure in one line using the sums of the Incomes and Expenses tables, for example (• You have a monthly gross income of £2,700.00 and a monthly expenditure of £1,670.00, leaving you with a monthly surplus of £1,030.00.).
+    - Whenever you mention "You should always have 3-6 months worth of expenditure", include the range (£<3 x monthly expenditure>-£<6 x monthly expenditure>).
+    - Avoid specific details about their investment knowledge and experience.
+    - Example bullets:
+      • Chris, you are 68 years old, co-habiting with your partner and in good health.
+      • You own your house outright which is worth approximately £555,000.00.
+      • You have a monthly gross income of £3,260.00 and a monthly expenditure of £2,410.00, leaving you with a monthly disposable of £850.00.
+      • You have £39,000.00 in cash reserves. This is a sufficient emergency fund. You should always have 3-6 months worth of expenditure in an easy access bank account for emergencies (£7,230.00-£14,460.00).
+      • You have drafted a Will and Power of Attorney, and they are both up to date.
+
+    **objectives** (list of strings, each starting with its number, e.g. "1. ..."):
+    - Take the goals from the Objectives table and personalise them with the client's financial circumstances, retirement plans, health and family situation.
+    - Cover financial objectives, specific income goals or purchases, retirement strategies, family considerations, timeframes and preferences.
+    - Professional and concise; avoid repetition or vague statements.
+
+    **Language** (all text fields):
+    - UK grammar, spelling ("realise", "prioritise", "colour", "centre", "travelling"), terminology ("flat", "holiday") and date format.
+    - Single quotation marks for quotes.
+
     **FactFinding Report**:
     {factfinding_text}
 
-    **Expected JSON Format**:
+    **Expected JSON Format** (return ONLY this JSON object):
     {{
-      "Full name": "",
-      "Address": "",
-      "Today’s date": "",
-      "salutation": ""
+      "client_details": {{"Full name": "", "Address": "", "salutation": ""}},
+      "household": {{"clients": [{{"forename": "", "age": "", "marital_status": "", "health": "", "employment": ""}}], "partner": {{}}}},
+      "property": {{"main_residence": "", "ownership": "", "value": ""}},
+      "debts": {{"mortgage": "", "other": [], "total": ""}},
+      "dependents": [{{"name": "", "relationship": "", "age": ""}}],
+      "current_situation": ["• ..."],
+      "objectives": ["1. ..."]
     }}
     """
-    
+
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0
-        )
-        
-        raw_content = response.choices[0].message.content
-        cleaned_content = clean_json_response(raw_content)
-        return parse_json_response(cleaned_content, "client details extraction")
+        digest = structured_completion(prompt, "factfind_digest", "extract_factfind_digest:v2")
     except Exception as e:
-        error_msg = f"Client details error: {str(e)}"
-        if 'raw_content' in locals():
-            error_msg += f"\nRaw response: {raw_content}"
-        raise ValueError(error_msg)
-    
-
-def generate_current_situation(factfinding_text):
-    """
-    Use OpenAI to generate a detailed 'Current Situation' section based on the FactFinding report.
-    """
-    prompt = f"""
-    You are an assistant tasked with creating a "Current Situation" summary for a financial report.
-
-    **Objective**:
-    1. Analyze the provided FactFinding report and extract all relevant details.
-    2. Write a detailed "Current Situation" section summarizing the client's financial and personal details.
-    3. Write the "Current Situation" section as bullet points only. Do not include any headings, introductions.
-
-    **Instructions**:
-    - Use UK grammar, language and date format, also dont use 'z' in words use 's' where applicable for example (e.g., "realise" instead of "realize").
-   - 1. Use British English spelling conventions:
-        - Words ending in "ise" (e.g., "prioritise" instead of "prioritize").
-        - Words like "colour", "favour", and "neighbour" (instead of "color", "favor", and "neighbor").
-        - Words like "centre" and "metre" (instead of "center" and "meter").
-        - Words like "travelling" and "cancelled" with double "l" (instead of "traveling" and "canceled").
-   - 2.Use British grammar and punctuation:
-        - Use single quotation marks (' ') for quotes instead of double quotation marks (" ").
-        - Place punctuation outside quotation marks unless it's part of the quoted text.
-        - Refer to collective nouns (e.g., "team", "government") as plural where appropriate (e.g., "The team are ready").
-   - 3.Use British terminology:
-        - Use "flat" instead of "apartment", "lift" instead of "elevator", and "petrol" instead of "gasoline".
-        - Use "holiday" instead of "vacation" and "autumn" instead of "fall".    
-    - If the report is for one individual, use singular language (e.g., "Chris, you are 68 years....","You have...", "Your pension is...").
-    - If the report is for two individuals, use plural or joint language (e.g., "Tony, you are 74 years old, and Liz, you are 75 years old.... ", "You both have...", "Your combined pensions are...").       
-    - Write the section in professional bullet points, but keep it conversational by using "You" at the beginning of some sentences.
-    - Make sure to mention the part about include monthly growth and monthly expenditure and remain in one line for example (• You have a monthly gross income of £2,700.00 and a monthly expenditure of £1,670.00, leaving you with a monthly surplus of £1,030.00.).
-    - Include point about dependants and Wife details and their financial details if they are found.
-    - When extracting dependents' details, exclude the name of the person who took the notes (e.g., "16 Sep 2024 - Alex Armstrong"). Focus only on the actual dependents' names and their details.
-    - Whenever you mention the phrase "You should always have 3-6 months worth of expenditure," always calculate and include the range for 3-6 months of monthly expenditure, formatted as (£<3 months value>-£<6 months value>). Use the extracted monthly expenditure for this calculation(3 multiple by monthly expenditure - 6 multiple by monthly expenditure ).
-    - Include line about Protection detalis (e.g,  Home insurance, car insurance,..... .)
-    - Include sufficient length and detail, following this example:
-
-    **Example "Current Situation" Section**:
-    
-    Current Situation
-
-    When we last met, you made me aware of your current situation:
-
-    • Chris, you are 68 years old, co-habiting with your partner and in good health. 
-    • You retired in January 2020 having previously worked in IT.  
-    • You own your house outright which is worth approximately £555,000.00.
-    • You are in receipt of your full state pension (£930.00 gross per month), Zurich Financial Services final salary pension (£640.00 gross per month) and your NHS pension (£890.00 gross per month).
-    • You withdraw £800.00 gross per month from your tax-free cash entitlement from your Royal London Personal Pension. This will be exhausted soon. 
-    • You have no debts or other liabilities.
-    • You have a monthly gross income of £3,260.00 and a monthly expenditure of £2,410.00, leaving you with a monthly disposable of £850.00. 
-    • You have no financial dependents. 
-    • You have £39,000.00 in cash reserves. This is a sufficient emergency fund. You should always have 3-6 months worth of expenditure in an easy access bank account for emergencies (£7,230.00-£14,460.00). You may want to invest any over this amount to get better returns than cash in the bank. 
-    • You have drafted a Will and Power of Attorney, and they are both up to date.
-
-    **Your Task**:
-    1. Ensure your output matches the tone, structure, and level of detail of the example provided above.
-    2. Extract details from the FactFinding report, including:
-       - Personal details (age, marital status, and health).
-       - Dependants and Wife details and their financial details if they are found.
-       - Include point about dependants and Wife details and their financial details if they are found.
-       - Retirement details and previous occupation , also for his wife it was found in one line with his detalis.
-       - Property ownership and approximate value.
-       - Pensions, incomes, and cash withdrawals.
-       - Include point about monthly growth and monthly expenditure in one line, you can use the Incomes and Expenses table (The Sum of each), use the word growth and exenditure when talking about it.
-       - Emergency funds and recommendations for improvement.
-       - Succession planning (Will and Power of Attorney).
-       - Protection
-       - Any other relevant details.
-
-    **FactFinding Report**:
-    {factfinding_text}
-
-    **Output**:
-    Write a "Current Situation" section that:
-    1. Matches the tone and format of the example.
-    2. Includes sufficient detail to make the section comprehensive and professional.
-    3. Avoids mentioning specific details about thier invstment knowledge and experience.
-    """
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0
+        raise ValueError(f"FactFind digest error: {str(e)}")
+
+    # The model has no reliable notion of "today", so the date is filled in locally
+    digest.setdefault("client_details", {})["Today’s date"] = format_report_date()
+    return digest
+
+
+def format_current_situation(factfind_digest):
+    """Render the 'Current Situation' bullets from a FactFind digest."""
+    bullets = factfind_digest.get("current_situation") or []
+    lines = []
+    for bullet in bullets:
+        bullet = str(bullet).strip()
+        if bullet:
+            lines.append(bullet if bullet.startswith("•") else f"• {bullet}")
+    return "\n".join(lines)
+
+
+def format_priorities_and_objectives(factfind_digest):
+    """Render the numbered 'Priorities and Objectives' list from a FactFind digest."""
+    objectives = [str(o).strip() for o in (factfind_digest.get("objectives") or []) if str(o).strip()]
+    return "\n".join(
+        objective if re.match(r"^\d+[.)]", objective) else f"{idx}. {objective}"
+        for idx, objective in enumerate(objectives, start=1)
     )
-    return response.choices[0].message.content
-
-
-def generate_priorities_and_objectives(factfinding_text):
-    """
-    Use OpenAI to generate a detailed 'Priorities and Objectives' section based on the FactFinding report.
-    """
-    prompt = f"""
-    You are an assistant tasked with creating a "Priorities and Objectives" section for a financial report.
-
-    **Objective**:
-    1. Analyze the provided FactFinding report and extract relevant details fro m the Objectives table.
-    2. Personalize the "Priorities and Objectives" section by integrating other relevant information in the report, such as financial circumstances, retirement plans, health, and family situation.
-    3. Write the "Priorities and Objectives" section as a bullet points or numbers for example (e.g., 1. lab akbdh sj h , 2. hushfjfhsuhfivn;k , 3.h osijck,........). Do not include headings or numbered lists.
-
-    **Instructions**:
-    - Use UK grammar, language and date format, also dont use 'z' in words use 's' where applicable for example (e.g., "realise" instead of "realize").
-    - 1. Use British English spelling conventions:
-        - Words ending in "ise" (e.g., "prioritise" instead of "prioritize").
-        - Words like "colour", "favour", and "neighbour" (instead of "color", "favor", and "neighbor").
-        - Words like "centre" and "metre" (instead of "center" and "meter").
-        - Words like "travelling" and "cancelled" with double "l" (instead of "traveling" and "canceled").
-    - 2.Use British grammar and punctuation:
-        - Use single quotation marks (' ') for quotes instead of double quotation marks (" ").
-        - Place punctuation outside quotation marks unless it's part of the quoted text.
-        - Refer to collective nouns (e.g., "team", "government") as plural where appropriate (e.g., "The team are ready").
-    - 3.Use British terminology:
-        - Use "flat" instead of "apartment", "lift" instead of "elevator", and "petrol" instead of "gasoline".
-        - Use "holiday" instead of "vacation" and "autumn" instead of "fall".   
-    - If the report is for one individual, use singular language (e.g., "You have...", "Your pension is...").
-    - If the report is for two individuals, use plural or joint language (e.g., "You both have...", "Your combined pensions are...").   
-    - Focus on the client's primary and secondary financial objectives, integrating personal context to make it highly personalized.
-    - Use a professional tone and structure, with clear and specific details.
-    - Avoid unnecessary repetition or vague language.
-    - Ensure that the content remains cohesive and logical.
-    - Write the "Priorities and Objectives" section as a bullet points or numbers for example (e.g., 1. lab akbdh sj h , 2. hushfjfhsuhfivn;k , 3.h osijck,........).
-
-
-    **Your Task**:
-    1. Ensure your output matches the tone, structure, and level of detail of the example provided above.
-    2. Extract details from the FactFinding report, including:
-       - Financial objectives (e.g., maintaining living standards, creating income, building capital).
-       - Any specific income goals or plans (e.g., covering monthly expenses or specific purchases).
-       - Retirement plans or strategies (e.g., utilizing pensions, maintaining capital for long-term care).
-       - Any family or personal considerations that impact objectives (e.g., no descendants, focus on enjoying funds in the client's lifetime).
-       - Relevant details from the Objectives table, such as priority goals, timeframes, and preferences.
-    3. Write the section in a professional and concise manner.
 
-    **FactFinding Report**:
-    {factfinding_text}
 
-    **Output**:
-    Write a "Priorities and Objectives" section that:
-    1. Matches the tone and structure of the example provided above.
-    2. Includes sufficient personalization based on the Objectives table and other relevant details.
-    3. Avoids unnecessary repetition or vague statements.
-    """
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0
+def factfind_estate_summary(factfind_digest):
+    """The parts of a FactFind digest the IHT section needs, as indented JSON."""
+    return json.dumps(
+        {
+            "address": factfind_digest.get("client_details", {}).get("Address", ""),
+            "household": factfind_digest.get("household", {}),
+            "property": factfind_digest.get("property", {}),
+            "debts": factfind_digest.get("debts", {}),
+            "dependents": factfind_digest.get("dependents", []),
+        },
+        indent=2,
+        ensure_ascii=False,
     )
-    return response.choices[0].message.content
 
 
 def generate_multi_risk_attitude_text(extracted_texts):
@@ -502,12 +679,7 @@ Finally, return ONLY the final combined text.
     """
 
     try:
-        response = openai.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0,
-        )
-        final_text = response.choices[0].message.content.strip()
+        final_text = chat_completion(prompt, prompt_version="generate_multi_risk_attitude_text:v1").strip()
         return final_text
     except Exception as e:
         raise ValueError(f"Error generating multi-risk text: {e}")
@@ -516,7 +688,7 @@ Finally, return ONLY the final combined text.
 # 3) GPT prompt for plan details
 def extract_plan_details_with_gpt(extracted_text):
     """
-    Sends the extracted text to GPT, asking for plan details in JSON array form:
+    Sends the extracted text to GPT and returns the plan details as a list:
     [
       {
         "Provider": "some provider",
@@ -526,35 +698,26 @@ def extract_plan_details_with_gpt(extracted_text):
       },
       ...
     ]
+    Raises ValueError when no valid answer could be obtained (see structured_completion).
     """
     prompt = f"""
-Extract plan details from the text below and return a JSON array of objects. Example structure:
-[
-  {{
-    "Provider": "XYZ",
-    "Plan Number": "12345",
-    "Plan Type": "Personal Pension",
-    "Current Value": "£210,000"
-  }}
-]
+Extract plan details from the text below and return a JSON object with a "Plans" array. Example structure:
+{{
+  "Plans": [
+    {{
+      "Provider": "XYZ",
+      "Plan Number": "12345",
+      "Plan Type": "Personal Pension",
+      "Current Value": "£210,000"
+    }}
+  ]
+}}
+Use "" for any detail that is not in the text.
 
 Text:
 {extracted_text}
 """
-    response = openai.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0,
-    )
-    raw_content = response.choices[0].message.content
-    cleaned = clean_json_response(raw_content)
-
-    # Attempt to parse as JSON
-    try:
-        return json.loads(cleaned)
-    except:
-        # If parsing fails or GPT didn't return valid JSON, return empty
-        return []
+    return structured_completion(prompt, "plan_details", "extract_plan_details_with_gpt:v2")["Plans"]
        
     
 def generate_pension_review_section(extracted_text):
@@ -631,13 +794,7 @@ You have contributed a total of **£[Total Investment]** into this fund over the
 - Maintain a clear, concise, professional tone and follow the instructions above.
 """
 
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0
-    )
-
-    return response.choices[0].message.content.strip()
+    return chat_completion(prompt, prompt_version="generate_pension_review_section:v1").strip()
 
 
 def extract_investment_portfolio_with_gpt(extracted_text):
@@ -704,17 +861,7 @@ Text to analyze:
 {extracted_text}
 """
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0
-        )
-        raw_content = response.choices[0].message.content
-        # Remove any markdown code fences if present
-        cleaned = re.sub(r'^```json\s*|\s*```$', '', raw_content, flags=re.DOTALL).strip()
-        return json.loads(cleaned)
-    except json.JSONDecodeError as e:
-        raise ValueError(f"Failed to parse investment portfolio GPT response: {str(e)}\nRaw response: {raw_content}")
+        return structured_completion(prompt, "portfolio", "extract_investment_portfolio_with_gpt:v2")
     except Exception as e:
         raise ValueError(f"Investment portfolio extraction error: {str(e)}")
 
@@ -812,21 +959,18 @@ def generate_safe_withdrawal_rate_section(plan_report_text):
 
     try:
         # Make a call to the OpenAI API
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
+        generated_text = chat_completion(
             messages=[
                 {"role": "system", "content": "You are a financial advisor assistant."},
                 {"role": "user", "content": prompt}
             ],
+            prompt_version="generate_safe_withdrawal_rate_section:v1",
             temperature=0.3,  # Lower temperature for more deterministic output
             max_tokens=600,    # Adjust as needed to capture detailed responses
             top_p=1,
             frequency_penalty=0,
             presence_penalty=0
-        )
-
-        # Extract the response text
-        generated_text = response.choices[0].message.content.strip()
+        ).strip()
 
         if generated_text == "No withdrawals detected.":
             return ""  # No SWR section needed
@@ -834,7 +978,7 @@ def generate_safe_withdrawal_rate_section(plan_report_text):
             return generated_text
 
     except Exception as e:
-        print("Error generating SWR section: " + repr(e))
+        logger.warning("Error generating SWR section: %r", e)
         return ""
     
     
@@ -849,10 +993,12 @@ Analyze this fund performance data and return JSON with:
 3. Cumulative 5-year sum (calculated as simple sum of yearly percentages)
 
 Rules:
-- Use EXACTLY this format:
-[
+- Use EXACTLY this format (one entry in "Funds" per fund in the text):
+{{
+  "Funds": [
     {{
         "Fund": "Fund Name",
+        "ISIN": "GB00XXXXXXXX",
         "Year 1": "X%",
         "Year 2": "X%",
         "Year 3": "X%",
@@ -868,22 +1014,85 @@ Rules:
             "Cumulative (5 YR)": "X%"
         }}
     }}
-]
+  ]
+}}
 - Only return raw JSON without any additional text or markdown.
-- Use "N/A" for missing data.
+- Use "N/A" for missing data (use "" for a missing ISIN).
 
 Text to analyze:
 {text}
     """
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0
-    )
-    raw_content = response.choices[0].message.content
-    # Remove any markdown code fences if present
-    cleaned_content = raw_content.strip().replace('```json', '').replace('```', '')
-    return json.loads(cleaned_content)
+    return structured_completion(prompt, "fund_performance", "process_single_fund_performance:v3")["Funds"]
+
+def _as_fund_records(result):
+    """Normalise one file's performance JSON (a list or a single object) into a list of records."""
+    if isinstance(result, dict):
+        return [result]
+    return [record for record in (result or []) if isinstance(record, dict)]
+
+
+def fund_identity(record):
+    """Dedup key for a fund performance record: its ISIN when present, otherwise its normalised name."""
+    isin = re.sub(r"\s+", "", str(record.get("ISIN") or "")).upper()
+    if re.fullmatch(r"[A-Z]{2}[A-Z0-9]{9}\d", isin):
+        return isin
+    return " ".join(re.findall(r"[a-z0-9]+", str(record.get("Fund", "")).lower()))
+
+
+def merge_fund_performance(per_file_results):
+    """
+    Merge per-file performance results into one list, deduplicated by ISIN/fund name.
+    The first record for a fund wins; "N/A" fields are filled in from later duplicates.
+    """
+    merged = {}
+    for result in per_file_results:
+        for record in _as_fund_records(result):
+            key = fund_identity(record)
+            if key not in merged:
+                merged[key] = dict(record)
+                continue
+            existing = merged[key]
+            for field_name, value in record.items():
+                if existing.get(field_name) in (None, "", "N/A", {}) and value not in (None, "", "N/A", {}):
+                    existing[field_name] = value
+    return list(merged.values())
+
+
+def match_fact_sheet(per_file_results, holding_names):
+    """
+    Index of the fact sheet whose funds best match the client's holdings (by name-token overlap).
+    Falls back to the first file that produced any performance records.
+    """
+    holding_tokens = [
+        set(re.findall(r"[a-z0-9]+", str(name).lower()))
+        for name in holding_names if name and str(name).upper() != "TOTAL"
+    ]
+    best_idx, best_score = None, 0.0
+    for idx, result in enumerate(per_file_results):
+        for record in _as_fund_records(result):
+            fund_tokens = set(re.findall(r"[a-z0-9]+", str(record.get("Fund", "")).lower()))
+            for tokens in holding_tokens:
+                if fund_tokens and tokens:
+                    score = len(fund_tokens & tokens) / len(fund_tokens | tokens)
+                    if score > best_score:
+                        best_idx, best_score = idx, score
+    if best_idx is not None:
+        return best_idx
+    for idx, result in enumerate(per_file_results):
+        if _as_fund_records(result):
+            return idx
+    return 0
+
+
+def _performance_per_file(extracted_texts, process_fn):
+    """Run process_fn over every non-empty text in parallel, keeping file order."""
+    tasks = {idx: (process_fn, (text,)) for idx, text in enumerate(extracted_texts) if text.strip()}
+    results, errors = run_concurrently(tasks)
+    if errors:
+        idx = min(errors)
+        raise ValueError(f"Error processing fact sheet {idx + 1}: {errors[idx]}")
+    return [results[idx] for idx in sorted(results)]
+
 
 def extract_fund_performance_with_gpt(extracted_texts):
     """
@@ -891,16 +1100,12 @@ def extract_fund_performance_with_gpt(extracted_texts):
     Processes each text individually using process_single_fund_performance.
     
     Returns:
-    - A list of JSON objects if multiple texts are provided.
-    - A single JSON object if only one text is provided.
+    - For a list: one merged list of fund records (files processed in parallel, deduplicated by ISIN/name).
+    - For a single string: the JSON from that file.
     """
     # Multi-file case: if extracted_texts is a list
     if isinstance(extracted_texts, list):
-        results = []
-        for text in extracted_texts:
-            if text.strip():
-                results.append(process_single_fund_performance(text))
-        return results
+        return merge_fund_performance(_performance_per_file(extracted_texts, process_single_fund_performance))
     else:
         # Single file case
         if extracted_texts.strip():
@@ -915,9 +1120,11 @@ def process_single_dark_star_performance(text: str):
     prompt = f"""
     You are an AI assistant tasked with extracting fund performance details from a financial report.
     Analyze the text below and return a JSON response similar to this format:
-    [
+    {{
+      "Funds": [
         {{
             "Fund": "Dark Star Asset Management Balanced Plus",
+            "ISIN": "",
             "Year 1": "15%",
             "Year 2": "9.7%",
             "Year 3": "6.5%",
@@ -926,7 +1133,8 @@ def process_single_dark_star_performance(text: str):
             "Benchmark": {{}},
             "Cumulative (5 YR)": "33.9%"
         }}
-    ]
+      ]
+    }}
 
     If no benchmark is provided in the text, leave the "Benchmark" field empty.
     **Important Instructions**:
@@ -934,22 +1142,15 @@ def process_single_dark_star_performance(text: str):
         - Map the most recent year as Year 1, the next as Year 2, and so on.
         - If a year has no data, use "N/A".
         - Cumulative performance should only include available years and should be calculated as the sum of those percentages.
+        - Include the fund's ISIN if shown, otherwise "".
 
     Text:
     {text}
     """
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0,
-        )
-        raw_content = response.choices[0].message.content
-        # Clean out any markdown code fences if present
-        cleaned_content = re.sub(r'^```json\s*|\s*```$', '', raw_content, flags=re.DOTALL)
-        return json.loads(cleaned_content)
-    except json.JSONDecodeError as e:
-        raise ValueError(f"Dark Star JSON error: {e}\nResponse: {raw_content}")
+        return structured_completion(prompt, "fund_performance", "process_single_dark_star_performance:v3")["Funds"]
+    except ValueError as e:
+        raise ValueError(f"Dark Star JSON error: {e}")
 
 def extract_dark_star_performance_with_gpt(extracted_texts):
     """
@@ -957,16 +1158,12 @@ def extract_dark_star_performance_with_gpt(extracted_texts):
     Processes each text individually using process_single_dark_star_performance.
     
     Returns:
-    - A list of JSON objects if multiple texts are provided.
-    - A single JSON object if only one text is provided.
+    - For a list: one merged list of fund records (files processed in parallel, deduplicated by ISIN/name).
+    - For a single string: the JSON from that file.
     """
     # Multi-file case
     if isinstance(extracted_texts, list):
-        results = []
-        for text in extracted_texts:
-            if text.strip():
-                results.append(process_single_dark_star_performance(text))
-        return results
+        return merge_fund_performance(_performance_per_file(extracted_texts, process_single_dark_star_performance))
     else:
         # Single file case
         if extracted_texts.strip():
@@ -1026,44 +1223,33 @@ def extract_sap_comparison_with_gpt(extracted_text):
     """
 
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0,
-        )
-        raw_content = response.choices[0].message.content
-        # Clean any markdown fences
-        cleaned_content = re.sub(r'^```json\s*|\s*```$', '', raw_content, flags=re.DOTALL)
-        return json.loads(cleaned_content)
-    except json.JSONDecodeError as e:
-        raise ValueError(f"SAP comparison JSON error: {e}\nResponse: {raw_content}")
+        return structured_completion(prompt, "sap_comparison", "extract_sap_comparison_with_gpt:v2")
+    except ValueError as e:
+        raise ValueError(f"SAP comparison JSON error: {e}")
+
+ANNUITY_QUOTE_FIELDS = ("Purchase Amount", "Monthly Amount", "Yearly Amount", "Yearly Increase")
 
-def extract_annuity_quotes_with_gpt(extracted_text):
+
+def extract_annuity_quotes_with_gpt(extracted_texts):
     """
-    Use GPT to extract annuity quotes details from the extracted text and return a plain text response.
+    Use GPT to extract every annuity quote from all uploaded quote documents in one call.
+
+    Args:
+    - extracted_texts (list[str]): OCR text of each uploaded quote, in upload order.
+
+    Returns:
+    - dict: {"Quotes": [{"Purchase Amount", "Monthly Amount", "Yearly Amount", "Yearly Increase"}, ...]}
+      in document order, as used by create_annuity_quotes_table.
     """
+    if isinstance(extracted_texts, str):
+        extracted_texts = [extracted_texts]
+    documents = "\n\n".join(
+        f"--- Document {idx} ---\n{text}" for idx, text in enumerate(extracted_texts, start=1)
+    )
     prompt = f"""
         ### Instructions:
-        Extract the details of annuity quotes from the provided text and format the output as follows:
-
-        Example Output:
-        Quote 1:
-        - Purchase Amount: £124,030
-        - Monthly Amount: £854
-        - Yearly Amount: £10,250
-        - Yearly Increase: None
-
-        Quote 2:
-        - Purchase Amount: £124,030
-        - Monthly Amount: £603
-        - Yearly Amount: £7,242
-        - Yearly Increase: Retail Price Index (RPI)
-
-        Quote 3:
-        - Purchase Amount: £124,030
-        - Monthly Amount: £668
-        - Yearly Amount: £8,018
-        - Yearly Increase: 3.00%
+        Extract the details of every annuity quote in the documents below. Each document is one
+        uploaded quote and usually holds a single quote. List the quotes in document order.
 
         ### Notes:
         1. **Purchase Amount**:
@@ -1085,103 +1271,131 @@ def extract_annuity_quotes_with_gpt(extracted_text):
             - `"Retail Price Index (RPI)"` for `Increase by RPI`.
             - `"3.00%"` for `Increase 3% per year`.
 
+        Use "" for any value that is not in the document.
+
+        ### Output Format:
+        Return ONLY this JSON object:
+        {{
+          "Quotes": [
+            {{
+              "Purchase Amount": "£124,030",
+              "Monthly Amount": "£854",
+              "Yearly Amount": "£10,250",
+              "Yearly Increase": "None"
+            }}
+          ]
+        }}
+
         ---
 
-        Text to Analyze:
-    {extracted_text}
+        Documents to Analyze:
+    {documents}
     """
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0,
-    )
-    # Return the formatted plain text output
-    return response.choices[0].message.content
+    data = structured_completion(prompt, "annuity_quotes", "extract_annuity_quotes_with_gpt:v3")
+    return {
+        "Quotes": [
+            {field_name: str(quote.get(field_name, "") or "") for field_name in ANNUITY_QUOTE_FIELDS}
+            for quote in data["Quotes"]
+        ]
+    }
+
 
+FEE_METRIC_KEYS = (
+    "Weighted Fund Charge",
+    "Platform Charge",
+    "Ongoing Advice Fee",
+    "Discretionary Fund Manager Charge",
+    "Drawdown Fee",
+    "ProfitShare",
+)
 
-def extract_fund_comparison_with_gpt(fund1_text, fund2_file1_text, fund2_file2_text):
+
+def extract_fee_metrics_with_gpt(extracted_text, role="fund"):
     """
-    Generate a GPT response for fund comparison in the specified short format.
+    Extract one fund's raw fee metrics as structured JSON (no arithmetic).
+
+    Args:
+    - extracted_text (str): Combined text of the fund's documents.
+    - role (str): "fund" for the client's existing (Royal London) fund, "p1" for the P1 benchmark.
+      The role only changes which defaults apply.
+
+    Returns:
+    - dict: {"Provider": "...", "Plan Value": "£...", "Weighted Fund Charge": "X%", ...}
     """
+    if role == "p1":
+        defaults = """
+    - Weighted Fund Charge: if not mentioned, default to 0.44%.
+    - ProfitShare: search for its value; if not mentioned, default to 0.0%.
+    - Discretionary Fund Manager Charge: if not mentioned, default to 0.0%."""
+    else:
+        defaults = """
+    - Weighted Fund Charge: look for phrases like "equivalent to X% of the value of your plan each year." Extract X%.
+    - ProfitShare: always set to -0.15%.
+    - Discretionary Fund Manager Charge: if not mentioned, default to 0.0%."""
+
     prompt = f"""
     ### Role
-    You are a financial data extraction system specialized in processing multi-file texts from investment fund reports. Your task is to analyze the provided text for Royal London and P1 funds and extract fee metrics from sections that start with terms like "Fees and charges", "Service Charges", or "COSTS AND CHARGES ANNUAL SUMMAR". 
+    You are a financial data extraction system. Analyse the fund report text below and extract fee metrics
+    from sections that start with terms like "Fees and charges", "Service Charges", or "COSTS AND CHARGES ANNUAL SUMMAR".
+    Do NOT calculate anything; only extract the raw values.
 
     ### Metrics to Extract:
-    1. **Plan Value**: Locate the plan value associated with the review period by looking for text after "Review dates:".
-    2. **Weighted Fund Charge (WFC)**:
-       - For Royal London: Look for phrases like "equivalent to X% of the value of your plan each year." Extract X%.
-       - For P1: If not mentioned, default to 0.44%.
-    3. **Platform Charge**:
-       - Search for any instance of the word "Platform" or phrases like "[Provider Name] charges" (e.g., "Quilter charges").
-       - Extract the percentage value if available; otherwise, default to 0.0%.
-    4. **Ongoing Advice Fee (OAF / Advice Charges)**:
-       - Look for terms such as "Ongoing Advice Fee", "OAF", "advice fee", or "Advice charges".
-       - Always use a default value of 0.50% if no specific value is found.
-    5. **Discretionary Management Charges**:
-       - Look for any fee that includes the word "Discretionary" (such as "Discretionary Manager fees" or "Discretionary management charges").
-       - For Royal London, if not mentioned, default to 0.0%.
-    6. **Drawdown Fee**:
-       - Search for terms like "Drawdown" or "Product" to extract the fee.
-    7. **ProfitShare**:
-       - For Royal London, always set ProfitShare to -0.15%.
-       - For P1, search for its value; if not mentioned, default to 0.0%.
+    - Provider: the provider name (e.g., "Royal London", "Quilter").
+    - Plan Value: the plan value associated with the review period (text after "Review dates:"). Use "" if not found.
+    - Weighted Fund Charge (WFC).
+    - Platform Charge: any instance of the word "Platform" or phrases like "[Provider Name] charges" (e.g., "Quilter charges"); otherwise 0.0%.
+    - Ongoing Advice Fee: terms such as "Ongoing Advice Fee", "OAF", "advice fee", or "Advice charges"; default 0.50%.
+    - Discretionary Fund Manager Charge: any fee that includes the word "Discretionary".
+    - Drawdown Fee: terms like "Drawdown" or "Product"; otherwise 0.0%.
+    - ProfitShare.
+
+    ### Defaults for this fund:{defaults}
+    - Use "0.0%" for any other missing percentage.
 
     ### Input Text:
-    **Royal London Details**:
-    {fund1_text}
-
-    **P1 Details**:
-    {fund2_file1_text}
-    {fund2_file2_text}
-
-    ### Tasks:
-    - First, identify the section in the text that starts with "Fees and charges", "Service Charges", or "COSTS AND CHARGES ANNUAL SUMMAR".
-    - Within that section, extract each of the metrics listed above along with their percentage values.
-    - If a metric is not mentioned in the text, use the default value as specified.
-    - Multiply each percentage by the Royal London Plan Value to calculate monetary amounts.
-    - Sum these amounts to determine the Total Annual Ongoing Charges for each fund.
-    - Compute the differences between the P1 fund and the Royal London fund for each fee category and overall totals.
-    - Generate a dynamic comparison statement summarizing the fee differences.
+    {extracted_text}
 
     ### Output Format:
-    Return **ONLY** the populated template below with the extracted and calculated values. Do not include any additional explanations or markdown formatting:
-
-    ---
-    Plan value = £[Value]  
-    Weighted Fund Charge % = [Value]% (£[Value])  
-    Platform Charge % = [Value]% (£[Value])  
-    Ongoing Advice Fee % = 0.50% (£[Value])  
-    Discretionary Fund Manager Charge % = [Value]% (£[Value])  
-    Drawdown Fee % = [Value]% (£[Value])  
-    ProfitShare % = -0.15% (£[Value])  
-
-    **P1 Metrics**:  
-    Weighted Fund Charge % = [Value]% (£[Value])  
-    Platform Charge % = [Value]% (£[Value])  
-    Ongoing Advice Fee % = [Value]% (£[Value])  
-    Discretionary Fund Manager Charge % = [Value]% (£[Value])  
-    Drawdown Fee % = [Value]% (£[Value])  
-    ProfitShare % = [Value]% (£[Value])  
-
-    **Total Annual Ongoing Charges**:  
-    - Royal London: [Total_%]% (£[Total_£])  
-    - P1: [Total_P1_%]% (£[Total_P1_£])  
-
-    **Comparison**: [Dynamic_Statement]  
-    ---
-
-    **Rules**:
-    - Use "0.0%" for any missing values.
-    - Format all monetary values as £1,234.56.
-    - Do not include any additional commentary or explanations.
-    """
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0,
+    Return ONLY this JSON object, with percentages as strings like "0.44%" and money like "£123,456.78":
+    {{
+      "Provider": "",
+      "Plan Value": "",
+      "Weighted Fund Charge": "",
+      "Platform Charge": "",
+      "Ongoing Advice Fee": "",
+      "Discretionary Fund Manager Charge": "",
+      "Drawdown Fee": "",
+      "ProfitShare": ""
+    }}
+    """
+    try:
+        metrics = structured_completion(prompt, "fee_metrics", "extract_fee_metrics_with_gpt:v2")
+    except ValueError as e:
+        raise ValueError(f"Fee metrics JSON error: {e}")
+    for key in FEE_METRIC_KEYS:
+        metrics.setdefault(key, "0.0%")
+    return metrics
+
+
+def assemble_fund_comparison(fund_metrics, p1_metrics):
+    """
+    Render the fund comparison template from two structured fee records
+    (see extract_fee_metrics_with_gpt). All amounts, totals and differences are computed
+    locally by fee_calculator, so no model call is involved.
+    """
+    return render_fund_comparison(compute_fee_comparison(fund_metrics, p1_metrics))
+
+
+def extract_fund_comparison_with_gpt(fund1_text, fund2_file1_text, fund2_file2_text=""):
+    """
+    Generate the fund comparison in the specified short format from raw texts.
+    Kept for single comparisons; process_funds_for_comparison extracts P1 once and reuses it.
+    """
+    p1_text = fund2_file1_text if fund2_file2_text in ("", fund2_file1_text) else f"{fund2_file1_text}\n{fund2_file2_text}"
+    return assemble_fund_comparison(
+        extract_fee_metrics_with_gpt(fund1_text, "fund"),
+        extract_fee_metrics_with_gpt(p1_text, "p1"),
     )
-    return response.choices[0].message.content
 
         
                                 
@@ -1222,12 +1436,7 @@ def extract_last_year_performance_text(extracted_text: str) -> str:
     try:
 
         # Call GPT with your prompt
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",  
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0,
-        )
-        final_text = response.choices[0].message.content.strip()
+        final_text = chat_completion(prompt, prompt_version="extract_last_year_performance_text:v1").strip()
         return final_text
 
     except Exception as e:
@@ -1236,20 +1445,21 @@ def extract_last_year_performance_text(extracted_text: str) -> str:
 
 
 
-def generate_iht_section(factfinding_text, plan_texts: list) -> str:
+def generate_iht_section(factfind_digest, plan_texts: list) -> str:
     """
-    Given a FactFinding text and a list of plan report texts, 
+    Given a FactFind digest (see extract_factfind_digest) and a list of plan report texts,
     concatenate all plan texts and generate a single IHT section.
     """
     # Concatenate all plan texts into one string (separated by newlines)
     combined_plan_text = "\n".join(plan_texts)
+    factfind_summary = factfind_estate_summary(factfind_digest)
     
     prompt = f"""
 Analyze the provided data and calculate the IHT liabilities, taking into account the following UK IHT rules and thresholds. Use the client’s address to estimate property value based on typical property prices for the area,
-search the `factfinding_text` for details about the client’s wife, dependents, mortgage, and debts, and include these details in the calculations. and the `combined_plan_text` for investment details.
+use the `factfind_summary` for details about the client’s wife, dependents, property, mortgage, and debts, and include these details in the calculations. and the `combined_plan_text` for investment details.
 
 **Objective**:
-1. Analyze the provided FactFinding document and the combined plan report text.
+1. Analyze the provided FactFind summary and the combined plan report text.
 2. Nil Rate Band (NRB)**:
    - Every individual has a Nil Rate Band (NRB) allowance of £325,000. This amount is **not taxed**.
    - For married couples or civil partners, the unused portion of the NRB can be transferred to the surviving spouse, effectively doubling the NRB to £650,000.
@@ -1264,17 +1474,17 @@ search the `factfinding_text` for details about the client’s wife, dependents,
    - If two names are present: "[Name] [Investment Type] ([Plan Number]) = £[Current Value]"
    - If only one person is present, simply: "[Investment Type] ([Plan Number]) = £[Current Value]"
 6. Wife and Dependents:
-   - Search the `factfinding_text` for information about the client's wife or civil partner and dependents.
+   - Use the `factfind_summary` household and dependents for information about the client's wife or civil partner and dependents.
    - If a wife or civil partner is found, include their NRB (£325,000) and RNRB (£175,000) in the calculations.
    - Use details about dependents (e.g., children or grandchildren) to determine eligibility for the RNRB.
 
 7.Mortgage and Debts:
-   - Search the `factfinding_text` for any mortgage, loans, or debts.
+   - Use the `factfind_summary` debts for any mortgage, loans, or debts.
 8. Pensions:
    - Include pensions invesments values where applicable from the product report.     
 9. Then calculate the summary values:
    - Total Taxable Estate = Sum of all current values.
-   - Mortgage and Debts: Extract from the FactFinding document (assume £0.00 if none).
+   - Mortgage and Debts: Take from the FactFind summary (assume £0.00 if none).
    - If one person use Nil Rate Band if more than one (husbund, wife, childern) use Nil Rate Band x2 = £<value>
    - If one person use Residence Nil Rate Band if more than one (husbund, wife, childern) use Residence Nil Rate Band x2 = £<value>
    - Remaining Estate = Total Taxable Estate - (Nil Rate Band x2 + Residence Nil Rate Band x2 + Mortgage and Debts). If negative, set to £0.00.
@@ -1283,8 +1493,8 @@ search the `factfinding_text` for details about the client’s wife, dependents,
 10. Output the results as bullet points, one per line.
 
 **Input Data**:
-1. FactFinding Document:
-{factfinding_text}
+1. FactFind Summary (JSON):
+{factfind_summary}
 
 2. Combined Plan Report Text:
 {combined_plan_text}
@@ -1304,12 +1514,7 @@ Return only bullet points with each investment line and the summary rows exactly
 - Tax @ 40% = £<value>
 """
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0
-        )
-        iht_text = response.choices[0].message.content.strip()
+        iht_text = chat_completion(prompt, prompt_version="generate_iht_section:v2").strip()
         return iht_text
     except Exception as e:
         raise RuntimeError("Error generating IHT section: " + repr(e))
@@ -1323,21 +1528,8 @@ def create_plan_report_table(doc, plan_report_data):
     { "Provider": "", "Plan Number": "", "Plan Type": "", "Current Value": "" }.
     """
     doc.add_heading("Plan Report Details", level=2)
-    table = doc.add_table(rows=1, cols=4)
-    table.style = 'Table Grid'
-    hdr_cells = table.rows[0].cells
-
-    hdr_cells[0].text = "Provider"
-    hdr_cells[1].text = "Plan Number"
-    hdr_cells[2].text = "Plan Type"
-    hdr_cells[3].text = "Current Value"
-
-    for plan in plan_report_data:
-        row_cells = table.add_row().cells
-        row_cells[0].text = plan.get("Provider", "")
-        row_cells[1].text = plan.get("Plan Number", "")
-        row_cells[2].text = plan.get("Plan Type", "")
-        row_cells[3].text = plan.get("Current Value", "")
+    columns = ("Provider", "Plan Number", "Plan Type", "Current Value")
+    add_table(doc, [[plan.get(column, "") for column in columns] for plan in plan_report_data], header=columns)
 
 def create_comparison_table(document, sap_comparison_dict):
     """
@@ -1357,26 +1549,15 @@ def create_comparison_table(document, sap_comparison_dict):
     row_labels = [key for key in table_data.keys() if key != "Assumed Growth Rates"]
     header = [""] + growth_rates
 
-    table = document.add_table(rows=len(row_labels) + 1, cols=len(header))
-    table.style = "Table Grid"
-
-    # Fill in the header row
-    for col_idx, hdr in enumerate(header):
-        table.cell(0, col_idx).text = hdr
-
-    # Fill in each row
-    for row_idx, label in enumerate(row_labels, start=1):
-        table.cell(row_idx, 0).text = label
+    rows = []
+    for label in row_labels:
         row_data = table_data.get(label, [])
-        for col_idx in range(len(growth_rates)):
-            val = row_data[col_idx] if col_idx < len(row_data) else "N/A"
-            table.cell(row_idx, col_idx + 1).text = val
-
-    return table
+        rows.append([label] + [row_data[idx] if idx < len(row_data) else "N/A" for idx in range(len(growth_rates))])
+    return add_table(document, rows, header=header)
 
 
 
-def add_investment_holdings_tables(document: Document, portfolio_data):
+def add_investment_holdings_tables(document: "Document", portfolio_data):
     """
     Inserts one or more Investment Holdings tables into the 'document'.
 
@@ -1392,61 +1573,33 @@ def add_investment_holdings_tables(document: Document, portfolio_data):
         }
     """
 
-    # If multiple portfolio JSON objects exist, handle them in a loop
+    # If multiple portfolio JSON objects exist, each gets its own numbered table
     if isinstance(portfolio_data, list):
-        # Insert each portfolio's table
-        for idx, single_portfolio in enumerate(portfolio_data, start=1):
-            holdings = single_portfolio.get("Holdings", [])
-            # Add a heading or some label to indicate which file this table belongs to
-            document.add_heading(f"Investment Holdings (File {idx})", level=2)
-
-            # Create the table in the same Document
-            table = document.add_table(rows=1, cols=3)
-            table.style = "Table Grid"
-
-            # Fill header row
-            hdr_cells = table.rows[0].cells
-            hdr_cells[0].text = "Fund"
-            hdr_cells[1].text = "Value"
-            hdr_cells[2].text = "Percent"
-
-            # Fill rows
-            for h in holdings:
-                row_cells = table.add_row().cells
-                row_cells[0].text = str(h.get("Fund", ""))
-                row_cells[1].text = str(h.get("Value", ""))
-                row_cells[2].text = str(h.get("Percent", ""))
-
-            document.add_paragraph("")  # extra spacing
+        portfolios = [(f"Investment Holdings (File {idx})", single_portfolio)
+                      for idx, single_portfolio in enumerate(portfolio_data, start=1)]
     else:
-        # We only have a single portfolio JSON
-        single_portfolio = portfolio_data
-        holdings = single_portfolio.get("Holdings", [])
-
-        document.add_heading("Investment Holdings", level=2)
-        table = document.add_table(rows=1, cols=3)
-        table.style = "Table Grid"
-
-        # Fill header row
-        hdr_cells = table.rows[0].cells
-        hdr_cells[0].text = "Fund"
-        hdr_cells[1].text = "Value"
-        hdr_cells[2].text = "Percent"
-
-        # Fill rows
-        for h in holdings:
-            row_cells = table.add_row().cells
-            row_cells[0].text = str(h.get("Fund", ""))
-            row_cells[1].text = str(h.get("Value", ""))
-            row_cells[2].text = str(h.get("Percent", ""))
+        portfolios = [("Investment Holdings", portfolio_data)]
 
-        document.add_paragraph("")
+    for heading, single_portfolio in portfolios:
+        holdings = single_portfolio.get("Holdings", [])
+        document.add_heading(heading, level=2)
+        add_table(
+            document,
+            [[str(h.get("Fund", "")), str(h.get("Value", "")), str(h.get("Percent", ""))] for h in holdings],
+            header=("Fund", "Value", "Percent"),
+        )
+        document.add_paragraph("")  # extra spacing
 
 
 
-"""
 def create_annuity_quotes_table(document, annuity_quotes):
-  
+    """
+    Add the annuity quotes as a table: one column per quote, one row per attribute.
+
+    Args:
+    - document (Document): The Word document to append to.
+    - annuity_quotes (dict): {"Quotes": [...]} as returned by extract_annuity_quotes_with_gpt.
+    """
     if not annuity_quotes or "Quotes" not in annuity_quotes:
         raise ValueError("Invalid annuity quotes data.")
 
@@ -1455,265 +1608,239 @@ def create_annuity_quotes_table(document, annuity_quotes):
     # Add a heading for the table
     document.add_heading("Annuity Quotes", level=2)
 
-    # Create the table with rows for attributes and a header for quotes
-    table = document.add_table(rows=5, cols=len(quotes) + 1)
-    table.style = 'Table Grid'
+    # One row per attribute, one column per quote (Quote 1, Quote 2, etc.)
+    header = [""] + [f"Quote {idx + 1}" for idx in range(len(quotes))]
+    rows = [[attribute] + [str(quote.get(attribute, "")) for quote in quotes] for attribute in ANNUITY_QUOTE_FIELDS]
+    return add_table(document, rows, header=header)
+ 
 
-    # Fill the first cell in the header with an empty label
-    table.cell(0, 0).text = ""
+def _sap_comparison_note(sc_table):
+    """The explanation printed under one SAP comparison table, from its critical yield."""
+    age = sc_table.get("Age", "N/A")
+    # Search for a row key containing "Effect on Fund if Moved"
+    effect_key = None
+    for key in sc_table["Table"].keys():
+        if "Effect on Fund if Moved" in key:
+            effect_key = key
+            break
+    if effect_key:
+        effect_values = sc_table["Table"].get(effect_key, ["N/A", "N/A", "N/A"])
+        if len(effect_values) != 3:
+            effect_values = ["N/A", "N/A", "N/A"]
+        try:
+            middle_value_str = effect_values[1]
+            middle_value = float(middle_value_str.strip('%').strip()) if middle_value_str != "N/A" else 0.0
+        except ValueError:
+            middle_value = 0.0
+    else:
+        middle_value_str = "N/A"
+        middle_value = 0.0
+
+    if middle_value < 0.0:
+        return (
+            f"The critical yield required to match the benefits of your current scheme at age {age} "
+            f"is {middle_value_str}, indicating that the proposed arrangement would need less performance "
+            f"per annum to make up the costs of transferring. This is because the proposed arrangement "
+            "is more cost-effective than your current arrangement."
+        )
+    elif 0.0 <= middle_value < 3.0:
+        return (
+            f"The critical yield required to match the benefits of your current scheme at age {age} "
+            f"is {middle_value_str}, indicating that the proposed arrangement would need an additional "
+            f"fund performance per annum to make up the costs of transferring.\n\n"
+            "I believe the chosen fund will be able to achieve this over the long term, although this is not guaranteed."
+        )
+    return (
+        f"The critical yield required to match the benefits of your current scheme at age {age} "
+        f"is {middle_value_str}, indicating that the proposed arrangement would need an additional "
+        f"performance per annum to make up the costs of transferring.\n\n"
+        "I cannot guarantee that the recommended fund can match the additional performance required to make up the costs of transferring, "
+        "but I still believe that transferring out is in your best interests. Performance is only one consideration to make when transferring out."
+    )
 
-    # Add headers for Quotes (Quote 1, Quote 2, etc.)
-    for idx in range(len(quotes)):
-        table.cell(0, idx + 1).text = f"Quote {idx + 1}"
 
-    # Define the rows for attributes
-    attributes = ["Purchase Amount", "Monthly Amount", "Yearly Amount", "Yearly Increase"]
+# ---- Section renderers: placeholder -> renderer(context, document) -> replacement text ----
+# context holds the create_new_document arguments plus "client_details". Renderers that
+# insert tables or headings append them to the document; report_template.render_template
+# moves them to where the placeholder was.
 
-    for row_idx, attribute in enumerate(attributes, start=1):
-        # Add the attribute name to the first column
-        table.cell(row_idx, 0).text = attribute
-        # Fill in the data for each quote
-        for col_idx, quote in enumerate(quotes):
-            table.cell(row_idx, col_idx + 1).text = quote.get(attribute, "")
 
-    return table
-    
-    """
- 
+def _client_detail(name):
+    return lambda context, document: context["client_details"].get(name, "")
 
-def create_new_document(template_path, factfinding_text, plan_review_paragraphs, portfolio_json, attitude_to_risk,
-                        table_data, product_report_text, plan_report_text, last_year_performance_text,
-                        fund_performance_data, dark_star_performance_data, sap_comparison_tables,
-                        annuity_quotes_text, fund_comparison_text, plan_review_texts,
-                        safe_withdrawal_text,iht_text, output_path):
-    """
-    Create a well-formatted document by replacing placeholders, appending tables,
-    and inserting dynamically generated sections while preserving static text.
-    """
 
- # Parse client details from GPT response
-    client_details_json_str = extract_client_details_with_gpt(factfinding_text)
-    try:
-        client_details = extract_client_details_with_gpt(factfinding_text)
-    except json.JSONDecodeError as e:
-        raise ValueError(
-            "Error parsing client details JSON: " + repr(e) +
-            "\nRaw GPT Response:\n" + client_details_json_str
-        )
-    """# Validate risk details
-    if not isinstance(risk_details, dict):
-        raise ValueError(f"Expected risk_details to be a dictionary, but got: {type(risk_details)}")"""
+def _render_report_date(context, document):
+    return context["client_details"].get("Today’s date") or format_report_date()
 
-    # Generate dynamic sections
-    current_situation = generate_current_situation(factfinding_text)
-    priorities_and_objectives = generate_priorities_and_objectives(factfinding_text)
 
-    pension_review_section = generate_pension_review_section(product_report_text)
-    swr_section = safe_withdrawal_text
-    
+def _render_plan_reviews(context, document):
+    document.add_heading("Plan Reviews", level=2)
+    for review in context["plan_review_paragraphs"]:
+        document.add_paragraph(review)
+    return ""
 
-    # Load the template
-    original_doc = Document(template_path)
-    new_doc = Document()
 
-  
-    # Replace placeholders while preserving static text
-    for paragraph in original_doc.paragraphs:
-        text = paragraph.text
-
-        # Replace placeholders dynamically
-        if "{Full name}" in text:
-            text = text.replace("{Full name}", client_details.get("Full name", ""))
-        if "{Address}" in text:
-            text = text.replace("{Address}", client_details.get("Address", ""))
-        if "{Today’s date}" in text:
-            text = text.replace("{Today’s date}", client_details.get("Today’s date", ""))
-        if "{salutation}" in text:
-            text = text.replace("{salutation}", client_details.get("salutation", ""))
-        if "{Current_Situation}" in text:
-            text = text.replace("{Current_Situation}", current_situation)
-        if "{Priorities_and_Objectives}" in text:
-            text = text.replace("{Priorities_and_Objectives}", priorities_and_objectives)
-        if "{Attitude_to_Risk}" in text:
-            text = text.replace("{Attitude_to_Risk}", attitude_to_risk or "")
-        if "{Review of Existing Royal London Personal Pension}" in text:
-            text = text.replace("{Review of Existing Royal London Personal Pension}", "")  # Remove placeholder
-            new_doc.add_heading("Plan Reviews", level=2)
-            for review in plan_review_paragraphs:
-                new_doc.add_paragraph(review)
-
-
-        if "{Safe Withdrawal Rate (SWR)}" in text:
-            text = text.replace("{Safe Withdrawal Rate (SWR)}", swr_section)
-
-        # Handle the {table} placeholder
-        if "{table1}" in text:
-            paragraph.text = "Overview of Current Investments\nHere is a breakdown of your current investments."
-            create_plan_report_table(new_doc, table_data)  # Insert table right after the paragraph
-            continue
-        # Handle the {table2-1} placeholder for fund performance
-
-        # Example placeholder for last-year performance
-        if "{Last_Year_Performance}" in text:
-            # If last_year_performance_text is provided, use it
-            if last_year_performance_text:
-                text = text.replace("{Last_Year_Performance}", last_year_performance_text)
-            else:
-                text = text.replace("{Last_Year_Performance}", "No single-year performance data found.")
-        # Check for the new Investment_holdings placeholder
-
-        if "{Investment_holdings}" in text:
-            # Remove the placeholder from the paragraph text
-            text = text.replace("{Investment_holdings}", "")
-            # Insert the tables for one or more portfolios
-            if portfolio_json:
-                add_investment_holdings_tables(new_doc, portfolio_json)
-            else:
-                new_doc.add_paragraph("No portfolio data found for Investment Holdings.")
-
-
-        if "{table2-1}" in text:
-            bullet_points = "Extracted Fund Performance\n\n"
-            # Ensure fund_performance_data is a list so we can iterate over it
-            if not isinstance(fund_performance_data, list):
-                fund_performance_data = [fund_performance_data]
-            for fund in fund_performance_data:
-                bullet_points += f"**{fund['Fund']}**\n"
-                for year in range(1, 6):
-                    year_key = f"Year {year}"
-                    benchmark_key = fund.get("Benchmark", {}).get(year_key, "N/A")
-                    year_value = fund.get(year_key, "N/A")
-                    bullet_points += f"- {year_key}: {year_value} (Benchmark: {benchmark_key})\n"
-                cumulative_performance = fund.get("Cumulative (5 YR)", "N/A")
-                cumulative_benchmark = fund.get("Benchmark", {}).get("Cumulative (5 YR)", "N/A")
-                bullet_points += f"- Cumulative 5-Year Performance: {cumulative_performance} (Benchmark: {cumulative_benchmark})\n\n"
-            text = text.replace("{table2-1}", bullet_points.strip())
-
-
-                # Handle the {table2-2} placeholder for Dark Star performance
-        if "{table2-2}" in text:
-            bullet_points = "Extracted Dark Star Performance\n\n"
-            # Ensure dark_star_performance_data is iterable (a list)
-            if not isinstance(dark_star_performance_data, list):
-                dark_star_performance_data = [dark_star_performance_data]
-            for fund in dark_star_performance_data:
-                bullet_points += f"**{fund.get('Fund', 'Unknown Fund')}**\n"
-                for year in range(1, 6):
-                    year_key = f"Year {year}"
-                    year_value = fund.get(year_key, "N/A")
-                    bullet_points += f"- {year_key}: {year_value}\n"
-                cumulative_performance = fund.get("Cumulative (5 YR)", "N/A")
-                bullet_points += f"- Cumulative 5-Year Performance: {cumulative_performance}\n\n"
-            text = text.replace("{table2-2}", bullet_points.strip())
-
-
-                # Handle placeholders
-        # Handle the {table3-1} placeholder for SAP comparison tables (multiple files)
-        # Handle the {table3-1} placeholder for SAP comparison tables (multiple files)
-        if "{table3-1}" in text:
-            text = text.replace("{table3-1}", "")
-            if sap_comparison_tables:
-                for sc_table in sap_comparison_tables:
-                    age = sc_table.get("Age", "N/A")
-                    # Search for a row key containing "Effect on Fund if Moved"
-                    effect_key = None
-                    for key in sc_table["Table"].keys():
-                        if "Effect on Fund if Moved" in key:
-                            effect_key = key
-                            break
-                    if effect_key:
-                        effect_values = sc_table["Table"].get(effect_key, ["N/A", "N/A", "N/A"])
-                        if len(effect_values) != 3:
-                            effect_values = ["N/A", "N/A", "N/A"]
-                        try:
-                            middle_value_str = effect_values[1]
-                            middle_value = float(middle_value_str.strip('%').strip()) if middle_value_str != "N/A" else 0.0
-                        except ValueError:
-                            middle_value = 0.0
-                    else:
-                        middle_value_str = "N/A"
-                        middle_value = 0.0
-
-                    # Build explanatory text based on the middle value
-                    if middle_value < 0.0:
-                        below_table_text = (
-                            f"The critical yield required to match the benefits of your current scheme at age {age} "
-                            f"is {middle_value_str}, indicating that the proposed arrangement would need less performance "
-                            f"per annum to make up the costs of transferring. This is because the proposed arrangement "
-                            "is more cost-effective than your current arrangement."
-                        )
-                    elif 0.0 <= middle_value < 3.0:
-                        below_table_text = (
-                            f"The critical yield required to match the benefits of your current scheme at age {age} "
-                            f"is {middle_value_str}, indicating that the proposed arrangement would need an additional "
-                            f"fund performance per annum to make up the costs of transferring.\n\n"
-                            "I believe the chosen fund will be able to achieve this over the long term, although this is not guaranteed."
-                        )
-                    else:
-                        below_table_text = (
-                            f"The critical yield required to match the benefits of your current scheme at age {age} "
-                            f"is {middle_value_str}, indicating that the proposed arrangement would need an additional "
-                            f"performance per annum to make up the costs of transferring.\n\n"
-                            "I cannot guarantee that the recommended fund can match the additional performance required to make up the costs of transferring, "
-                            "but I still believe that transferring out is in your best interests. Performance is only one consideration to make when transferring out."
-                        )
-
-                    heading = f"Comparison at Age {age}"
-                    paragraph_before_table = (
-                        f"The table below shows the projected value of your pensions at the age of {age}, firstly if it were to remain in your current arrangement and secondly were it to be transferred."
-                    )
-                    new_doc.add_heading(heading, level=2)
-                    new_doc.add_paragraph(paragraph_before_table)
-                    create_comparison_table(new_doc, sc_table)
-                    new_doc.add_paragraph("")  # Blank line after the table
-                    new_doc.add_paragraph(below_table_text)
-            
-
-        # Insert Annuity Quotes text (if any)
-        if "{Annuity_Quotes}" in text:
-            if annuity_quotes_text:
-                text = text.replace("{Annuity_Quotes}", annuity_quotes_text)
-            else:
-                text = text.replace("{Annuity_Quotes}", "No annuity quotes available.")
-
-                # Replace placeholder for Fund Comparison
-        if "{Fund_Comparison}" in text:
-            text = text.replace("{Fund_Comparison}", fund_comparison_text)  
-
-# Handle the {IHT_Table} placeholder with bullet points
-        if "{IHT_Text}" in text:
-            text = text.replace("{IHT_Text}", iht_text)
-        # Add formatted paragraph to the new document
-        new_paragraph = new_doc.add_paragraph(text)
-        new_paragraph.style = new_doc.styles['Normal']
-        new_paragraph.paragraph_format.space_before = Pt(6)
-        new_paragraph.paragraph_format.space_after = Pt(6)
-        new_paragraph.paragraph_format.line_spacing = Pt(12)  # Set consistent line spacing
-        new_paragraph.alignment = WD_PARAGRAPH_ALIGNMENT.LEFT
-
-    # Adjust document margins
-    section = new_doc.sections[0]
-    section.top_margin = Inches(1)
-    section.bottom_margin = Inches(1)
-    section.left_margin = Inches(1)
-    section.right_margin = Inches(1)
-
-    # Save the combined document
-    new_doc.save(output_path)
-    print(f"Debug: Document saved successfully at {output_path}")
-
-
-    return swr_section
-
-
-def save_uploaded_file(uploaded_file, folder):
-    import os
-    os.makedirs(folder, exist_ok=True)
-    file_path = os.path.join(folder, uploaded_file.name)
-    
-    # Make absolutely sure we write the entire buffer
-    with open(file_path, "wb") as f:
-        f.write(uploaded_file.getbuffer())  # <-- getbuffer instead of read()
+def _render_plan_table(context, document):
+    create_plan_report_table(document, context["table_data"])
+    return ""
 
-    return file_path
 
+def _render_investment_holdings(context, document):
+    if context["portfolio_json"]:
+        add_investment_holdings_tables(document, context["portfolio_json"])
+    else:
+        document.add_paragraph("No portfolio data found for Investment Holdings.")
+    return ""
+
+
+def _render_fund_performance(context, document):
+    fund_performance_data = context["fund_performance_data"]
+    # Ensure fund_performance_data is a list so we can iterate over it
+    if not isinstance(fund_performance_data, list):
+        fund_performance_data = [fund_performance_data]
+    bullet_points = "Extracted Fund Performance\n\n"
+    for fund in fund_performance_data:
+        bullet_points += f"**{fund['Fund']}**\n"
+        for year in range(1, 6):
+            year_key = f"Year {year}"
+            benchmark_key = fund.get("Benchmark", {}).get(year_key, "N/A")
+            year_value = fund.get(year_key, "N/A")
+            bullet_points += f"- {year_key}: {year_value} (Benchmark: {benchmark_key})\n"
+        cumulative_performance = fund.get("Cumulative (5 YR)", "N/A")
+        cumulative_benchmark = fund.get("Benchmark", {}).get("Cumulative (5 YR)", "N/A")
+        bullet_points += f"- Cumulative 5-Year Performance: {cumulative_performance} (Benchmark: {cumulative_benchmark})\n\n"
+    return bullet_points.strip()
+
+
+def _render_dark_star_performance(context, document):
+    dark_star_performance_data = context["dark_star_performance_data"]
+    # Ensure dark_star_performance_data is iterable (a list)
+    if not isinstance(dark_star_performance_data, list):
+        dark_star_performance_data = [dark_star_performance_data]
+    bullet_points = "Extracted Dark Star Performance\n\n"
+    for fund in dark_star_performance_data:
+        bullet_points += f"**{fund.get('Fund', 'Unknown Fund')}**\n"
+        for year in range(1, 6):
+            year_key = f"Year {year}"
+            year_value = fund.get(year_key, "N/A")
+            bullet_points += f"- {year_key}: {year_value}\n"
+        cumulative_performance = fund.get("Cumulative (5 YR)", "N/A")
+        bullet_points += f"- Cumulative 5-Year Performance: {cumulative_performance}\n\n"
+    return bullet_points.strip()
+
+
+def _render_sap_comparisons(context, document):
+    # One "Comparison at Age" block per SAP report
+    for sc_table in context["sap_comparison_tables"] or []:
+        age = sc_table.get("Age", "N/A")
+        document.add_heading(f"Comparison at Age {age}", level=2)
+        document.add_paragraph(
+            f"The table below shows the projected value of your pensions at the age of {age}, firstly if it were to remain in your current arrangement and secondly were it to be transferred."
+        )
+        create_comparison_table(document, sc_table)
+        document.add_paragraph("")  # Blank line after the table
+        document.add_paragraph(_sap_comparison_note(sc_table))
+    return ""
+
+
+def _render_annuity_quotes(context, document):
+    annuity_quotes = context["annuity_quotes"]
+    if annuity_quotes and annuity_quotes.get("Quotes"):
+        create_annuity_quotes_table(document, annuity_quotes)
+        document.add_paragraph("")
+        return ""
+    return "No annuity quotes available."
+
+
+SECTION_RENDERERS = {
+    "{Full name}": _client_detail("Full name"),
+    "{Address}": _client_detail("Address"),
+    "{salutation}": _client_detail("salutation"),
+    "{Today’s date}": _render_report_date,
+    "{Current_Situation}": lambda context, document: format_current_situation(context["factfind_digest"]),
+    "{Priorities_and_Objectives}": lambda context, document: format_priorities_and_objectives(context["factfind_digest"]),
+    "{Attitude_to_Risk}": lambda context, document: context["attitude_to_risk"] or "",
+    "{Review of Existing Royal London Personal Pension}": _render_plan_reviews,
+    "{Safe Withdrawal Rate (SWR)}": lambda context, document: context["safe_withdrawal_text"] or "",
+    "{table1}": _render_plan_table,
+    "{Last_Year_Performance}": lambda context, document: (
+        context["last_year_performance_text"] or "No single-year performance data found."
+    ),
+    "{Investment_holdings}": _render_investment_holdings,
+    "{table2-1}": _render_fund_performance,
+    "{table2-2}": _render_dark_star_performance,
+    "{table3-1}": _render_sap_comparisons,
+    "{Annuity_Quotes}": _render_annuity_quotes,
+    "{Fund_Comparison}": lambda context, document: context["fund_comparison_text"] or "",
+    "{IHT_Text}": lambda context, document: context["iht_text"] or "",
+}
+# Styles the renderers use, copied in when a template doesn't define them
+RENDERER_STYLES = ("Heading 2", "Table Grid")
+
+
+@traced("document", bytes_in=lambda template_path, *args, **kwargs: file_sizes(template_path))
+def create_new_document(template_path, factfind_digest, plan_review_paragraphs, portfolio_json, attitude_to_risk,
+                        table_data, product_report_text, plan_report_text, last_year_performance_text,
+                        fund_performance_data, dark_star_performance_data, sap_comparison_tables,
+                        annuity_quotes, fund_comparison_text, plan_review_texts,
+                        safe_withdrawal_text,iht_text, output_path=None):
+    """
+    Fill the template's placeholders in place (body, tables, headers and footers). The
+    template's styles, page set-up and static text are kept; tables and headings go where
+    their placeholder was. See SECTION_RENDERERS for what each placeholder becomes, and
+    report_template.py for the compiled template index.
+
+    The document is built in memory; output_path (a file path or a writable stream) is
+    optional and only needed when a copy should be written as well.
+
+    Returns:
+    - bytes: The .docx file.
+    """
+    from docx import Document
+
+    document = Document(template_path)
+    index = template_index(template_path, document)
+    ensure_styles(document, RENDERER_STYLES)
+
+    # FactFind-based sections all come from the single FactFind digest (no GPT calls here;
+    # plan reviews also arrive precomputed per PlanDocument)
+    context = {
+        "client_details": (factfind_digest or {}).get("client_details", {}),
+        "factfind_digest": factfind_digest or {},
+        "plan_review_paragraphs": plan_review_paragraphs,
+        "portfolio_json": portfolio_json,
+        "attitude_to_risk": attitude_to_risk,
+        "table_data": table_data,
+        "last_year_performance_text": last_year_performance_text,
+        "fund_performance_data": fund_performance_data,
+        "dark_star_performance_data": dark_star_performance_data,
+        "sap_comparison_tables": sap_comparison_tables,
+        "annuity_quotes": annuity_quotes,
+        "fund_comparison_text": fund_comparison_text,
+        "safe_withdrawal_text": safe_withdrawal_text,
+        "iht_text": iht_text,
+    }
+    render_template(document, index, SECTION_RENDERERS, context)
+
+    buffer = io.BytesIO()
+    document.save(buffer)
+    data = buffer.getvalue()
+    if isinstance(output_path, (str, os.PathLike)):
+        with open(output_path, "wb") as f:
+            f.write(data)
+        logger.debug("Document saved successfully at %s", output_path)
+    elif output_path is not None:
+        output_path.write(data)
+    return data
+
+
+def local_path(file, spool=None):
+    """Path on disk of a local file path or an upload (uploads are spooled once by content, see spool.py)."""
+    return (spool or default_spool()).path(file)
+
+
+def file_display_name(file):
+    """File name of a local path or an upload, for messages."""
+    if isinstance(file, (str, os.PathLike)):
+        return os.path.basename(os.fspath(file))
+    return file.name
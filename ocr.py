@@ -0,0 +1,234 @@
+"""
+OCR helpers shared by logic.py and the PDF worker pool (see pdf_text.py).
+
+Kept free of Streamlit/OpenAI imports, and OCR libraries load on first use, so pool
+workers and logic.py can import it cheaply.
+
+Two backends sit behind ocr_image():
+  - "tesserocr": a persistent in-process Tesseract engine (libtesseract via tesserocr). The
+    language model is loaded once per thread and reused for every image, so there is no
+    process start-up or traineddata reload per call. PDF pool workers keep theirs for life.
+  - "pytesseract": the original fallback, one /usr/bin/tesseract subprocess per image.
+
+OCR_BACKEND picks one ("auto" = tesserocr when it is installed and can load its language
+data, otherwise pytesseract). Per-image latency is recorded per backend; see ocr_latency_stats().
+
+ocr_files() OCRs a batch of image files across the shared process pool (scheduler.py),
+keeping input order. Images may be paths or in memory (see spool.py); in-memory images go
+to the workers as bytes, without a copy on disk.
+"""
+import os
+import platform
+import threading
+import time
+from collections import deque
+
+from scheduler import map_in_processes
+from spool import as_buffer, as_readable, is_path
+
+# Resolution used when rasterising PDF pages that have no text layer
+OCR_DPI = 300
+OCR_BACKEND = os.getenv("OCR_BACKEND", "auto")  # auto | tesserocr | pytesseract
+OCR_LANG = os.getenv("OCR_LANG", "eng")
+# Latency samples kept per backend for ocr_latency_stats()
+LATENCY_SAMPLES = 1000
+
+
+def configure_tesseract():
+    """Set the Tesseract executable path based on the OS."""
+    import pytesseract
+
+    if platform.system() == 'Windows':
+        pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+    else:  # For Linux (Streamlit Cloud) and macOS
+        pytesseract.pytesseract.tesseract_cmd = '/usr/bin/tesseract'
+
+
+class PytesseractBackend:
+    """Fallback: shells out to the tesseract binary for every image."""
+
+    name = "pytesseract"
+
+    def __init__(self):
+        # Imported here: pytesseract pulls in pandas when available, which is slow to load
+        import pytesseract
+
+        configure_tesseract()
+        self._pytesseract = pytesseract
+
+    def ocr(self, image):
+        return self._pytesseract.image_to_string(image, lang=OCR_LANG)
+
+
+class TesserocrBackend:
+    """
+    Persistent engine: one tesserocr.PyTessBaseAPI per thread, created on first use and
+    kept for the life of the thread (the API handle is not thread-safe, so it isn't shared).
+    """
+
+    name = "tesserocr"
+
+    def __init__(self):
+        import tesserocr
+
+        self._tesserocr = tesserocr
+        self._local = threading.local()
+        self._handles = []
+        self._lock = threading.Lock()
+        # Fail here (not on the first image) if the language data can't be loaded
+        self._api()
+
+    def _api(self):
+        api = getattr(self._local, "api", None)
+        if api is None:
+            tessdata = os.getenv("TESSDATA_PREFIX")
+            if tessdata:
+                api = self._tesserocr.PyTessBaseAPI(path=tessdata, lang=OCR_LANG)
+            else:
+                api = self._tesserocr.PyTessBaseAPI(lang=OCR_LANG)
+            self._local.api = api
+            with self._lock:
+                self._handles.append(api)
+        return api
+
+    def ocr(self, image):
+        api = self._api()
+        api.SetImage(image)
+        try:
+            return api.GetUTF8Text()
+        finally:
+            api.Clear()
+
+    def close(self):
+        with self._lock:
+            for api in self._handles:
+                api.End()
+            self._handles = []
+        self._local = threading.local()
+
+
+_backends = {}
+_backend_lock = threading.Lock()
+_latencies = {}
+
+
+def _load_backend(name):
+    if name == "tesserocr":
+        return TesserocrBackend()
+    if name == "pytesseract":
+        return PytesseractBackend()
+    raise ValueError(f"Unknown OCR backend: {name!r}")
+
+
+def get_backend(name=None):
+    """
+    The OCR backend to use, created once per process.
+
+    Args:
+    - name (str): "tesserocr", "pytesseract" or "auto" (default: OCR_BACKEND).
+
+    Returns:
+    - An object with a .name and an .ocr(image) -> str method.
+    """
+    name = name or OCR_BACKEND
+    with _backend_lock:
+        if name not in _backends:
+            if name == "auto":
+                try:
+                    backend = _load_backend("tesserocr")
+                except Exception:
+                    # tesserocr not installed or no traineddata: one subprocess per image
+                    backend = _load_backend("pytesseract")
+            else:
+                backend = _load_backend(name)
+            _backends[name] = backend
+        return _backends[name]
+
+
+def _record_latency(backend_name, seconds):
+    samples = _latencies.get(backend_name)
+    if samples is None:
+        samples = _latencies.setdefault(backend_name, deque(maxlen=LATENCY_SAMPLES))
+    samples.append(seconds)
+
+
+def _percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def ocr_latency_stats():
+    """
+    Per-image OCR latency of this process, per backend.
+
+    Returns:
+    - dict: {backend name: {"images", "mean_ms", "p50_ms", "p95_ms", "max_ms"}}
+    """
+    stats = {}
+    for name, samples in list(_latencies.items()):
+        values = sorted(samples)
+        if not values:
+            continue
+        stats[name] = {
+            "images": len(values),
+            "mean_ms": round(1000 * sum(values) / len(values), 1),
+            "p50_ms": round(1000 * _percentile(values, 0.50), 1),
+            "p95_ms": round(1000 * _percentile(values, 0.95), 1),
+            "max_ms": round(1000 * values[-1], 1),
+        }
+    return stats
+
+
+def ocr_image(image, backend=None):
+    """
+    Extract text from a PIL image using Tesseract OCR.
+
+    Args:
+    - image (PIL.Image.Image): The image to read.
+    - backend (str): Force a backend for this call (default: OCR_BACKEND).
+
+    Returns:
+    - str: Extracted text.
+    """
+    engine = get_backend(backend)
+    start = time.perf_counter()
+    text = engine.ocr(image)
+    _record_latency(engine.name, time.perf_counter() - start)
+    return text
+
+
+def ocr_file(path, preprocess=False):
+    """
+    Worker: OCR one image file.
+
+    Args:
+    - path (str): Path to a png/jpg image, or the image in memory (bytes, memoryview, upload).
+    - preprocess (bool): Normalise the photo first (see image_preprocessing.preprocess_for_ocr).
+
+    Returns:
+    - str: Extracted text.
+    """
+    from PIL import Image
+
+    image = Image.open(as_readable(path))
+    if preprocess:
+        from image_preprocessing import preprocess_for_ocr
+
+        image = preprocess_for_ocr(image)
+    return ocr_image(image)
+
+
+def ocr_files(paths, preprocess=False):
+    """
+    OCR a list of image files across the process pool, one image per task.
+
+    Each worker process keeps its own OCR engine (see get_backend), so the model is loaded
+    once per worker rather than once per image.
+
+    Returns:
+    - tuple: (texts, errors). texts is in the order of paths (None where OCR failed);
+      errors maps the index of each failed image to its exception.
+    """
+    # Uploads and memoryviews can't be pickled; the workers get their bytes instead
+    sources = [path if is_path(path) else bytes(as_buffer(path)) for path in paths]
+    return map_in_processes(ocr_file, [(source, preprocess) for source in sources])
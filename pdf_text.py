@@ -0,0 +1,198 @@
+"""
+Page-level PDF text extraction.
+
+SAP reports and fact sheet bundles run to hundreds of pages, so text extraction is split
+into page ranges across a process pool, and every page's text is cached keyed by
+(file hash, page number) so the same document is never parsed twice.
+
+A PDF can be a path or an in-memory source (bytes, memoryview, upload; see spool.py).
+In-memory PDFs are read in place; only when the page pool is used is a copy spooled to
+disk, once per content, so the worker processes can open it.
+
+Scanned pages (no usable text layer) are detected per page; only those are rasterised and
+OCRed, also in the pool, so mixed documents don't pay OCR cost on every page.
+
+This module stays free of Streamlit/OpenAI imports: pool workers import it on start-up.
+"""
+import os
+from concurrent.futures.process import BrokenProcessPool
+
+from llm_cache import ResponseCache
+import scheduler
+from scheduler import get_process_pool, reset_process_pool
+from spool import as_readable, content_sha256, default_spool, is_path
+
+PDF_PAGE_CACHE_PATH = os.getenv("PDF_PAGE_CACHE_PATH", os.path.join("cache", "pdf_pages.sqlite3"))
+# Page groups a document is split into; 0 = one per pool worker (the pool is shared, see scheduler.py)
+PDF_MAX_WORKERS = int(os.getenv("PDF_MAX_WORKERS", "0"))
+# Below this many uncached pages the pool start-up costs more than it saves
+PDF_MIN_PAGES_FOR_POOL = int(os.getenv("PDF_MIN_PAGES_FOR_POOL", "12"))
+# A page whose text layer has fewer non-whitespace characters than this is treated as scanned
+PDF_OCR_MIN_CHARS = int(os.getenv("PDF_OCR_MIN_CHARS", "20"))
+PDF_OCR_FALLBACK = os.getenv("PDF_OCR_FALLBACK", "1") == "1"
+# Bump when the way page text is produced changes, so stale cached pages are not reused
+PAGE_CACHE_VERSION = "ocr1"
+
+page_cache = ResponseCache(path=PDF_PAGE_CACHE_PATH, memory_items=4096)
+# Set (per process) once rasterising/OCR is known not to work here, e.g. ImageMagick or Tesseract missing
+_ocr_unavailable = None
+
+
+def file_sha256(file_path):
+    """Content hash of a file on disk (or of an in-memory source)."""
+    return content_sha256(file_path)
+
+
+def _page_key(file_hash, page_number):
+    return f"{PAGE_CACHE_VERSION}:{file_hash}:{page_number}"
+
+
+def needs_ocr(text):
+    """True when a page's text layer is missing or too thin to be the real content."""
+    return len("".join(text.split())) < PDF_OCR_MIN_CHARS
+
+
+def extract_pages(file_path, page_numbers):
+    """
+    Worker: text layer of the given pages of a PDF, in the order given.
+    Pages without a text layer yield "" (pdfplumber returns None for them).
+    """
+    import pdfplumber
+
+    with pdfplumber.open(as_readable(file_path)) as pdf:
+        return [(pdf.pages[number].extract_text() or "") for number in page_numbers]
+
+
+def _ocr_page(page):
+    """OCR text of one pdfplumber page, or None if it cannot be OCRed."""
+    global _ocr_unavailable
+    if _ocr_unavailable:
+        return None
+    try:
+        from ocr import OCR_DPI, ocr_image
+
+        return ocr_image(page.to_image(resolution=OCR_DPI).original)
+    except (ImportError, OSError) as e:
+        # Missing toolchain (Wand/ImageMagick, Tesseract binary): don't retry on every page
+        _ocr_unavailable = repr(e)
+        return None
+    except Exception:
+        return None
+
+
+def ocr_pages(file_path, page_numbers):
+    """
+    Worker: rasterise and OCR the given pages of a PDF, in the order given.
+    A page that cannot be OCRed (e.g. Tesseract missing) yields None so the caller keeps its text layer.
+    """
+    import pdfplumber
+
+    with pdfplumber.open(as_readable(file_path)) as pdf:
+        return [_ocr_page(pdf.pages[number]) for number in page_numbers]
+
+
+def count_pdf_pages(file_path):
+    import pdfplumber
+
+    with pdfplumber.open(as_readable(file_path)) as pdf:
+        return len(pdf.pages)
+
+
+def extract_pdf_pages(file_path, max_workers=None, use_cache=True):
+    """
+    Extract the text of every page of a PDF, in page order.
+
+    Cached pages are served from the page cache; the rest are extracted either inline
+    (small documents) or split into page ranges across the process pool.
+
+    Returns:
+    - list[str]: One text per page ("" for pages without a text layer).
+    """
+    file_hash = file_sha256(file_path)
+    page_count = count_pdf_pages(file_path)
+    texts = [None] * page_count
+    if use_cache:
+        for number in range(page_count):
+            texts[number] = page_cache.get(_page_key(file_hash, number))
+    missing = [number for number, text in enumerate(texts) if text is None]
+    if not missing:
+        return texts
+
+    workers = max_workers or PDF_MAX_WORKERS or scheduler.PROCESS_POOL_WORKERS
+    # Pass 1: text layer for every uncached page, one page range per worker
+    use_pool = len(missing) >= PDF_MIN_PAGES_FOR_POOL and workers > 1
+    groups = _split_evenly(missing, workers if use_pool else 1)
+    chunks = _run_chunks(extract_pages, file_path, groups, use_pool)
+    for group, chunk in zip(groups, chunks):
+        for number, text in zip(group, chunk):
+            texts[number] = text
+
+    # Pass 2: OCR only the pages without a usable text layer (always worth the pool when >1).
+    # Pages whose OCR failed are not cached, so they get another chance once OCR works.
+    uncacheable = set()
+    if PDF_OCR_FALLBACK:
+        scanned = [number for number in missing if needs_ocr(texts[number])]
+        if scanned:
+            use_pool = len(scanned) > 1 and workers > 1
+            groups = _split_evenly(scanned, workers if use_pool else 1)
+            chunks = _run_chunks(ocr_pages, file_path, groups, use_pool)
+            for group, chunk in zip(groups, chunks):
+                for number, ocr_text in zip(group, chunk):
+                    if ocr_text is None:
+                        uncacheable.add(number)
+                    elif len(ocr_text.strip()) > len(texts[number].strip()):
+                        texts[number] = ocr_text
+
+    if use_cache:
+        for number in missing:
+            if number not in uncacheable:
+                page_cache.set(_page_key(file_hash, number), texts[number])
+    return texts
+
+
+def _split_evenly(items, parts):
+    """Split a list into at most `parts` contiguous groups of near-equal size."""
+    size = max(1, -(-len(items) // parts))  # ceil division
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def _run_chunks(fn, file_path, groups, use_pool):
+    """Run fn(file_path, group) for every page group, across the pool or inline, keeping group order."""
+    if not use_pool:
+        return [fn(file_path, group) for group in groups]
+    if not is_path(file_path):
+        file_path = default_spool().path(file_path, "document.pdf")  # pool workers need a file
+    try:
+        pool = get_process_pool()
+        futures = [pool.submit(fn, file_path, group) for group in groups]
+        return [future.result() for future in futures]
+    except BrokenProcessPool:
+        # A worker died (or could not start): drop the pool and run inline
+        reset_process_pool()
+        return [fn(file_path, group) for group in groups]
+
+
+def iter_pdf_pages(file_path, use_cache=True):
+    """
+    Yield page texts one at a time, in order, so callers can stop early
+    (e.g. once a heading is found) without parsing the rest of the document.
+    """
+    import pdfplumber
+
+    file_hash = file_sha256(file_path)
+    with pdfplumber.open(as_readable(file_path)) as pdf:
+        for number, page in enumerate(pdf.pages):
+            key = _page_key(file_hash, number)
+            text = page_cache.get(key) if use_cache else None
+            if text is None:
+                text = page.extract_text() or ""
+                cacheable = True
+                if PDF_OCR_FALLBACK and needs_ocr(text):
+                    ocr_text = _ocr_page(page)
+                    if ocr_text is None:
+                        cacheable = False
+                    elif len(ocr_text.strip()) > len(text.strip()):
+                        text = ocr_text
+                if use_cache and cacheable:
+                    page_cache.set(key, text)
+            yield text
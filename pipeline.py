@@ -0,0 +1,764 @@
+"""
+UI-agnostic report pipeline: one client case in, one Word report out.
+
+The Streamlit app (app.py) and the headless batch CLI (batch.py) both drive reports through
+generate_report(), or through prepare_sections() + render_report() when the sections are
+computed ahead of the "Generate Report" click. Nothing here imports Streamlit: progress and
+per-file problems are reported through a progress(stage, level, message) callback, where
+level is one of "start", "done", "info", "success", "warning" or "error".
+
+Stage results are memoised in a dict keyed on (stage, content hash). Pass the same memo
+again and unchanged inputs are never re-extracted or re-prompted: each job worker keeps a
+bounded StageMemo for its lifetime (see jobs.run_worker), so resubmitting the same uploads
+doesn't re-OCR them.
+
+Only the sections the template asks for are computed: prepare_sections() reads the
+template's placeholder manifest (see report_template.py) first, and a section whose
+placeholder is missing costs no extraction and no GPT call.
+
+generate_report() traces the run (see tracing.py): every stage, file extraction, OCR batch,
+GPT call and the document build is recorded with its wall time, tokens, input bytes, cache
+hit/miss and error, under one run id.
+
+A case on disk (see Case.from_directory) is a folder laid out as:
+
+    case_dir/
+        template.docx           or template/<one .docx>
+        factfind.pdf            or factfind/<one file>
+        risk/                   risk profile images or PDFs
+        plans/                  plan reports (docx, pdf, images)
+        fact_sheets/            client fund fact sheets (pdf)
+        dark_star/              Dark Star fact sheets (pdf)
+        sap/                    SAP reports (pdf)
+        annuity/                annuity quote images
+        funds/1/, funds/2/, ... files of each fund to compare against P1 (pdf)
+        p1/                     P1 benchmark files (pdf)
+
+Top-level files named after a folder (e.g. "risk_john.png", "sap.pdf") count too.
+"""
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+from logic import (
+    PlanDocument,
+    create_new_document,
+    extract_annuity_quotes_with_gpt,
+    extract_factfind_digest,
+    extract_last_year_performance_text,
+    extract_sap_comparison_with_gpt,
+    extract_text_from_file,
+    extract_texts_from_images,
+    generate_iht_section,
+    generate_multi_risk_attitude_text,
+    load_plan_document,
+    match_fact_sheet,
+    merge_fund_performance,
+    process_funds_for_comparison,
+    process_single_dark_star_performance,
+    process_single_fund_performance,
+)
+from pdf_text import file_sha256
+from report_template import SECTION_PLACEHOLDERS, template_manifest
+from scheduler import run_concurrently
+from tracing import span, trace_run
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+REPORT_FILE_NAME = "Generated_Report.docx"
+REPORT_MIME = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+# Root of kept report copies (see save_report)
+REPORT_DIR = os.getenv("REPORT_DIR", "generated_docs")
+NO_RISK_TEXT = "No risk details provided."
+
+# Folder (or file-name prefix) of every multi-file input in a case directory
+CASE_FOLDERS = {
+    "risk_profiles": "risk",
+    "plan_files": "plans",
+    "fund_fact_sheets": "fact_sheets",
+    "dark_star_fact_sheets": "dark_star",
+    "sap_reports": "sap",
+    "annuity_quotes": "annuity",
+    "p1_files": "p1",
+}
+
+# Sections in the order prepare_sections() runs them, for progress reporting
+SECTION_STAGES = (
+    "extract", "prefetch", "factfind", "risk", "plans", "fact_sheets", "dark_star",
+    "sap", "annuity", "fund_comparison", "portfolio", "iht", "swr",
+)
+REPORT_STAGES = SECTION_STAGES + ("document",)
+
+
+@dataclass
+class Case:
+    """The input files of one client review, as local paths."""
+    template: str
+    factfind: str
+    name: str = ""
+    risk_profiles: list = field(default_factory=list)
+    plan_files: list = field(default_factory=list)
+    fund_fact_sheets: list = field(default_factory=list)
+    dark_star_fact_sheets: list = field(default_factory=list)
+    sap_reports: list = field(default_factory=list)
+    annuity_quotes: list = field(default_factory=list)
+    funds: list = field(default_factory=list)  # one list of files per fund, compared against P1
+    p1_files: list = field(default_factory=list)
+
+    @classmethod
+    def from_directory(cls, case_dir):
+        """
+        Build a Case from a case folder (layout in the module docstring).
+
+        Raises:
+        - ValueError: when the template or the FactFind is missing.
+        """
+        case_dir = os.fspath(case_dir)
+        template = _single_file(case_dir, "template", (".docx",))
+        factfind = _single_file(case_dir, "factfind", None)
+        if not template or not factfind:
+            missing = [label for label, path in (("template", template), ("factfind", factfind)) if not path]
+            raise ValueError(f"Case '{case_dir}' has no {' or '.join(missing)}")
+        files = {attr: _case_files(case_dir, folder) for attr, folder in CASE_FOLDERS.items()}
+        funds_dir = os.path.join(case_dir, "funds")
+        funds = []
+        if os.path.isdir(funds_dir):
+            fund_dirs = [d for d in os.listdir(funds_dir) if os.path.isdir(os.path.join(funds_dir, d))]
+            for fund_dir in sorted(fund_dirs, key=_natural_key):
+                funds.append(_case_files(funds_dir, fund_dir))
+        return cls(
+            template=template, factfind=factfind, name=os.path.basename(os.path.normpath(case_dir)),
+            funds=funds, **files,
+        )
+
+
+def _natural_key(name):
+    """Sort "2" before "10" (fund folders are numbered)."""
+    return (0, int(name), "") if name.isdigit() else (1, 0, name)
+
+
+def _case_files(case_dir, folder):
+    """Files in case_dir/folder/ plus top-level files named folder.* or folder_*, sorted."""
+    paths = []
+    sub_dir = os.path.join(case_dir, folder)
+    if os.path.isdir(sub_dir):
+        paths += [
+            os.path.join(sub_dir, name) for name in sorted(os.listdir(sub_dir))
+            if os.path.isfile(os.path.join(sub_dir, name)) and not name.startswith(".")
+        ]
+    for name in sorted(os.listdir(case_dir)):
+        stem = os.path.splitext(name)[0].lower()
+        path = os.path.join(case_dir, name)
+        if os.path.isfile(path) and (stem == folder or stem.startswith(folder + "_")):
+            paths.append(path)
+    return paths
+
+
+def _single_file(case_dir, folder, extensions):
+    for path in _case_files(case_dir, folder):
+        if extensions is None or os.path.splitext(path)[1].lower() in extensions:
+            return path
+    return None
+
+
+def text_hash(text):
+    """Content hash of an extracted text block."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _file_name(path):
+    return os.path.basename(path)
+
+
+class StageMemo:
+    """
+    Bounded stage memo for long-lived processes: a dict-like LRU of at most max_items
+    results, safe to share between the runner's threads.
+    """
+
+    def __init__(self, max_items):
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._items
+
+    def __getitem__(self, key):
+        with self._lock:
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._items)
+
+
+class StageRunner:
+    """
+    Runs pipeline stages at most once per distinct input and collects what happened.
+
+    Results are memoised in memo under (stage, key), where key is derived from file/text
+    content hashes. Exceptions are not memoised: they are kept in errors for this run
+    only, so a failed stage is retried next time the same memo is used.
+    """
+
+    def __init__(self, memo=None, progress=None):
+        self.memo = {} if memo is None else memo
+        self.errors = {}
+        self.messages = []
+        self.stage_seconds = {}
+        self.progress = progress
+        self._file_hashes = {}
+        self._lock = threading.Lock()
+
+    def notify(self, stage, level, message=""):
+        """Record a progress message and pass it on to the progress callback."""
+        self.messages.append((stage, level, message))
+        if level in ("error", "warning"):
+            logger.log(logging.ERROR if level == "error" else logging.WARNING, "[%s] %s", stage, message)
+        if self.progress is not None:
+            self.progress(stage, level, message)
+
+    def _timed(self, stage, fn):
+        def run(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                with span("stage", stage):
+                    return fn(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                with self._lock:
+                    self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.0) + elapsed
+        return run
+
+    def file_hash(self, path):
+        if path not in self._file_hashes:
+            self._file_hashes[path] = file_sha256(path)
+        return self._file_hashes[path]
+
+    def run(self, stage, key, fn, *args, **kwargs):
+        """Return the memoised result of fn(*args) for (stage, key), computing it if needed."""
+        memo_key = (stage, key)
+        if memo_key in self.memo:
+            try:
+                return self.memo[memo_key]
+            except KeyError:
+                pass  # dropped by a bounded memo (StageMemo) in the meantime
+        if memo_key in self.errors:
+            raise self.errors[memo_key]
+        value = self._timed(stage, fn)(*args, **kwargs)
+        self.memo[memo_key] = value
+        return value
+
+    def prefetch(self, stages, plan_documents=(), plan_fields=None):
+        """
+        Dispatch every not-yet-memoised stage at once on the bounded thread pool.
+
+        stages is a list of (stage, key, fn, args). Results land in the memo, so the
+        sections read them back with run(); errors are recorded and re-raised by run()
+        in the section that consumes them, keeping the per-file error reporting.
+        Derived fields still missing on the (memoised) PlanDocuments are dispatched in
+        the same batch and written back onto each document (only plan_fields, when given).
+        """
+        tasks = {}
+        for stage, key, fn, args in stages:
+            memo_key = (stage, key)
+            if memo_key not in self.memo:
+                tasks[memo_key] = (self._timed(stage, fn), args)
+        for plan_doc in plan_documents:
+            for field_name, (fn, args) in plan_doc.pending(plan_fields).items():
+                tasks[(plan_doc, field_name)] = (self._timed(f"plan_{field_name}", fn), args)
+        results, errors = run_concurrently(tasks)
+        for task_key, value in results.items():
+            if isinstance(task_key[0], PlanDocument):
+                setattr(task_key[0], task_key[1], value)
+            else:
+                self.memo[task_key] = value
+        for task_key, error in errors.items():
+            if isinstance(task_key[0], PlanDocument):
+                task_key[0].errors[task_key[1]] = error
+            else:
+                self.errors[task_key] = error
+
+    def extract_text(self, path):
+        """Extract a file's text (pdf, docx or image), once per distinct file content."""
+        return self.run("extract_text", self.file_hash(path), extract_text_from_file, path)
+
+    def extract_image_texts(self, paths):
+        """
+        Warm the "extract_text" memo for several files at once: every image not yet
+        extracted is OCRed in one batch across the process pool. Failures are recorded
+        so extract_text re-raises them for that file.
+        """
+        pending = {}
+        for path in paths:
+            key = ("extract_text", self.file_hash(path))
+            if key in self.memo or key in pending:
+                continue
+            if os.path.splitext(path)[1].lower() in IMAGE_EXTENSIONS:
+                pending[key] = path
+        if not pending:
+            return
+        keys = list(pending)
+        texts, errors = self._timed("extract_text", extract_texts_from_images)([pending[key] for key in keys])
+        for index, key in enumerate(keys):
+            if index in errors:
+                self.errors[key] = errors[index]
+            else:
+                self.memo[key] = texts[index]
+
+    def non_empty_texts(self, paths):
+        """Texts of the files that could be read and are not blank (failures are reported later)."""
+        texts = []
+        for path in paths:
+            try:
+                text = self.extract_text(path)
+            except Exception:
+                continue  # reported by the section that reads this file
+            if text.strip():
+                texts.append(text)
+        return texts
+
+
+@dataclass
+class ReportResult:
+    """What generate_report() produced for one case."""
+    case_name: str
+    output_path: str = None  # only set when a copy was written to disk
+    document: bytes = field(default=None, repr=False)  # the .docx
+    sections: dict = field(default_factory=dict)
+    messages: list = field(default_factory=list)  # (stage, level, message)
+    stage_seconds: dict = field(default_factory=dict)
+    seconds: float = 0.0
+    run_id: str = None
+    trace: list = field(default_factory=list)  # spans, see tracing.py
+
+    @property
+    def error_count(self):
+        return sum(1 for _, level, _ in self.messages if level == "error")
+
+
+def prepare_sections(case, progress=None, memo=None, runner=None, manifest=None):
+    """
+    Run the extraction and GPT stages the case's template needs and return the report sections.
+
+    Args:
+    - case (Case): The input files.
+    - progress (callable): progress(stage, level, message), see the module docstring.
+    - memo (dict): Stage memo to reuse across calls (e.g. Streamlit reruns).
+    - runner (StageRunner): Use this runner instead of building one from progress/memo.
+    - manifest (report_template.Manifest): Sections to compute (default: the template's manifest).
+
+    Returns:
+    - dict: Keyword arguments for create_new_document (everything except template_path
+      and output_path), plus "portfolio_by_plan" [(plan name, portfolio), ...] for display.
+      Sections the template doesn't use keep their empty defaults.
+    """
+    runner = runner or StageRunner(memo=memo, progress=progress)
+    notify = runner.notify
+    manifest = manifest or template_manifest(case.template)
+    needs = manifest.needs
+    plan_fields = [name for name in PlanDocument.DERIVED_FIELDS if needs(name)]
+
+    # Extract every file first (images OCRed in one parallel batch), then fan out all
+    # independent GPT stages at once
+    notify("extract", "start", "Extracting text")
+    skipped = [section for section in SECTION_PLACEHOLDERS if not needs(section)]
+    if skipped:
+        notify("extract", "info", "Not used by the template, skipped: " + ", ".join(skipped))
+    runner.extract_image_texts(
+        (list(case.risk_profiles) if needs("risk") else []) + (list(case.annuity_quotes) if needs("annuity") else [])
+    )
+    factfinding_text = runner.extract_text(case.factfind) if needs("factfind") else ""
+    notify("extract", "done")
+
+    notify("prefetch", "start", "Running GPT stages")
+    pending_stages = []
+    if needs("factfind"):
+        pending_stages.append(
+            ("factfind_digest", text_hash(factfinding_text), extract_factfind_digest, (factfinding_text,))
+        )
+    prefetch_risk_texts = runner.non_empty_texts(case.risk_profiles) if needs("risk") else []
+    if prefetch_risk_texts:
+        pending_stages.append((
+            "risk_text", tuple(text_hash(t) for t in prefetch_risk_texts),
+            generate_multi_risk_attitude_text, (prefetch_risk_texts,)
+        ))
+    # One PlanDocument per plan file: text extracted once, derived results cached on it
+    plan_documents = []
+    for path in (case.plan_files if plan_fields or needs("iht") else []):
+        try:
+            plan_documents.append(runner.run("plan_document", runner.file_hash(path), load_plan_document, path))
+        except Exception as e:
+            notify("plans", "error", f"Failed to extract text from '{_file_name(path)}': {e}")
+    plan_texts_list = [doc.text for doc in plan_documents if doc.has_text]
+    # Fact sheets are processed one file per call, in parallel, and merged afterwards
+    for text in runner.non_empty_texts(case.fund_fact_sheets if needs("fund_performance") else []):
+        pending_stages.append(("fund_performance", text_hash(text), process_single_fund_performance, (text,)))
+    for text in runner.non_empty_texts(case.dark_star_fact_sheets if needs("dark_star") else []):
+        pending_stages.append(("dark_star_performance", text_hash(text), process_single_dark_star_performance, (text,)))
+    for text in runner.non_empty_texts(case.sap_reports if needs("sap") else []):
+        pending_stages.append(("sap_comparison", text_hash(text), extract_sap_comparison_with_gpt, (text,)))
+    prefetch_annuity_texts = runner.non_empty_texts(case.annuity_quotes) if needs("annuity") else []
+    if prefetch_annuity_texts:
+        pending_stages.append((
+            "annuity_quotes", tuple(text_hash(t) for t in prefetch_annuity_texts),
+            extract_annuity_quotes_with_gpt, (prefetch_annuity_texts,)
+        ))
+    fund_comparison_key = None
+    if needs("fund_comparison"):
+        fund_comparison_key = (
+            tuple(tuple(runner.file_hash(f) for f in (fund_files or [])) for fund_files in case.funds),
+            tuple(runner.file_hash(f) for f in case.p1_files),
+        )
+        pending_stages.append(
+            ("fund_comparison", fund_comparison_key, process_funds_for_comparison, (case.funds, case.p1_files))
+        )
+    runner.prefetch(pending_stages, plan_documents, plan_fields)
+    notify("prefetch", "done")
+
+    # Read the FactFind once; every FactFind-based section consumes this digest
+    notify("factfind", "start")
+    factfind_digest = None
+    try:
+        if needs("factfind"):
+            factfind_digest = runner.run(
+                "factfind_digest", text_hash(factfinding_text), extract_factfind_digest, factfinding_text
+            )
+    except Exception as e:
+        notify("factfind", "error", f"Error reading the FactFind document: {e}")
+    notify("factfind", "done")
+
+    # Risk Profiles
+    notify("risk", "start")
+    risk_texts = []
+    for path in (case.risk_profiles if needs("risk") else []):
+        try:
+            extracted_risk_text = runner.extract_text(path)
+        except Exception as e:
+            notify("risk", "error", f"Error reading risk profile '{_file_name(path)}': {e}")
+            continue
+        if extracted_risk_text.strip():
+            risk_texts.append(extracted_risk_text)
+            notify("risk", "success", f"Extracted risk text from '{_file_name(path)}'")
+        else:
+            notify("risk", "warning", f"No text found in '{_file_name(path)}', skipping risk parsing.")
+
+    final_attitude_text = NO_RISK_TEXT
+    if risk_texts:
+        try:
+            final_attitude_text = runner.run(
+                "risk_text", tuple(text_hash(t) for t in risk_texts),
+                generate_multi_risk_attitude_text, risk_texts
+            )
+        except Exception as e:
+            notify("risk", "error", f"Error generating final risk text: {e}")
+    notify("risk", "done")
+
+    # Plan Reports
+    notify("plans", "start")
+    plan_report_data = []
+    plan_report_text = ""
+    plan_review_paragraphs = []
+    for plan_doc in plan_documents:
+        if plan_doc.has_text:
+            try:
+                if needs("plan_details"):
+                    plan_report_data.extend(plan_doc.get("plan_details"))
+                plan_report_text += plan_doc.text + "\n"
+                if needs("review"):
+                    plan_review_paragraphs.append(plan_doc.get("review"))
+                    notify("plans", "success", f"Generated a pension review for '{plan_doc.name}'")
+            except Exception as e:
+                notify("plans", "error", f"Error processing '{plan_doc.name}': {e}")
+        elif needs("plan_details") or needs("review"):
+            notify("plans", "warning", f"No text found in '{plan_doc.name}', skipping review generation.")
+    notify("plans", "done")
+
+    # Client Fund Fact Sheets (multi-file): one extraction per file, merged by fund name/ISIN
+    notify("fact_sheets", "start")
+    fund_performance_data = []
+    last_year_performance_text = "No last-year performance found."
+    if case.fund_fact_sheets and needs("fund_performance"):
+        fact_sheet_texts = []
+        fact_sheet_results = []
+        for path in case.fund_fact_sheets:
+            try:
+                text = runner.extract_text(path)
+            except Exception as e:
+                notify("fact_sheets", "error", f"Error reading '{_file_name(path)}': {e}")
+                continue
+            if not text.strip():
+                notify("fact_sheets", "warning", f"No text found in {_file_name(path)}.")
+                continue
+            try:
+                fact_sheet_results.append(
+                    runner.run("fund_performance", text_hash(text), process_single_fund_performance, text)
+                )
+                fact_sheet_texts.append(text)
+            except Exception as e:
+                notify("fact_sheets", "error", f"Error extracting fund performance from '{_file_name(path)}': {e}")
+        if fact_sheet_results:
+            fund_performance_data = merge_fund_performance(fact_sheet_results)
+        if fact_sheet_results and needs("last_year_performance"):
+            # Last-year performance only needs the fact sheet matching the client's holdings.
+            # Holdings are only known when the template uses the portfolio; otherwise
+            # match_fact_sheet falls back to the first sheet with fund records
+            holding_names = [
+                holding.get("Fund")
+                for plan_doc in plan_documents if isinstance(plan_doc.portfolio, dict)
+                for holding in plan_doc.portfolio.get("Holdings", [])
+            ]
+            matched_text = fact_sheet_texts[match_fact_sheet(fact_sheet_results, holding_names)]
+            try:
+                last_year_performance_text = runner.run(
+                    "last_year_performance", text_hash(matched_text),
+                    extract_last_year_performance_text, matched_text
+                )
+            except Exception as e:
+                notify("fact_sheets", "error", f"Error extracting last-year performance: {e}")
+        elif not fact_sheet_results:
+            notify("fact_sheets", "warning", "No fund text could be extracted from the uploaded files.")
+    notify("fact_sheets", "done")
+
+    # Dark Star Fact Sheets (multi-file): one extraction per file, merged by fund name/ISIN
+    notify("dark_star", "start")
+    dark_star_performance_data = []
+    if case.dark_star_fact_sheets and needs("dark_star"):
+        dark_star_results = []
+        for path in case.dark_star_fact_sheets:
+            try:
+                text = runner.extract_text(path)
+            except Exception as e:
+                notify("dark_star", "error", f"Error reading '{_file_name(path)}': {e}")
+                continue
+            if not text.strip():
+                notify("dark_star", "warning", f"No text found in {_file_name(path)}.")
+                continue
+            try:
+                dark_star_results.append(
+                    runner.run("dark_star_performance", text_hash(text), process_single_dark_star_performance, text)
+                )
+            except Exception as e:
+                notify("dark_star", "error", f"Error extracting Dark Star performance from '{_file_name(path)}': {e}")
+        if dark_star_results:
+            dark_star_performance_data = merge_fund_performance(dark_star_results)
+        else:
+            notify("dark_star", "warning", "No text extracted from the uploaded Dark Star fact sheets.")
+    notify("dark_star", "done")
+
+    # SAP Reports
+    notify("sap", "start")
+    sap_comparison_tables = []
+    for path in (case.sap_reports if needs("sap") else []):
+        try:
+            extracted_sap_text = runner.extract_text(path)
+        except Exception as e:
+            notify("sap", "error", f"Error reading SAP report '{_file_name(path)}': {e}")
+            continue
+        if extracted_sap_text.strip():
+            try:
+                sap_comparison_tables.append(runner.run(
+                    "sap_comparison", text_hash(extracted_sap_text),
+                    extract_sap_comparison_with_gpt, extracted_sap_text
+                ))
+            except Exception as e:
+                notify("sap", "error", f"Error processing SAP report '{_file_name(path)}': {e}")
+        else:
+            notify("sap", "warning", f"No text found in '{_file_name(path)}', skipping SAP report processing.")
+    notify("sap", "done")
+
+    # Annuity Quotes: all quotes go to GPT in a single structured call
+    notify("annuity", "start")
+    annuity_quotes = None
+    annuity_texts = []
+    for path in (case.annuity_quotes if needs("annuity") else []):
+        try:
+            annuity_extracted = runner.extract_text(path)
+        except Exception as e:
+            notify("annuity", "error", f"Error reading annuity file '{_file_name(path)}': {e}")
+            continue
+        if annuity_extracted.strip():
+            annuity_texts.append(annuity_extracted)
+        else:
+            notify("annuity", "warning", f"No text extracted from annuity file '{_file_name(path)}', skipping it.")
+    if annuity_texts:
+        try:
+            annuity_quotes = runner.run(
+                "annuity_quotes", tuple(text_hash(t) for t in annuity_texts),
+                extract_annuity_quotes_with_gpt, annuity_texts
+            )
+        except Exception as e:
+            notify("annuity", "error", f"Error processing annuity quotes: {e}")
+    notify("annuity", "done")
+
+    # Fund Comparisons
+    notify("fund_comparison", "start")
+    fund_comparison_results = []
+    try:
+        if needs("fund_comparison"):
+            fund_comparison_results = runner.run(
+                "fund_comparison", fund_comparison_key, process_funds_for_comparison, case.funds, case.p1_files
+            )
+    except Exception as e:
+        notify("fund_comparison", "error", f"Error processing fund comparisons: {e}")
+    combined_fund_comparison_text = "\n\n".join(
+        [f"Fund {num}: {text}" for num, text in fund_comparison_results]
+    )
+    notify("fund_comparison", "done")
+
+    # Portfolio Extraction
+    notify("portfolio", "start")
+    portfolio_jsons = []
+    portfolio_by_plan = []
+    for plan_doc in (plan_documents if needs("portfolio") else []):
+        if plan_doc.has_text:
+            try:
+                portfolio_jsons.append(plan_doc.get("portfolio"))
+                portfolio_by_plan.append((plan_doc.name, portfolio_jsons[-1]))
+            except Exception as e:
+                notify("portfolio", "error", f"Error extracting portfolio from '{plan_doc.name}': {e}")
+    notify("portfolio", "done")
+
+    # IHT Section (only if FactFind and Plan Reports were provided)
+    notify("iht", "start")
+    iht_text = ""
+    if needs("iht") and factfind_digest and plan_texts_list:
+        try:
+            iht_key = (text_hash(factfinding_text), tuple(text_hash(t) for t in plan_texts_list))
+            iht_text = runner.run("iht", iht_key, generate_iht_section, factfind_digest, plan_texts_list)
+        except Exception as e:
+            notify("iht", "error", "Error generating IHT section: " + repr(e))
+    elif needs("iht"):
+        notify("iht", "warning", "Please upload the FactFind and Plan Report files to extract IHT details.")
+    notify("iht", "done")
+
+    # Safe Withdrawal Rate Sections
+    notify("swr", "start")
+    swr_sections_list = []
+    for plan_doc in (plan_documents if needs("swr") else []):
+        if plan_doc.has_text:
+            try:
+                swr_sections_list.append(plan_doc.get("swr"))
+            except Exception as e:
+                notify("swr", "error", f"Error generating SWR section for '{plan_doc.name}': {e}")
+    combined_swr_text = "\n\n".join(
+        [f"Safe Withdrawal Rate for File {idx+1}:\n{swr}" for idx, swr in enumerate(swr_sections_list)]
+    )
+    notify("swr", "done")
+
+    return {
+        "factfind_digest": factfind_digest or {},
+        "attitude_to_risk": final_attitude_text,
+        "table_data": plan_report_data,
+        "product_report_text": plan_report_text,  # Modify as needed
+        "plan_review_texts": plan_review_paragraphs,
+        "plan_review_paragraphs": plan_review_paragraphs,
+        "plan_report_text": plan_report_text,
+        "fund_performance_data": fund_performance_data,
+        "last_year_performance_text": last_year_performance_text,
+        "dark_star_performance_data": dark_star_performance_data,
+        "sap_comparison_tables": sap_comparison_tables,
+        "annuity_quotes": annuity_quotes,
+        "fund_comparison_text": combined_fund_comparison_text,
+        "iht_text": iht_text,
+        "portfolio_json": portfolio_jsons,
+        "safe_withdrawal_text": combined_swr_text,
+        # For display only (not a create_new_document argument)
+        "portfolio_by_plan": portfolio_by_plan,
+    }
+
+
+DISPLAY_ONLY_SECTIONS = ("portfolio_by_plan",)
+
+
+def render_report(template_path, sections, output_path=None):
+    """
+    Assemble the Word report from prepared sections (see prepare_sections).
+
+    Returns:
+    - bytes: The .docx file, also written to output_path when one is given.
+    """
+    if output_path:
+        output_dir = os.path.dirname(output_path)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+    document_args = {k: v for k, v in sections.items() if k not in DISPLAY_ONLY_SECTIONS}
+    return create_new_document(template_path=template_path, output_path=output_path, **document_args)
+
+
+def save_report(document, case_name, root=None):
+    """
+    Keep a copy of a report at a per-case, content-addressed path:
+    <root>/<case name>/<sha256 of the .docx>.docx. Identical reports are written once,
+    and reports of different cases or sessions never overwrite each other.
+
+    Returns:
+    - str: The path.
+    """
+    folder = os.path.join(root or REPORT_DIR, re.sub(r"[^\w.-]+", "_", case_name or "case").strip("._") or "case")
+    path = os.path.join(folder, hashlib.sha256(document).hexdigest() + ".docx")
+    if not os.path.exists(path):
+        os.makedirs(folder, exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(document)
+        os.replace(temp_path, path)
+    return path
+
+
+def generate_report(case, output_path=None, progress=None, memo=None, trace_path=None, persist=False):
+    """
+    Produce the report for one case. The document is built in memory (result.document);
+    a copy is written only when output_path or persist is given.
+
+    Args:
+    - case (Case): The input files.
+    - output_path (str): Write the .docx here.
+    - progress (callable): progress(stage, level, message) callback.
+    - memo (dict): Stage memo to reuse across calls (dict or StageMemo).
+    - trace_path (str): JSON-lines file to append this run's spans to (default: tracing.TRACE_PATH).
+    - persist (bool): Without output_path, keep a copy under REPORT_DIR (see save_report).
+
+    Returns:
+    - ReportResult: The document, output path (if written), sections, every progress
+      message, per-stage timings and the run's trace. Per-section problems are reported as
+      "error" messages; only a failure to build or write the document raises.
+    """
+    start = time.perf_counter()
+    runner = StageRunner(memo=memo, progress=progress)
+    with trace_run(case.name, path=trace_path) as run:
+        sections = prepare_sections(case, runner=runner)
+
+        runner.notify("document", "start", "Generating the report document")
+        document = runner._timed("document", render_report)(case.template, sections, output_path)
+        if not output_path and persist:
+            output_path = save_report(document, case.name)
+        runner.notify("document", "done", output_path or f"{len(document)} bytes")
+
+    return ReportResult(
+        case_name=case.name,
+        output_path=output_path,
+        document=document,
+        sections=sections,
+        messages=runner.messages,
+        stage_seconds=runner.stage_seconds,
+        seconds=time.perf_counter() - start,
+        run_id=run.run_id,
+        trace=run.spans,
+    )
@@ -0,0 +1,244 @@
+"""
+Requests-per-minute / tokens-per-minute limiter and retry policy for OpenAI calls.
+
+Every chat completion in logic.py goes through logic.chat_completion, which calls
+limiter.acquire() before the request and retries rate-limit and transient errors with
+call_with_retries(). Together they keep throughput close to the account quota instead of
+failing a 40-fund comparison on the first 429.
+
+Two token buckets (requests and tokens) refill continuously at RATE_LIMIT_RPM / 60 and
+RATE_LIMIT_TPM / 60 per second. The token cost of a request is estimated up front from the
+prompt size and max_tokens, then corrected with the usage the API reports.
+
+By default the buckets are shared by the threads of one process. Set RATE_LIMIT_STATE_PATH
+to a file to share one quota between every Streamlit/worker process on the host: the bucket
+state then lives in that file, updated under an exclusive file lock (fcntl; on platforms
+without it the limiter stays process-local).
+
+Retries use full-jitter exponential backoff (base RATE_LIMIT_BACKOFF_SECONDS, capped at
+RATE_LIMIT_MAX_BACKOFF_SECONDS). A Retry-After header from the API is honoured and pauses
+the whole limiter, so other threads/processes back off too rather than piling into more 429s.
+"""
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, limiter is per process
+    fcntl = None
+
+RATE_LIMIT_RPM = float(os.getenv("RATE_LIMIT_RPM", "500"))
+RATE_LIMIT_TPM = float(os.getenv("RATE_LIMIT_TPM", "200000"))
+RATE_LIMIT_STATE_PATH = os.getenv("RATE_LIMIT_STATE_PATH", "")
+RATE_LIMIT_MAX_RETRIES = int(os.getenv("RATE_LIMIT_MAX_RETRIES", "6"))
+RATE_LIMIT_BACKOFF_SECONDS = float(os.getenv("RATE_LIMIT_BACKOFF_SECONDS", "1.0"))
+RATE_LIMIT_MAX_BACKOFF_SECONDS = float(os.getenv("RATE_LIMIT_MAX_BACKOFF_SECONDS", "60"))
+# Completion tokens assumed for requests that don't set max_tokens
+DEFAULT_COMPLETION_TOKENS = 1000
+RETRYABLE_STATUS_CODES = (408, 409, 429, 500, 502, 503, 504)
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_tokens(messages, max_tokens=None):
+    """
+    Rough token cost of a chat request: ~4 characters per prompt token plus the completion budget.
+
+    Args:
+    - messages (list): Chat messages.
+    - max_tokens (int): Completion limit of the request, if set.
+
+    Returns:
+    - int
+    """
+    chars = sum(len(str(m.get("content") or "")) for m in messages)
+    return chars // 4 + 4 * len(messages) + (max_tokens or DEFAULT_COMPLETION_TOKENS)
+
+
+class RateLimiter:
+    """
+    Token-bucket limiter for requests and tokens per minute.
+
+    Thread-safe. With state_path set (and fcntl available) the buckets are stored in that
+    file and shared by every process using it.
+    """
+
+    def __init__(self, rpm=RATE_LIMIT_RPM, tpm=RATE_LIMIT_TPM, state_path=RATE_LIMIT_STATE_PATH):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.state_path = state_path if (state_path and fcntl is not None) else ""
+        self._lock = threading.Lock()
+        self._state = self._full_state()
+        self._counters = {"requests": 0, "waits": 0, "wait_seconds": 0.0, "pauses": 0}
+
+    def _full_state(self):
+        return {"requests": self.rpm, "tokens": self.tpm, "updated": time.time(), "paused_until": 0.0}
+
+    # ---- State storage -----------------------------------------------------
+
+    def _update(self, change):
+        """Run change(state) on the current bucket state under the thread (and file) lock."""
+        with self._lock:
+            if not self.state_path:
+                return change(self._state)
+            os.makedirs(os.path.dirname(os.path.abspath(self.state_path)), exist_ok=True)
+            with open(self.state_path, "a+", encoding="utf-8") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.seek(0)
+                    try:
+                        state = json.loads(f.read())
+                    except ValueError:  # new or corrupt file
+                        state = self._full_state()
+                    result = change(state)
+                    f.seek(0)
+                    f.truncate()
+                    f.write(json.dumps(state))
+                    f.flush()
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+            return result
+
+    def _refill(self, state, now):
+        elapsed = max(0.0, now - state["updated"])
+        state["requests"] = min(self.rpm, state["requests"] + elapsed * self.rpm / 60.0)
+        state["tokens"] = min(self.tpm, state["tokens"] + elapsed * self.tpm / 60.0)
+        state["updated"] = now
+
+    # ---- Public API --------------------------------------------------------
+
+    def acquire(self, tokens=0):
+        """
+        Block until one request and `tokens` tokens are available, then take them.
+
+        A request larger than the whole TPM bucket waits for a full bucket and is let through.
+
+        Returns:
+        - float: Seconds spent waiting.
+        """
+        tokens = min(tokens, self.tpm)
+
+        def take(state):
+            now = time.time()
+            self._refill(state, now)
+            if state.get("paused_until", 0.0) > now:
+                return state["paused_until"] - now
+            if state["requests"] >= 1 and state["tokens"] >= tokens:
+                state["requests"] -= 1
+                state["tokens"] -= tokens
+                return 0.0
+            missing_requests = max(0.0, 1 - state["requests"]) * 60.0 / self.rpm
+            missing_tokens = max(0.0, tokens - state["tokens"]) * 60.0 / self.tpm
+            return max(missing_requests, missing_tokens)
+
+        waited = 0.0
+        while True:
+            delay = self._update(take)
+            if delay <= 0:
+                break
+            # Sleep outside the lock; a little jitter keeps waiting threads from waking together
+            delay += random.uniform(0, 0.05)
+            time.sleep(delay)
+            waited += delay
+        with self._lock:
+            self._counters["requests"] += 1
+            if waited:
+                self._counters["waits"] += 1
+                self._counters["wait_seconds"] += waited
+        return waited
+
+    def adjust(self, tokens):
+        """Give back (positive) or charge (negative) tokens once the real usage of a request is known."""
+        def change(state):
+            state["tokens"] = min(self.tpm, state["tokens"] + tokens)
+        self._update(change)
+
+    def pause(self, seconds):
+        """Stop handing out capacity for `seconds` (the API told us to back off)."""
+        def change(state):
+            state["paused_until"] = max(state.get("paused_until", 0.0), time.time() + seconds)
+        self._update(change)
+        with self._lock:
+            self._counters["pauses"] += 1
+
+    def stats(self):
+        """Counters for this process: requests let through, how many had to wait and for how long."""
+        with self._lock:
+            counters = dict(self._counters)
+        counters["wait_seconds"] = round(counters["wait_seconds"], 3)
+        return counters
+
+
+def _status_code(error):
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status
+
+
+def is_retryable(error):
+    """Rate limits, timeouts, connection drops and 5xx responses are worth retrying."""
+    if _status_code(error) in RETRYABLE_STATUS_CODES:
+        return True
+    # openai.APIConnectionError / APITimeoutError carry no status code
+    return type(error).__name__ in ("APIConnectionError", "APITimeoutError")
+
+
+def retry_after_seconds(error):
+    """The delay requested by the API's Retry-After (or retry-after-ms) header, if any."""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        value = headers.get("retry-after-ms")
+        if value is not None:
+            return float(value) / 1000.0
+        value = headers.get("retry-after")
+        if value is not None:
+            return float(value)
+    except (TypeError, ValueError):
+        pass  # HTTP-date form: fall back to exponential backoff
+    return None
+
+
+def backoff_seconds(attempt, base=RATE_LIMIT_BACKOFF_SECONDS, cap=RATE_LIMIT_MAX_BACKOFF_SECONDS):
+    """Full-jitter exponential backoff for the given (0-based) retry attempt."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def call_with_retries(call, limiter=None, max_retries=RATE_LIMIT_MAX_RETRIES):
+    """
+    Run call(), retrying retryable API errors with jittered exponential backoff.
+
+    Args:
+    - call (callable): Makes the request (limiter.acquire() belongs inside it, so every
+      attempt is counted against the quota).
+    - limiter (RateLimiter): Paused on Retry-After so other callers back off as well.
+    - max_retries (int): Retries after the first attempt.
+
+    Returns:
+    - Whatever call() returns. The last error is raised once retries are exhausted.
+    """
+    attempt = 0
+    while True:
+        try:
+            return call()
+        except Exception as e:
+            if attempt >= max_retries or not is_retryable(e):
+                raise
+            delay = backoff_seconds(attempt)
+            retry_after = retry_after_seconds(e)
+            if retry_after is not None:
+                delay = max(delay, retry_after)
+                if limiter is not None:
+                    limiter.pause(retry_after)
+            logger.warning(
+                "OpenAI call failed (%s), retry %d/%d in %.1fs", _status_code(e) or type(e).__name__,
+                attempt + 1, max_retries, delay,
+            )
+            time.sleep(delay)
+            attempt += 1
@@ -0,0 +1,426 @@
+"""
+Report templates: which placeholders a template uses, where they are, and filling them in.
+
+Templates vary (many are slim variants without IHT, SWR or fund comparisons), so
+pipeline.prepare_sections() reads the template's manifest first and only schedules the
+extraction and GPT work for sections the template actually contains. A section whose
+placeholder is missing costs no file extraction and no model call.
+
+Each template is compiled once per content hash into a TemplateIndex: the paragraphs of
+every document part (body, tables at any depth, headers, footers) that hold placeholders.
+Indexes are kept in memory and in a SQLite cache (TEMPLATE_INDEX_CACHE_PATH), so they
+survive restarts and are shared between the app and the job workers.
+
+add_table() builds a whole table (header + rows of strings) as one XML string and parses
+it once. python-docx's table.add_row().cells / table.cell(r, c) rebuild the cell grid on
+every access, which makes large holdings or comparison tables quadratic.
+
+render_template() then fills the template in place, keeping its styles, page set-up,
+headers and footers: each indexed paragraph goes through one compiled regex and a
+registry of renderers, {placeholder: renderer(context, document) -> text}. A renderer
+may also append blocks (headings, tables, paragraphs) to the end of the document body;
+they are moved right after the paragraph holding the placeholder.
+"""
+import bisect
+import copy
+import json
+import logging
+import os
+import re
+import threading
+from dataclasses import dataclass, field
+from xml.sax.saxutils import escape
+
+from llm_cache import ResponseCache
+from pdf_text import file_sha256
+
+logger = logging.getLogger(__name__)
+
+PLACEHOLDER_RE = re.compile(r"\{[^{}\n]+\}")
+TEMPLATE_INDEX_CACHE_PATH = os.getenv(
+    "TEMPLATE_INDEX_CACHE_PATH", os.path.join("cache", "template_index.sqlite3")
+)
+# Bump when the index layout changes, so stale cached indexes are not reused
+INDEX_VERSION = "idx1"
+
+# Section -> placeholders that need it. Section names match pipeline stages and the
+# PlanDocument derived fields ("plan_details", "review", "portfolio", "swr").
+SECTION_PLACEHOLDERS = {
+    "factfind": (
+        "{Full name}", "{Address}", "{salutation}", "{Current_Situation}", "{Priorities_and_Objectives}",
+        "{IHT_Text}",  # the IHT section is written from the FactFind digest
+    ),
+    "risk": ("{Attitude_to_Risk}",),
+    "plan_details": ("{table1}",),
+    "review": ("{Review of Existing Royal London Personal Pension}",),
+    "portfolio": ("{Investment_holdings}",),
+    "swr": ("{Safe Withdrawal Rate (SWR)}",),
+    # Last-year performance is read from the fact sheet matching the client's holdings when
+    # the portfolio is extracted anyway, else from the first sheet with fund records (see
+    # logic.match_fact_sheet); it never costs a portfolio call of its own
+    "fund_performance": ("{table2-1}", "{Last_Year_Performance}"),
+    "last_year_performance": ("{Last_Year_Performance}",),
+    "dark_star": ("{table2-2}",),
+    "sap": ("{table3-1}",),
+    "annuity": ("{Annuity_Quotes}",),
+    "fund_comparison": ("{Fund_Comparison}",),
+    "iht": ("{IHT_Text}",),
+}
+# Filled locally, no extraction or model call needed
+LOCAL_PLACEHOLDERS = ("{Today’s date}",)
+KNOWN_PLACEHOLDERS = frozenset(p for ps in SECTION_PLACEHOLDERS.values() for p in ps) | set(LOCAL_PLACEHOLDERS)
+
+# Characters XML 1.0 doesn't allow (PDF text extraction produces some of them)
+_INVALID_XML_CHARS = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+_HEADER_FOOTER_TYPES = (
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.header+xml",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.footer+xml",
+)
+
+index_cache = ResponseCache(path=TEMPLATE_INDEX_CACHE_PATH, memory_items=64)
+
+
+@dataclass(frozen=True)
+class Manifest:
+    """The placeholders of one template and the sections they require."""
+    placeholders: frozenset
+
+    @classmethod
+    def full(cls):
+        """A manifest that requires every section (used when the template can't be scanned)."""
+        return cls(KNOWN_PLACEHOLDERS)
+
+    def needs(self, section):
+        """True when any placeholder that section fills is in the template."""
+        return any(placeholder in self.placeholders for placeholder in SECTION_PLACEHOLDERS[section])
+
+    @property
+    def sections(self):
+        return sorted(section for section in SECTION_PLACEHOLDERS if self.needs(section))
+
+    @property
+    def unknown_placeholders(self):
+        """Brace-delimited text in the template that no section fills (typos, other tools' fields)."""
+        return sorted(self.placeholders - KNOWN_PLACEHOLDERS)
+
+
+@dataclass(frozen=True)
+class TemplateIndex:
+    """
+    Where a template's placeholders are.
+
+    locations maps a part name ("/word/document.xml", "/word/header1.xml", ...) to
+    [(paragraph number, placeholders), ...], the paragraph number counting every w:p of
+    that part in document order (so paragraphs in nested tables count too).
+    """
+    placeholders: frozenset
+    locations: dict = field(default_factory=dict)
+
+    @property
+    def manifest(self):
+        return Manifest(self.placeholders)
+
+    def to_json(self):
+        return json.dumps({
+            "placeholders": sorted(self.placeholders),
+            "locations": {part: [[number, list(found)] for number, found in entries]
+                          for part, entries in self.locations.items()},
+        }, ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, value):
+        data = json.loads(value)
+        return cls(
+            placeholders=frozenset(data["placeholders"]),
+            locations={part: [(number, tuple(found)) for number, found in entries]
+                       for part, entries in data["locations"].items()},
+        )
+
+
+def _qn(tag):
+    from docx.oxml.ns import qn
+    return qn(tag)
+
+
+def template_parts(document):
+    """The XML parts of a python-docx Document that can hold placeholders: body, headers, footers."""
+    parts = [document.part]
+    for part in document.part.package.iter_parts():
+        if part.content_type in _HEADER_FOOTER_TYPES:
+            parts.append(part)
+    return parts
+
+
+def _run_texts(p):
+    from docx.text.run import Run
+    return [Run(r, None).text for r in p.findall(_qn("w:r"))]
+
+
+def compile_template(document):
+    """Build the TemplateIndex of a loaded python-docx Document."""
+    placeholders = set()
+    locations = {}
+    for part in template_parts(document):
+        entries = []
+        for number, p in enumerate(part.element.iter(_qn("w:p"))):
+            # Same text as python-docx's Paragraph.text: the paragraph's direct runs
+            text = "".join(_run_texts(p))
+            found = PLACEHOLDER_RE.findall(text) if "{" in text else []
+            if found:
+                entries.append((number, tuple(found)))
+                placeholders.update(found)
+        if entries:
+            locations[str(part.partname)] = entries
+    return TemplateIndex(frozenset(placeholders), locations)
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def template_index(template_path, document=None):
+    """
+    The TemplateIndex of a .docx template, compiled once per content hash.
+
+    Args:
+    - template_path (str): The template file.
+    - document (Document): The template already loaded, compiled from on a cache miss.
+    """
+    key = f"{INDEX_VERSION}:{file_sha256(template_path)}"
+    with _indexes_lock:
+        index = _indexes.get(key)
+    if index is not None:
+        return index
+    cached = index_cache.get(key)
+    if cached is not None:
+        index = TemplateIndex.from_json(cached)
+    else:
+        if document is None:
+            from docx import Document
+            document = Document(template_path)
+        index = compile_template(document)
+        index_cache.set(key, index.to_json())
+        unknown = index.manifest.unknown_placeholders
+        if unknown:
+            logger.info("Template placeholders no section fills: %s", ", ".join(unknown))
+    with _indexes_lock:
+        _indexes[key] = index
+    return index
+
+
+def scan_placeholders(template_path):
+    """Set of placeholders (with braces) used anywhere in a .docx template."""
+    return set(template_index(template_path).placeholders)
+
+
+def template_manifest(template_path):
+    """
+    The Manifest of a template (see template_index).
+
+    A template that can't be read gets the full manifest, so nothing is skipped and the
+    document step reports the actual problem.
+    """
+    try:
+        return template_index(template_path).manifest
+    except Exception as e:
+        logger.warning("Cannot scan template %s (%r); generating every section", template_path, e)
+        return Manifest.full()
+
+
+# ---- Rendering ----------------------------------------------------------------
+
+
+def ensure_styles(document, names):
+    """
+    Copy the named styles (with the styles they are based on or linked to) from
+    python-docx's default template into document when it lacks them, so helpers that use
+    "Heading 2" or "Table Grid" work on templates saved without those styles.
+    """
+    missing = []
+    for name in names:
+        try:
+            document.styles[name]
+        except KeyError:
+            missing.append(name)
+    if not missing:
+        return
+    from docx import Document
+
+    defaults = Document().styles
+    by_id = {s.get(_qn("w:styleId")): s for s in defaults.element.iter(_qn("w:style"))}
+    styles = document.styles.element
+    existing = {s.get(_qn("w:styleId")) for s in styles.iter(_qn("w:style"))}
+    pending = [defaults[name].element.get(_qn("w:styleId")) for name in missing]
+    while pending:
+        style_id = pending.pop()
+        if style_id in existing or style_id not in by_id:
+            continue
+        element = by_id[style_id]
+        styles.append(copy.deepcopy(element))
+        existing.add(style_id)
+        for ref in ("w:basedOn", "w:link", "w:next"):
+            child = element.find(_qn(ref))
+            if child is not None:
+                pending.append(child.get(_qn("w:val")))
+
+
+def _cell_xml(text, width):
+    # Same markup as python-docx's cell.text setter: one run, "\n" -> w:br, "\t" -> w:tab
+    content = []
+    for line_number, line in enumerate(_INVALID_XML_CHARS.sub("", str(text)).split("\n")):
+        if line_number:
+            content.append("<w:br/>")
+        for chunk_number, chunk in enumerate(line.split("\t")):
+            if chunk_number:
+                content.append("<w:tab/>")
+            if chunk:
+                space = ' xml:space="preserve"' if chunk != chunk.strip() else ""
+                content.append(f"<w:t{space}>{escape(chunk)}</w:t>")
+    return (
+        f'<w:tc><w:tcPr><w:tcW w:type="dxa" w:w="{width}"/></w:tcPr>'
+        f'<w:p><w:r>{"".join(content)}</w:r></w:p></w:tc>'
+    )
+
+
+def add_table(document, rows, header=None, style="Table Grid", container=None):
+    """
+    Append a table of strings in one pass (instead of cell-by-cell python-docx calls).
+
+    Args:
+    - document (Document): The document (its styles and page width are used).
+    - rows (list[list]): Body rows; values are converted with str(), short rows are padded.
+    - header (list): Header row, written as the first row (optional).
+    - style (str): Table style name (None = the template's default table style).
+    - container: Where to append (default: the document body; a table cell also works).
+
+    Returns:
+    - docx.table.Table: The new table.
+    """
+    from docx.oxml import parse_xml
+    from docx.oxml.ns import nsdecls
+    from docx.table import Table
+
+    container = container if container is not None else document._body
+    all_rows = ([list(header)] if header is not None else []) + [list(row) for row in rows]
+    cols = max([len(row) for row in all_rows] + [1])
+    available = getattr(container, "width", None) or document._block_width
+    width = int(available // cols / 635)  # EMU -> twentieths of a point
+
+    parts = [f"<w:tbl {nsdecls('w')}><w:tblPr>"]
+    if style:
+        parts.append(f'<w:tblStyle w:val="{escape(document.styles[style].style_id)}"/>')
+    parts.append(
+        '<w:tblW w:type="auto" w:w="0"/><w:tblLook w:firstColumn="1" w:firstRow="1" w:lastColumn="0"'
+        ' w:lastRow="0" w:noHBand="0" w:noVBand="1" w:val="04A0"/></w:tblPr><w:tblGrid>'
+    )
+    parts.append(f'<w:gridCol w:w="{width}"/>' * cols)
+    parts.append("</w:tblGrid>")
+    for row in all_rows:
+        parts.append("<w:tr>")
+        parts.extend(_cell_xml(value, width) for value in row)
+        parts.append(_cell_xml("", width) * (cols - len(row)))
+        parts.append("</w:tr>")
+    parts.append("</w:tbl>")
+
+    tbl = parse_xml("".join(parts))
+    container._element._insert_tbl(tbl)
+    return Table(tbl, container)
+
+
+def _substitute_runs(p, render):
+    """
+    Replace the placeholders of paragraph element p, returning its new text. A placeholder
+    inside one run keeps that run's formatting; where Word split one across runs, the
+    paragraph's text is collapsed into its first run.
+    """
+    from docx.text.run import Run
+
+    runs = p.findall(_qn("w:r"))
+    texts = _run_texts(p)
+    starts, offset = [], 0
+    for text in texts:
+        starts.append(offset)
+        offset += len(text)
+    full = "".join(texts)
+
+    def run_of(position):
+        return bisect.bisect_right(starts, position) - 1
+
+    matches = list(PLACEHOLDER_RE.finditer(full))
+    if all(run_of(m.start()) == run_of(m.end() - 1) for m in matches):
+        for r, text in zip(runs, texts):
+            if "{" in text:
+                new_text = PLACEHOLDER_RE.sub(render, text)
+                if new_text != text:
+                    Run(r, None).text = new_text
+    elif runs:
+        Run(runs[0], None).text = PLACEHOLDER_RE.sub(render, full)
+        for r in runs[1:]:
+            p.remove(r)
+    return "".join(_run_texts(p))
+
+
+def _appended_blocks(body, count_before):
+    """Body children appended since the body had count_before children (the sectPr stays last)."""
+    children = list(body)
+    added = len(children) - count_before
+    if added <= 0:
+        return []
+    if children[-1].tag == _qn("w:sectPr"):
+        return children[-added - 1:-1]
+    return children[-added:]
+
+
+def render_template(document, index, renderers, context):
+    """
+    Fill a loaded template in place.
+
+    Args:
+    - document (Document): The template, loaded with python-docx; modified in place.
+    - index (TemplateIndex): Its index (see template_index).
+    - renderers (dict): {placeholder: renderer(context, document) -> replacement text}.
+      Placeholders without a renderer are left as they are.
+    - context (dict): Passed to every renderer.
+
+    Returns:
+    - int: Number of placeholders replaced.
+    """
+    body = document.element.body
+    parts = {str(part.partname): part for part in template_parts(document)}
+    # Resolve every location first: inserted blocks shift the paragraph numbering
+    targets = []
+    for partname, entries in index.locations.items():
+        part = parts.get(partname)
+        if part is None:
+            continue
+        paragraphs = list(part.element.iter(_qn("w:p")))
+        targets.extend(paragraphs[number] for number, _ in entries if number < len(paragraphs))
+
+    replaced = 0
+    for p in targets:
+        blocks = []
+
+        def render(match):
+            nonlocal replaced
+            renderer = renderers.get(match.group(0))
+            if renderer is None:
+                return match.group(0)
+            count_before = len(body)
+            text = renderer(context, document)
+            blocks.extend(_appended_blocks(body, count_before))
+            replaced += 1
+            return text
+
+        text = _substitute_runs(p, render)
+        anchor = p
+        for block in blocks:
+            anchor.addnext(block)
+            anchor = block
+        # A paragraph that only held a block placeholder is replaced by the blocks
+        if blocks and not text.strip():
+            parent = p.getparent()
+            parent.remove(p)
+            if parent.tag == _qn("w:tc") and parent[-1].tag != _qn("w:p"):
+                parent.append(copy.deepcopy(p))  # a table cell must end with a paragraph
+    return replaced
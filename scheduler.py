@@ -0,0 +1,155 @@
+"""
+Bounded fan-out for independent report sections.
+
+The GPT helpers spend nearly all their time waiting on the OpenAI API, so a thread pool
+is enough to overlap them: end-to-end latency approaches the slowest single call rather
+than the sum of all of them. Fan-outs nest (a section's task may fan out again), so the
+LLM_MAX_CONCURRENCY bound is not per pool: every API call takes a slot of one process-wide
+semaphore (llm_slot), however many pools are waiting on it.
+
+CPU-bound work (PDF parsing, OCR) instead goes to one shared, long-lived process pool.
+"""
+import contextlib
+import contextvars
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+DEFAULT_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+PROCESS_POOL_WORKERS = int(os.getenv("PROCESS_POOL_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+# Process-wide bound on API calls in flight (see llm_slot)
+_llm_slots = threading.BoundedSemaphore(DEFAULT_MAX_CONCURRENCY)
+
+
+@contextlib.contextmanager
+def llm_slot():
+    """
+    Hold one of the LLM_MAX_CONCURRENCY process-wide slots for the duration of one API call.
+
+    Only the request itself takes a slot, never a task that waits on other tasks, so nested
+    fan-outs can't deadlock on it.
+    """
+    with _llm_slots:
+        yield
+
+
+def run_concurrently(tasks, max_workers=DEFAULT_MAX_CONCURRENCY):
+    """
+    Run independent tasks at once with bounded concurrency.
+
+    max_workers bounds this call's threads only; API calls in flight are bounded across all
+    calls by llm_slot(). Tasks must not touch Streamlit (worker threads have no script context); callers
+    report errors themselves from the returned errors dict. Each task runs in a copy of
+    the caller's context, so context variables (e.g. the active trace run) carry over.
+
+    Args:
+    - tasks (dict): key -> (fn, args) or (fn, args, kwargs).
+    - max_workers (int): Upper bound on this call's worker threads.
+
+    Returns:
+    - tuple: (results, errors), two dicts keyed like tasks. A key appears in exactly one of them.
+    """
+    results = {}
+    errors = {}
+    if not tasks:
+        return results, errors
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(tasks)))) as pool:
+        futures = {}
+        for key, task in tasks.items():
+            fn, args = task[0], task[1]
+            kwargs = task[2] if len(task) > 2 else {}
+            futures[pool.submit(contextvars.copy_context().run, fn, *args, **kwargs)] = key
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                results[key] = future.result()
+            except Exception as e:
+                errors[key] = e
+    return results, errors
+
+
+def set_process_pool_workers(workers):
+    """
+    Resize the shared process pool (takes effect for the next pool created). 1 runs all
+    CPU-bound work inline, e.g. in processes that are already one of many parallel workers.
+    """
+    global PROCESS_POOL_WORKERS
+    reset_process_pool()
+    PROCESS_POOL_WORKERS = max(1, int(workers))
+
+
+def get_process_pool():
+    """Long-lived worker pool, created on first use (forkserver/spawn: safe from threaded servers)."""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            _process_pool = ProcessPoolExecutor(max_workers=PROCESS_POOL_WORKERS, mp_context=context)
+        return _process_pool
+
+
+def reset_process_pool():
+    """Drop the pool (e.g. after a worker died); the next get_process_pool() starts a fresh one."""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown(wait=False, cancel_futures=True)
+            _process_pool = None
+
+
+def map_in_processes(fn, items, use_pool=True):
+    """
+    fn(*item) for every item across the shared process pool, results in input order.
+
+    Falls back to running inline when the pool is not wanted or a worker dies. fn must be
+    a module-level function (it is pickled by name).
+
+    Args:
+    - fn (callable): The worker function.
+    - items (list): Argument tuples, one per call.
+    - use_pool (bool): False runs everything inline (e.g. for a single small item).
+
+    Returns:
+    - tuple: (results, errors). results is a list in input order (None where the call
+      failed); errors maps the index of each failed call to its exception.
+    """
+    results = [None] * len(items)
+    errors = {}
+
+    def _inline(indexes):
+        for index in indexes:
+            try:
+                results[index] = fn(*items[index])
+            except Exception as e:
+                errors[index] = e
+
+    if not use_pool or len(items) < 2 or PROCESS_POOL_WORKERS < 2:
+        _inline(range(len(items)))
+        return results, errors
+    try:
+        pool = get_process_pool()
+        futures = [pool.submit(fn, *item) for item in items]
+    except BrokenProcessPool:
+        reset_process_pool()
+        _inline(range(len(items)))
+        return results, errors
+    broken = []
+    for index, future in enumerate(futures):
+        try:
+            results[index] = future.result()
+        except BrokenProcessPool:
+            broken.append(index)
+        except Exception as e:
+            errors[index] = e
+    if broken:
+        # A worker died (or could not start): drop the pool and finish the rest inline
+        reset_process_pool()
+        _inline(broken)
+    return results, errors
@@ -0,0 +1,247 @@
+"""
+JSON schemas for every structured GPT extraction, and a small validator for them.
+
+logic.structured_completion() looks an extractor's schema up here by name, requests the
+answer in JSON mode, and validates it with validate(). When the answer doesn't parse or
+doesn't match, it makes one repair call that sends only the invalid output, the schema
+and the validation errors (not the source documents), instead of re-running the extraction.
+
+Schemas use a subset of JSON Schema: type (a name or a list of names), properties,
+required, items, additionalProperties (a schema for the values of other keys) and enum.
+That is all the extractors need, and checking it is a plain walk over the parsed answer.
+JSON mode only returns objects, so extractors that produce a list wrap it in one key
+(e.g. {"Plans": [...]}).
+"""
+import json
+
+# Errors reported per validation; enough for a repair prompt
+MAX_ERRORS = 20
+
+_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "number": (int, float),
+    "integer": int,
+    "boolean": bool,
+    "null": type(None),
+}
+
+STRING = {"type": "string"}
+# Amounts and ages sometimes come back as numbers, sometimes as "£1,234.00"
+AMOUNT = {"type": ["number", "string"]}
+STRINGS = {"type": "array", "items": STRING}
+
+
+def _object(properties, required=(), **extra):
+    return {"type": "object", "properties": properties, "required": list(required), **extra}
+
+
+CLIENT_DETAILS = _object(
+    {"Full name": STRING, "Address": STRING, "salutation": STRING},
+    required=("Full name", "Address", "salutation"),
+)
+
+FACTFIND_DIGEST = _object(
+    {
+        "client_details": CLIENT_DETAILS,
+        "household": {"type": "object"},
+        "property": {"type": "object"},
+        "debts": {"type": "object"},
+        "dependents": {"type": "array", "items": {"type": "object"}},
+        "current_situation": STRINGS,
+        "objectives": STRINGS,
+    },
+    required=("client_details", "household", "property", "debts", "dependents", "current_situation", "objectives"),
+)
+
+PLAN_DETAILS = _object(
+    {
+        "Plans": {
+            "type": "array",
+            "items": _object(
+                {"Provider": STRING, "Plan Number": AMOUNT, "Plan Type": STRING, "Current Value": AMOUNT},
+                required=("Provider", "Plan Number", "Plan Type", "Current Value"),
+            ),
+        }
+    },
+    required=("Plans",),
+)
+
+PORTFOLIO = _object(
+    {
+        "PortfolioTotal": AMOUNT,
+        "Holdings": {
+            "type": "array",
+            "items": _object({"Fund": STRING, "Value": AMOUNT, "Percent": AMOUNT}, required=("Fund", "Value")),
+        },
+    },
+    required=("PortfolioTotal", "Holdings"),
+)
+
+PERFORMANCE_PERIODS = ("Year 1", "Year 2", "Year 3", "Year 4", "Year 5", "Cumulative (5 YR)")
+
+FUND_PERFORMANCE = _object(
+    {
+        "Funds": {
+            "type": "array",
+            "items": _object(
+                {
+                    "Fund": STRING,
+                    "ISIN": STRING,
+                    **{period: STRING for period in PERFORMANCE_PERIODS},
+                    "Benchmark": _object({period: STRING for period in PERFORMANCE_PERIODS}),
+                },
+                required=("Fund",) + PERFORMANCE_PERIODS,
+            ),
+        }
+    },
+    required=("Funds",),
+)
+
+SAP_COMPARISON = _object(
+    {"Age": AMOUNT, "companyName": STRING, "Table": {"type": "object", "additionalProperties": STRINGS}},
+    required=("Age", "companyName", "Table"),
+)
+
+ANNUITY_QUOTES = _object(
+    {
+        "Quotes": {
+            "type": "array",
+            "items": _object(
+                {
+                    "Purchase Amount": STRING,
+                    "Monthly Amount": STRING,
+                    "Yearly Amount": STRING,
+                    "Yearly Increase": STRING,
+                },
+                required=("Purchase Amount", "Monthly Amount", "Yearly Amount", "Yearly Increase"),
+            ),
+        }
+    },
+    required=("Quotes",),
+)
+
+FEE_METRICS = _object(
+    {
+        name: STRING for name in (
+            "Provider", "Plan Value", "Weighted Fund Charge", "Platform Charge", "Ongoing Advice Fee",
+            "Discretionary Fund Manager Charge", "Drawdown Fee", "ProfitShare",
+        )
+    },
+    required=("Provider",),
+)
+
+# Extractor name -> schema of its answer
+SCHEMAS = {
+    "client_details": CLIENT_DETAILS,
+    "factfind_digest": FACTFIND_DIGEST,
+    "plan_details": PLAN_DETAILS,
+    "portfolio": PORTFOLIO,
+    "fund_performance": FUND_PERFORMANCE,
+    "sap_comparison": SAP_COMPARISON,
+    "annuity_quotes": ANNUITY_QUOTES,
+    "fee_metrics": FEE_METRICS,
+}
+
+
+def get_schema(name):
+    """The registered schema called name (KeyError if there is none)."""
+    return SCHEMAS[name]
+
+
+def _type_names(schema):
+    names = schema.get("type")
+    if names is None:
+        return ()
+    return (names,) if isinstance(names, str) else tuple(names)
+
+
+def _matches_type(value, type_name):
+    if isinstance(value, bool) and type_name in ("number", "integer"):
+        return False  # bool is an int subclass, but never a valid amount
+    return isinstance(value, _TYPES[type_name])
+
+
+def _check(value, schema, path, errors):
+    if len(errors) >= MAX_ERRORS:
+        return
+    type_names = _type_names(schema)
+    if type_names and not any(_matches_type(value, name) for name in type_names):
+        errors.append(f"{path}: expected {' or '.join(type_names)}, got {type(value).__name__}")
+        return
+    if "enum" in schema and value not in schema["enum"]:
+        errors.append(f"{path}: {value!r} is not one of {schema['enum']!r}")
+    if isinstance(value, dict):
+        properties = schema.get("properties", {})
+        for key in schema.get("required", ()):
+            if key not in value:
+                errors.append(f"{path}: missing required key {key!r}")
+        extra = schema.get("additionalProperties")
+        for key, item in value.items():
+            if key in properties:
+                _check(item, properties[key], f"{path}.{key}", errors)
+            elif isinstance(extra, dict):
+                _check(item, extra, f"{path}.{key}", errors)
+    elif isinstance(value, list) and "items" in schema:
+        for idx, item in enumerate(value):
+            _check(item, schema["items"], f"{path}[{idx}]", errors)
+
+
+def validate(data, schema):
+    """
+    Check parsed JSON against a schema.
+
+    Args:
+    - data: The parsed answer.
+    - schema (dict or str): A schema, or the name of a registered one.
+
+    Returns:
+    - list[str]: Validation errors with JSON paths (empty when valid), at most MAX_ERRORS.
+    """
+    if isinstance(schema, str):
+        schema = get_schema(schema)
+    errors = []
+    _check(data, schema, "$", errors)
+    return errors
+
+
+def parse_and_validate(raw_content, schema):
+    """
+    Parse a model answer (tolerating code fences) and validate it.
+
+    Returns:
+    - tuple: (data or None, list of errors). data is None when the answer isn't valid JSON.
+    """
+    cleaned = raw_content.strip()
+    if cleaned.startswith("```"):
+        cleaned = cleaned.split("\n", 1)[1] if "\n" in cleaned else ""
+        cleaned = cleaned.rsplit("```", 1)[0]
+    try:
+        data = json.loads(cleaned)
+    except json.JSONDecodeError as e:
+        return None, [f"not valid JSON: {e}"]
+    return data, validate(data, schema)
+
+
+def repair_prompt(raw_content, schema, errors):
+    """Prompt asking the model to fix an invalid answer; the source document is not resent."""
+    if isinstance(schema, str):
+        schema = get_schema(schema)
+    error_lines = "\n".join(f"- {error}" for error in errors)
+    return f"""
+The JSON below was extracted from a document but does not match the required schema.
+Fix ONLY the listed problems: keep every value that is already correct, do not invent data
+(use "" or "N/A" for values that are missing) and keep the same keys.
+
+Problems:
+{error_lines}
+
+Required JSON Schema:
+{json.dumps(schema, ensure_ascii=False)}
+
+JSON to fix:
+{raw_content}
+
+Return ONLY the corrected JSON object.
+"""
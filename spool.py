@@ -0,0 +1,205 @@
+"""
+In-memory file sources and a content-addressed spool for the copies that must be on disk.
+
+Streamlit keeps uploads in memory, and the extractors in logic.py read them from there:
+a "source" is a local path, bytes, a memoryview or a binary file object (an
+UploadedFile). as_readable() wraps an in-memory source in a BufferReader, which reads
+the upload's own buffer without copying it.
+
+A disk copy is only needed when another process has to open the file: the job workers
+(app.py) and the PDF page pool (pdf_text.py). Spool.path() writes such a copy once per
+distinct content, under <spool>/<sha256>/<file name>. Asking again for the same upload
+(or the same file uploaded twice) reuses the copy, and identical file names from
+different sessions never collide. Each Streamlit session gets its own spool folder
+(session_spool); everything else shares default_spool(). purge_spools() removes copies
+not used for a while.
+
+Kept free of third-party imports: PDF pool workers import it on start-up.
+"""
+import hashlib
+import io
+import os
+import threading
+import time
+import uuid
+
+SPOOL_DIR = os.getenv("SPOOL_DIR", os.path.join("cache", "spool"))
+SHARED_SPOOL = "shared"
+
+
+def is_path(source):
+    return isinstance(source, (str, os.PathLike))
+
+
+def as_buffer(source):
+    """
+    The bytes of an in-memory source as a memoryview, without copying where possible.
+    Returns None for a path.
+
+    Raises:
+    - TypeError: for anything that is neither a path nor bytes-like nor a binary file object.
+    """
+    if is_path(source):
+        return None
+    if isinstance(source, memoryview):
+        return source.cast("B") if source.format != "B" or source.ndim != 1 else source
+    if isinstance(source, (bytes, bytearray)):
+        return memoryview(source)
+    if hasattr(source, "getbuffer"):  # io.BytesIO, Streamlit's UploadedFile
+        return source.getbuffer()
+    if hasattr(source, "read"):
+        source.seek(0)
+        return memoryview(source.read())
+    raise TypeError(f"Cannot read a file from {type(source).__name__}")
+
+
+def source_name(source, name=None):
+    """File name of a source: name if given, else the path's or upload's name ("" if unknown)."""
+    if name:
+        return name
+    if is_path(source):
+        return os.path.basename(os.fspath(source))
+    return os.path.basename(str(getattr(source, "name", "") or ""))
+
+
+def source_size(source):
+    """Size in bytes of a source."""
+    if is_path(source):
+        return os.path.getsize(source)
+    return as_buffer(source).nbytes
+
+
+def content_sha256(source):
+    """Content hash of a source (a file on disk is read in chunks)."""
+    buffer = as_buffer(source)
+    if buffer is not None:
+        return hashlib.sha256(buffer).hexdigest()
+    digest = hashlib.sha256()
+    with open(source, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BufferReader(io.RawIOBase):
+    """Read-only, seekable binary stream over a memoryview; the buffer itself is never copied."""
+
+    def __init__(self, buffer, name=""):
+        super().__init__()
+        self._buffer = buffer
+        self._position = 0
+        self.name = name
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = len(self._buffer) + offset
+        else:
+            raise ValueError(f"Invalid whence {whence}")
+        if position < 0:
+            raise ValueError("Negative seek position")
+        self._position = position
+        return position
+
+    def readinto(self, target):
+        chunk = self._buffer[self._position:self._position + len(target)]
+        size = len(chunk)
+        target[:size] = chunk
+        self._position += size
+        return size
+
+    def readall(self):
+        data = bytes(self._buffer[self._position:])
+        self._position = len(self._buffer)
+        return data
+
+
+def as_readable(source):
+    """What file-opening libraries (PIL, pdfplumber, zipfile) accept: the path itself, or a BufferReader."""
+    if is_path(source):
+        return os.fspath(source)
+    return BufferReader(as_buffer(source), source_name(source))
+
+
+def open_binary(source):
+    """A binary file object for a source (use as a context manager)."""
+    if is_path(source):
+        return open(source, "rb")
+    return BufferReader(as_buffer(source), source_name(source))
+
+
+class Spool:
+    """Folder of on-disk copies of in-memory sources, one per distinct content and name."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, source, name=None):
+        """
+        Local path of a source: a path is returned as is; bytes and uploads are written
+        to <root>/<sha256>/<name> unless that copy already exists.
+        """
+        if is_path(source):
+            return os.fspath(source)
+        buffer = as_buffer(source)
+        file_name = os.path.basename(source_name(source, name)) or "upload"
+        folder = os.path.join(self.root, hashlib.sha256(buffer).hexdigest())
+        path = os.path.join(folder, file_name)
+        if os.path.exists(path):
+            os.utime(path)  # in use again: keep it out of purge_spools
+            return path
+        os.makedirs(folder, exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(buffer)
+        os.replace(temp_path, path)
+        return path
+
+    def paths(self, sources):
+        return [self.path(source) for source in (sources or [])]
+
+
+def session_spool(session_id=None, root=None):
+    """The spool of one user session (a new session id when none is given)."""
+    return Spool(os.path.join(root or SPOOL_DIR, session_id or uuid.uuid4().hex))
+
+
+def default_spool():
+    """The spool shared by everything that is not a user session (e.g. the PDF page pool)."""
+    return Spool(os.path.join(SPOOL_DIR, SHARED_SPOOL))
+
+
+def purge_spools(max_age_seconds, root=None):
+    """Delete spooled copies not written or reused for max_age_seconds, and emptied folders."""
+    root = root or SPOOL_DIR
+    if not os.path.isdir(root):
+        return 0
+    cutoff = time.time() - max_age_seconds
+    removed = 0
+    for directory, _, files in os.walk(root, topdown=False):
+        for file_name in files:
+            path = os.path.join(directory, file_name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                pass  # removed concurrently
+        if directory != root:
+            try:
+                os.rmdir(directory)  # only succeeds once empty
+            except OSError:
+                pass
+    return removed
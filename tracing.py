@@ -0,0 +1,279 @@
+"""
+Per-call tracing of report runs: wall time, tokens, bytes, cache hits and errors.
+
+A report run (pipeline.generate_report) opens a trace_run(); every span recorded while it
+is active, in this thread or in scheduler.run_concurrently workers (the context is copied
+into them), lands in that run with its run id. Spans are plain dicts:
+
+    {"run_id", "kind", "name", "stage", "start", "seconds", "error",
+     "bytes_in", "prompt_tokens", "completion_tokens", "cache"}
+
+kind is one of "stage" (a pipeline stage, see StageRunner), "extract" (one file's text),
+"ocr" (a batch of images), "llm" (one chat completion; name is the helper's prompt-version
+tag without the version, cache is "hit" or "miss") and "document" (create_new_document).
+stage is the pipeline stage the call ran under.
+
+Outside a run, span() costs a dict and two clock reads, and nothing is kept.
+
+Export with write_jsonl() (one span per line, appendable across runs) and prometheus_text()
+(summaries with p50/p95 per span, token/cache/byte/error counters). From the command line:
+
+    python tracing.py traces.jsonl [more.jsonl ...] [--format prometheus|summary]
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from spool import source_size
+
+# Append every finished run's spans here (empty = don't write)
+TRACE_PATH = os.getenv("TRACE_PATH", "")
+METRIC_PREFIX = "report"
+QUANTILES = (0.5, 0.95)
+
+_current_run = ContextVar("trace_run", default=None)
+_current_stage = ContextVar("trace_stage", default=None)
+
+
+class TraceRun:
+    """The spans of one report run."""
+
+    def __init__(self, name="", run_id=None):
+        self.run_id = run_id or uuid.uuid4().hex
+        self.name = name
+        self.started_at = time.time()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, record):
+        with self._lock:
+            self.spans.append(record)
+
+    def summary(self):
+        """Per-span aggregates of this run, see summarise()."""
+        with self._lock:
+            spans = list(self.spans)
+        return summarise(spans)
+
+
+@contextmanager
+def trace_run(name="", run_id=None, path=None):
+    """
+    Collect the spans recorded inside the block into a new TraceRun (yielded).
+
+    Args:
+    - name (str): Label of the run, e.g. the case name.
+    - run_id (str): Id to use (default: a new uuid).
+    - path (str): JSON-lines file the spans are appended to at the end (default: TRACE_PATH).
+    """
+    run = TraceRun(name, run_id)
+    token = _current_run.set(run)
+    try:
+        yield run
+    finally:
+        _current_run.reset(token)
+        path = path if path is not None else TRACE_PATH
+        if path:
+            write_jsonl(run.spans, path)
+
+
+def current_run():
+    """The active TraceRun, or None outside trace_run()."""
+    return _current_run.get()
+
+
+@contextmanager
+def span(kind, name, **attrs):
+    """
+    Time the block as one span of the active run. Yields the span dict so the block can
+    add fields (tokens, cache, bytes_in). An exception is recorded and re-raised.
+    Spans of kind "stage" also become the stage of every span opened inside them.
+    """
+    run = _current_run.get()
+    record = {"kind": kind, "name": name, "stage": _current_stage.get(), **attrs}
+    stage_token = _current_stage.set(name) if kind == "stage" else None
+    record["start"] = time.time()
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        record["error"] = repr(e)
+        raise
+    finally:
+        record["seconds"] = time.perf_counter() - start
+        if stage_token is not None:
+            _current_stage.reset(stage_token)
+        if run is not None:
+            record["run_id"] = run.run_id
+            run.add(record)
+
+
+def traced(kind, name=None, bytes_in=None):
+    """
+    Decorator: record every call of the function as a span.
+
+    Args:
+    - kind (str): Span kind.
+    - name (str): Span name (default: the function name).
+    - bytes_in (callable): Given the call's arguments, returns the input size in bytes.
+    """
+    def decorate(fn):
+        span_name = name or fn.__name__
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            attrs = {}
+            if bytes_in is not None and _current_run.get() is not None:
+                try:
+                    attrs["bytes_in"] = bytes_in(*args, **kwargs)
+                except Exception:
+                    pass  # size is best effort (e.g. a file that doesn't exist; the call reports that)
+            with span(kind, span_name, **attrs):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def file_sizes(*paths):
+    """bytes_in helper: total size of the given file paths or in-memory files (lists are flattened)."""
+    total = 0
+    for path in paths:
+        for p in (path if isinstance(path, (list, tuple)) else [path]):
+            total += source_size(p)
+    return total
+
+
+# ---- Aggregation and export ------------------------------------------------
+
+
+def _percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarise(spans):
+    """
+    Aggregate spans per (kind, name).
+
+    Returns:
+    - dict: {"kind:name": {"kind", "name", "count", "errors", "seconds_sum", "p50", "p95", "max",
+      "bytes_in", "prompt_tokens", "completion_tokens", "cache_hits", "cache_misses"}}
+    """
+    groups = {}
+    for record in spans:
+        groups.setdefault((record["kind"], record["name"]), []).append(record)
+    summary = {}
+    for (kind, name), records in sorted(groups.items()):
+        seconds = sorted(r["seconds"] for r in records)
+        summary[f"{kind}:{name}"] = {
+            "kind": kind,
+            "name": name,
+            "count": len(records),
+            "errors": sum(1 for r in records if r.get("error")),
+            "seconds_sum": round(sum(seconds), 4),
+            "p50": round(_percentile(seconds, 0.50), 4),
+            "p95": round(_percentile(seconds, 0.95), 4),
+            "max": round(seconds[-1], 4),
+            "bytes_in": sum(r.get("bytes_in") or 0 for r in records),
+            "prompt_tokens": sum(r.get("prompt_tokens") or 0 for r in records),
+            "completion_tokens": sum(r.get("completion_tokens") or 0 for r in records),
+            "cache_hits": sum(1 for r in records if r.get("cache") == "hit"),
+            "cache_misses": sum(1 for r in records if r.get("cache") == "miss"),
+        }
+    return summary
+
+
+def write_jsonl(spans, path):
+    """Append spans to a JSON-lines file, one span per line."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        for record in spans:
+            f.write(json.dumps(record, default=str) + "\n")
+
+
+def read_jsonl(*paths):
+    """Spans from one or more JSON-lines files."""
+    spans = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            spans.extend(json.loads(line) for line in f if line.strip())
+    return spans
+
+
+def _label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels):
+    return "{" + ",".join(f'{key}="{_label_value(value)}"' for key, value in labels.items()) + "}"
+
+
+def prometheus_text(spans, prefix=METRIC_PREFIX):
+    """
+    Prometheus text exposition of the spans: a summary of span seconds (p50/p95) per span,
+    plus counters for errors, input bytes, LLM tokens and cache lookups.
+    """
+    summary = summarise(spans)
+    lines = [
+        f"# HELP {prefix}_span_seconds Wall time of traced calls.",
+        f"# TYPE {prefix}_span_seconds summary",
+    ]
+    for item in summary.values():
+        labels = {"kind": item["kind"], "name": item["name"]}
+        for quantile in QUANTILES:
+            value = item["p50"] if quantile == 0.5 else item["p95"]
+            lines.append(f"{prefix}_span_seconds{_labels(**labels, quantile=quantile)} {value}")
+        lines.append(f"{prefix}_span_seconds_sum{_labels(**labels)} {item['seconds_sum']}")
+        lines.append(f"{prefix}_span_seconds_count{_labels(**labels)} {item['count']}")
+
+    counters = (
+        ("span_errors_total", "Traced calls that raised.", lambda item: [({}, item["errors"])]),
+        ("bytes_in_total", "Input bytes of traced calls.", lambda item: [({}, item["bytes_in"])]),
+        ("llm_tokens_total", "Tokens used by chat completions.", lambda item: [
+            ({"type": "prompt"}, item["prompt_tokens"]), ({"type": "completion"}, item["completion_tokens"]),
+        ] if item["kind"] == "llm" else []),
+        ("llm_cache_lookups_total", "Response cache lookups.", lambda item: [
+            ({"result": "hit"}, item["cache_hits"]), ({"result": "miss"}, item["cache_misses"]),
+        ] if item["kind"] == "llm" else []),
+    )
+    for metric, help_text, values in counters:
+        lines.append(f"# HELP {prefix}_{metric} {help_text}")
+        lines.append(f"# TYPE {prefix}_{metric} counter")
+        for item in summary.values():
+            for extra, value in values(item):
+                labels = _labels(kind=item["kind"], name=item["name"], **extra)
+                lines.append(f"{prefix}_{metric}{labels} {value}")
+
+    runs = len({record.get("run_id") for record in spans})
+    lines += [
+        f"# HELP {prefix}_runs_total Report runs traced.",
+        f"# TYPE {prefix}_runs_total counter",
+        f"{prefix}_runs_total {runs}",
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="JSON-lines trace files")
+    parser.add_argument("--format", choices=("summary", "prometheus"), default="summary")
+    args = parser.parse_args(argv)
+
+    spans = read_jsonl(*args.paths)
+    if args.format == "prometheus":
+        sys.stdout.write(prometheus_text(spans))
+    else:
+        print(json.dumps(summarise(spans), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())